@@ -36,6 +36,7 @@ parser.add_argument("--min_nAUC_to_beConsideredGrowing", dest="min_nAUC_to_beCon
 parser.add_argument("--hours_experiment", dest="hours_experiment", required=False, type=float, default=24.0, help="A float that indicates the total experiment hours that are used to calculate the fitness estimates.")
 parser.add_argument("--enhance_image_contrast", dest="enhance_image_contrast", required=False,  type=str, default='True', help="True/False. Enhances contrast of images. Only for developers.")
 parser.add_argument("--auto_accept", dest="auto_accept", required=False, default=False, action="store_true", help="Automatically accepts all the coordinates and bad spots. Only for developers.")
+parser.add_argument("--headless", dest="headless", required=False, default=False, action="store_true", help="Run without any window (i.e. on a server without display), and without the tk libraries. It requires --auto_accept, and --automatic_coordinates or --scanner_profiles (the run fails if the coordinates of a plate can't be obtained automatically). Only for developers.")
 parser.add_argument("--previous_output", dest="previous_output", required=False, default=None, help="Full path to the output directory of a previous Q-PHAST run. This will be used to re-use its growth measurements.")
 
 # developer args 
@@ -44,8 +45,26 @@ parser.add_argument("--replace", dest="replace", required=False, default=False,
 parser.add_argument("--reference_plate", dest="reference_plate", required=False,  type=str, default=None, help="The plate to take as reference. It should be a plate with high growth in many spots. For example 'SC1-plate1' could be passed to this argument. Only for developers.")
 parser.add_argument("--break_after", dest="break_after", required=False, type=str, default=None, help="Break after some steps. Only for developers.")
 parser.add_argument("--coords_1st_plate", dest="coords_1st_plate", required=False, default=False, action="store_true", help="Automatically transfers the coordinates of the 1st plate. Only for developers.")
-parser.add_argument("--contrast_enhancement_image", dest="contrast_enhancement_image", required=False,  type=str, default='auto', help="The plate to take as reference for contrast correction. It can be 'image_high_contrast' or 'auto'. Our testing suggests that 'auto' is better. Only for developers.")
+parser.add_argument("--automatic_coordinates", dest="automatic_coordinates", required=False, default=False, action="store_true", help="Detect the grid of spots in the latest image of each plate, and only ask for the coordinates of the plates where the grid is not clear (the confidence is below --automatic_coordinates_min_confidence). The coordinates are still validated. Only for developers.")
+parser.add_argument("--automatic_coordinates_min_confidence", dest="automatic_coordinates_min_confidence", required=False, type=float, default=0.8, help="With --automatic_coordinates or --scanner_profiles, the minimum confidence (0-1) of the detected (or stored) grid to skip the manual coordinates. Only for developers.")
+parser.add_argument("--scanner_profiles", dest="scanner_profiles", required=False, default=False, action="store_true", help="Save the coordinates of each plate validated in the GUI (not those accepted with --auto_accept) in <cache_dir>/scanner_profiles.json (by plate batch, plate and image size), and re-use them in later runs when they fit the spots of the latest image (checked automatically). The coordinates are still validated. Only for developers.")
+parser.add_argument("--contrast_enhancement_image", dest="contrast_enhancement_image", required=False,  type=str, default='auto', help="The plate to take as reference for contrast correction. It can be 'image_high_contrast' or 'auto'. Our testing suggests that 'auto' is better. It can also be 'global_histogram' (only with '--image_engine numpy'), which stretches the contrast of all images with the same LUT, based on the histogram of all images. Only for developers.")
+parser.add_argument("--global_histogram_pixel_stride", dest="global_histogram_pixel_stride", required=False, type=int, default=1, help="With '--contrast_enhancement_image global_histogram', build the histogram with one every <global_histogram_pixel_stride> rows and columns of each image. Only for developers.")
+parser.add_argument("--cache_dir", dest="cache_dir", required=False, type=str, default=None, help="A folder to store files that can be re-used across runs (i.e. the synthetic images for contrast enhancement). By default it is <home>/.Q-PHAST_cache. Only for developers.")
+parser.add_argument("--artifact_cache", dest="artifact_cache", required=False, default=False, action="store_true", help="Save the processed images of each plate, the colonyzer outputs and the fitness calculations in --cache_dir, identified by the hash of their inputs and parameters. Later runs (also in other output folders) re-use them, and only re-calculate what changed. Only for developers.")
+parser.add_argument("--reduced_inputs_compression", dest="reduced_inputs_compression", required=False, type=str, default="stored", help="The compression of <output>/extended_outputs/reduced_input_dir.zip (the plate layout and 4 images per plate batch, to reproduce the run). It can be 'stored' (fast, bigger file) or 'deflated' (slower, smaller file).")
+parser.add_argument("--parallel_colonyzer_timepoints", dest="parallel_colonyzer_timepoints", required=False, default=False, action="store_true", help="When there are less plates than cpus, split the timepoints of each plate across the free cpus to run colonyzer (the growth measurements are the same). Only for developers.")
+parser.add_argument("--quantification_engine", dest="quantification_engine", required=False, type=str, default="colonyzer", help="The engine that quantifies the spots of each image. It can be 'colonyzer' (default) or 'native', a numpy implementation of colonyzer that writes the same data files without plots, and only implements the parameters lc and diffims (it should be run with i.e. --parms_colonyzer lc,diffims, because it does not detect lids with greenlab). With --reference_plate, it appends the reference image in memory, without writing the merged images that colonyzer needs. Run 'testing/testing_subsets/testing_script.py compare_quantification_engines' to check the agreement with colonyzer before using it. Only for developers.")
+parser.add_argument("--fitting_engine", dest="fitting_engine", required=False, type=str, default="qfa", help="The engine that fits the growth curves in step 3. It can be 'qfa' (default, the R package) or 'numpy', a batched fit of the same logistic model that does not start R for each plate. The numpy fits are close, but not identical, to those of qfa. Run 'testing/compare_fitting_engines.py' on the output of a run with qfa to check the agreement before using it. Only for developers.")
+parser.add_argument("--lazy_colonyzer_plots", dest="lazy_colonyzer_plots", required=False, default=False, action="store_true", help="In the growth measurements (step 3), colonyzer only renders the diagnostic images (Output_Images) of the latest image of each plate, which is the one that is displayed, and no pdf reports. The growth measurements are the same. Only for developers.")
+parser.add_argument("--follow", dest="follow", required=False, default=False, action="store_true", help="Analyze the images as the scanners generate them. Q-PHAST waits until there are 2 images for each plate batch, asks for the coordinates, and then processes and gets the growth of each new image (against the first one) until the images cover --hours_experiment. The growth of each new image is only a preview, since colonyzer gets the threshold of the spots from each (first, new) pair of images. Once the images cover --hours_experiment, colonyzer runs on the full time series of each plate, so that the fitness calculations and reports are the same as in a run without --follow. It requires '--image_engine numpy' and '--contrast_enhancement_image auto'.")
+parser.add_argument("--follow_poll_seconds", dest="follow_poll_seconds", required=False, type=int, default=60, help="With --follow, the seconds between checks for new images. Images that were modified in the last <follow_poll_seconds> are not analyzed yet.")
+parser.add_argument("--follow_timeout_hours", dest="follow_timeout_hours", required=False, type=float, default=2.0, help="With --follow, the experiment is considered finished if there are no new images in <follow_timeout_hours>.")
 parser.add_argument("--parms_colonyzer", dest="parms_colonyzer", required=False,  type=str, default="greenlab,lc,diffims", help="Set of extra parameters to pass to colonyzer as --<parm>.")
+parser.add_argument("--image_engine", dest="image_engine", required=False,  type=str, default="imagej", help="The engine used to flip, rotate and enhance the contrast of the images in step 1. It can be 'imagej' (a headless Fiji macro) or 'numpy' (an in-process reimplementation of the same operations). Only for developers.")
+parser.add_argument("--concurrent_batches", dest="concurrent_batches", required=False, default=False, action="store_true", help="Process several plate batches at the same time in step 1. The number of concurrent batches is limited by the available memory and the size of the images. Only for developers.")
+parser.add_argument("--fused_image_pipeline", dest="fused_image_pipeline", required=False, default=False, action="store_true", help="In step 1, decode each raw image once and write the cropped plates directly, without the intermediate full-size processed images. It requires '--image_engine numpy'. Only for developers.")
+parser.add_argument("--keep_processed_images", dest="keep_processed_images", required=False, default=False, action="store_true", help="With --fused_image_pipeline, also write the full-size processed images (<output>/tmp/processed_images). Only for developers.")
 
 
 # parse
@@ -54,6 +73,9 @@ opt = parser.parse_args()
 # pass the opt to functions
 fun.opt = opt
 
+# import the libraries of the windows
+if opt.headless is False: fun.import_GUI_libraries()
+
 # log
 print("\n")
 fun.print_with_runtime("Running Q-PHAST...")
@@ -99,6 +121,11 @@ start_time = time.time()
 
 ######  DEBUG INPUTS #########
 
+# check the headless mode, which can't show any window
+if opt.headless is True:
+    if opt.auto_accept is False: raise ValueError("--headless requires --auto_accept")
+    if opt.automatic_coordinates is False and opt.scanner_profiles is False: raise ValueError("--headless requires --automatic_coordinates or --scanner_profiles")
+
 # check that the mandatory args are not none
 if opt.docker_image is None: raise ValueError("You should provide a string in --docker_image")
 if opt.input is None: raise ValueError("You should provide a string in --input")
@@ -107,13 +134,32 @@ if opt.output is None: raise ValueError("You should provide a string in --output
 opt.input = fun.get_fullpath(opt.input)
 opt.output = fun.get_fullpath(opt.output)
 if not os.path.isdir(opt.input): raise ValueError("The folder provided in --input does not exist")
-if opt.contrast_enhancement_image not in {"image_high_contrast", "auto"}: raise ValueError("contrast_enhancement_image should be 'image_high_contrast' or 'auto'")
+if opt.cache_dir is None: opt.cache_dir = "%s%s.%s_cache"%(os.path.expanduser("~"), fun.get_os_sep(), fun.pipeline_name)
+opt.cache_dir = fun.get_fullpath(opt.cache_dir)
+fun.make_folder(opt.cache_dir)
+if opt.contrast_enhancement_image not in {"image_high_contrast", "auto", "global_histogram"}: raise ValueError("contrast_enhancement_image should be 'image_high_contrast', 'auto' or 'global_histogram'")
+if opt.contrast_enhancement_image=="global_histogram" and opt.image_engine!="numpy": raise ValueError("--contrast_enhancement_image global_histogram requires --image_engine numpy")
+if opt.global_histogram_pixel_stride<1: raise ValueError("--global_histogram_pixel_stride should be >=1")
+if opt.automatic_coordinates_min_confidence<0 or opt.automatic_coordinates_min_confidence>1: raise ValueError("--automatic_coordinates_min_confidence should be between 0 and 1")
+if opt.quantification_engine not in {"colonyzer", "native"}: raise ValueError("--quantification_engine should be 'colonyzer' or 'native'")
+if opt.quantification_engine=="native" and opt.follow is True: raise ValueError("--quantification_engine native can't be used with --follow")
+if opt.fitting_engine not in {"qfa", "numpy"}: raise ValueError("--fitting_engine should be 'qfa' or 'numpy'")
+if opt.reduced_inputs_compression not in {"stored", "deflated"}: raise ValueError("--reduced_inputs_compression should be 'stored' or 'deflated'")
+if opt.image_engine not in {"imagej", "numpy"}: raise ValueError("image_engine should be 'imagej' or 'numpy'")
+if opt.fused_image_pipeline is True and opt.image_engine!="numpy": raise ValueError("--fused_image_pipeline requires --image_engine numpy")
+if opt.follow is True:
+    if opt.image_engine!="numpy": raise ValueError("--follow requires --image_engine numpy")
+    if opt.contrast_enhancement_image!="auto" and opt.enhance_image_contrast=="True": raise ValueError("--follow requires --contrast_enhancement_image auto, so that the processing of each image does not depend on the images to come")
+    if opt.reference_plate is not None: raise ValueError("--follow can't be used with --reference_plate")
+    if opt.previous_output is not None: raise ValueError("--follow can't be used with --previous_output")
+    if opt.follow_poll_seconds<1: raise ValueError("--follow_poll_seconds should be >=1")
 
 # check parms colonyzer
 set_parms = set(opt.parms_colonyzer.split(","))
 strange_parms = set_parms.difference({"greenlab", "lc", "diffims", "cut", "edgemask", "none"})
 if len(strange_parms)>0: raise ValueError("strange values passed to --parms_colonyzer: %s"%strange_parms)
 if "none" in set_parms and len(set_parms)!=1: raise ValueError("if you specify none to --parms_colonyzer, there can't  be anything else")
+if opt.quantification_engine=="native" and len(set_parms.difference({"lc", "diffims", "none"}))>0: raise ValueError("--quantification_engine native only implements the --parms_colonyzer lc and diffims, and it can't be used with %s"%(set_parms.difference({"lc", "diffims", "none"})))
 
 # deifine the parms colonyzer
 fun.parms_colonyzer = tuple(sorted(set_parms))
@@ -128,8 +174,12 @@ if not opt.os in {"linux", "mac", "windows"}: raise ValueError("--os should have
 fun.print_with_runtime("Writing results into the output folder '%s', using input files from '%s'"%(opt.output, opt.input))
 
 # print the cmd
-arguments = " ".join(["--%s %s"%(arg_name, arg_val) for arg_name, arg_val in [("os", opt.os), ("input", opt.input), ("output", opt.output), ("docker_image", opt.docker_image), ("min_nAUC_to_beConsideredGrowing", opt.min_nAUC_to_beConsideredGrowing), ("hours_experiment", opt.hours_experiment), ("enhance_image_contrast", opt.enhance_image_contrast), ("parms_colonyzer", opt.parms_colonyzer)]])
+arguments = " ".join(["--%s %s"%(arg_name, arg_val) for arg_name, arg_val in [("os", opt.os), ("input", opt.input), ("output", opt.output), ("docker_image", opt.docker_image), ("min_nAUC_to_beConsideredGrowing", opt.min_nAUC_to_beConsideredGrowing), ("hours_experiment", opt.hours_experiment), ("enhance_image_contrast", opt.enhance_image_contrast), ("parms_colonyzer", opt.parms_colonyzer), ("image_engine", opt.image_engine), ("contrast_enhancement_image", opt.contrast_enhancement_image), ("global_histogram_pixel_stride", opt.global_histogram_pixel_stride), ("quantification_engine", opt.quantification_engine), ("automatic_coordinates_min_confidence", opt.automatic_coordinates_min_confidence), ("fitting_engine", opt.fitting_engine)]])
 if opt.auto_accept is True: arguments += " --auto_accept"
+if opt.headless is True: arguments += " --headless"
+if opt.lazy_colonyzer_plots is True: arguments += " --lazy_colonyzer_plots"
+if opt.automatic_coordinates is True: arguments += " --automatic_coordinates"
+if opt.scanner_profiles is True: arguments += " --scanner_profiles"
 if not opt.previous_output is None: arguments += "--previous_output %s"%opt.previous_output
 
 full_command = "%s %s%smain.py %s"%(sys.executable, pipeline_dir, os_sep, arguments)
@@ -137,7 +187,7 @@ fun.print_with_runtime("Executing the following command (you may use it to repro
 
 # check that the docker image can be run
 fun.print_with_runtime("Trying to run docker image. If this fails it may be because either the image is not in your system or docker is not properly initialized.")
-fun.run_cmd('docker run -it --rm %s bash -c "sleep 1"'%(opt.docker_image))
+fun.run_cmd('docker run %s--rm %s bash -c "sleep 1"'%({True:"", False:"-it "}[opt.headless], opt.docker_image))
 fun.print_with_runtime("Docker runs well")
 
 #############################
@@ -174,11 +224,17 @@ fun.make_folder(opt.output)
 fun.delete_folder(tmp_input_dir); fun.make_folder(tmp_input_dir)
 
 # init command with general features
-docker_cmd = 'docker run --rm -it -e contrast_enhancement_image=%s -e hours_experiment=%s -e KEEP_TMP_FILES=%s -e min_nAUC_to_beConsideredGrowing=%s -e enhance_image_contrast=%s -e reference_plate=%s -e PARMS_COLONYZER=%s -v "%s":/small_inputs -v "%s":/output -v "%s":/images'%(opt.contrast_enhancement_image, opt.hours_experiment, opt.keep_tmp_files, opt.min_nAUC_to_beConsideredGrowing, opt.enhance_image_contrast, str(opt.reference_plate), opt.parms_colonyzer, tmp_input_dir, opt.output, opt.input)
+docker_cmd = 'docker run --rm -it -e contrast_enhancement_image=%s -e hours_experiment=%s -e KEEP_TMP_FILES=%s -e min_nAUC_to_beConsideredGrowing=%s -e enhance_image_contrast=%s -e reference_plate=%s -e PARMS_COLONYZER=%s -e image_engine=%s -e concurrent_batches=%s -e fused_image_pipeline=%s -e keep_processed_images=%s -e global_histogram_pixel_stride=%i -e artifact_cache=%s -e follow=%s -e min_image_age_seconds=%i -e reduced_inputs_compression=%s -e parallel_colonyzer_timepoints=%s -e quantification_engine=%s -e lazy_colonyzer_plots=%s -e auto_accept=%s -e fitting_engine=%s -v "%s":/small_inputs -v "%s":/output -v "%s":/images'%(opt.contrast_enhancement_image, opt.hours_experiment, opt.keep_tmp_files, opt.min_nAUC_to_beConsideredGrowing, opt.enhance_image_contrast, str(opt.reference_plate), opt.parms_colonyzer, opt.image_engine, opt.concurrent_batches, opt.fused_image_pipeline, opt.keep_processed_images, opt.global_histogram_pixel_stride, opt.artifact_cache, opt.follow, {True:opt.follow_poll_seconds, False:0}[opt.follow], opt.reduced_inputs_compression, opt.parallel_colonyzer_timepoints, opt.quantification_engine, opt.lazy_colonyzer_plots, opt.auto_accept, opt.fitting_engine, tmp_input_dir, opt.output, opt.input)
 
 if not opt.previous_output is None:
     docker_cmd += ' -v "%s":/previous_output'%opt.previous_output
 
+# without a display there may be no terminal either
+if opt.headless is True: docker_cmd = docker_cmd.replace(" -it ", " ")
+
+# add the cache dir, shared across runs
+docker_cmd += ' -v "%s":/cache'%opt.cache_dir
+
 # add the scripts from outside
 docker_cmd += ' -v "%s%sscripts":/workdir_app/scripts'%(pipeline_dir, fun.get_os_sep())
 
@@ -191,6 +247,7 @@ open(full_command_file, "w").write(full_command+"\n")
 # get the corrected images
 print("\n")
 fun.print_with_runtime("STEP 1/5: Getting cropped, flipped images...")
+if opt.follow is True: fun.wait_for_first_images_follow(opt.input, opt.follow_poll_seconds)
 if opt.previous_output is None:
     fun.run_docker_cmd("%s -e MODULE=analyze_images_process_images"%(docker_cmd), ["%s%sanalyze_images_process_images_correct_finish.txt"%(opt.output, fun.get_os_sep())])
 else:
@@ -207,6 +264,12 @@ if opt.previous_output is None:
     fun.get_colonyzer_coordinates_GUI(opt.output, docker_cmd)
 else:
     fun.print_with_runtime("Skipping because previous output was provided...")
+
+# analyze the new images as they appear
+if opt.follow is True:
+    print("\n")
+    fun.print_with_runtime("Following the new images in --input...")
+    fun.run_follow_new_images(opt.input, opt.output, docker_cmd, opt.follow_poll_seconds, opt.follow_timeout_hours)
     
 # get fitness measurements
 print("\n")
@@ -234,7 +297,7 @@ fun.print_with_runtime("STEP 5/5: Getting integrated fitness and susceptibility
 fun.run_docker_cmd("%s -e MODULE=get_rel_fitness_and_susceptibility_measurements"%(docker_cmd), ["%s%sget_rel_fitness_and_susceptibility_measurements_correct_finish.txt"%(opt.output, fun.get_os_sep())])
 
 # clean
-for f in ['analyze_images_run_colonyzer_subset_images_correct_finish.txt', 'analyze_images_process_images_correct_finish.txt', 'get_fitness_measurements_correct_finish.txt', 'get_rel_fitness_and_susceptibility_measurements_correct_finish.txt']: fun.remove_file("%s%s%s"%(opt.output, fun.get_os_sep(), f))
+for f in ['analyze_images_run_colonyzer_subset_images_correct_finish.txt', 'analyze_images_process_images_correct_finish.txt', 'analyze_images_follow_new_images_correct_finish.txt', 'get_fitness_measurements_correct_finish.txt', 'get_rel_fitness_and_susceptibility_measurements_correct_finish.txt']: fun.remove_file("%s%s%s"%(opt.output, fun.get_os_sep(), f))
 fun.delete_folder(tmp_input_dir)
 #fun.delete_folder("%s%sextended_outputs%sreduced_input_dir.zip"%(opt.output, fun.get_os_sep(), fun.get_os_sep()))
 
@@ -3,14 +3,16 @@
 # Functions of the image analysis pipeline. This should be imported from the main_env
 
 # imports
-import os, sys, time, random, string, shutil, math, itertools, pickle, scipy, zipfile, matplotlib
+import os, sys, time, random, string, shutil, math, itertools, pickle, scipy, zipfile, matplotlib, json, hashlib
 import copy as cp
 from datetime import date
+import datetime
 import pandas as pd
 from openpyxl.styles import PatternFill, Font
 from openpyxl.styles.borders import Border, Side
 import matplotlib.colors as mcolors
 import multiprocessing as multiproc
+import multiprocessing.pool
 import numpy as np
 from PIL import Image as PIL_Image
 from PIL import ImageEnhance, ImageDraw, ImageFont, ImageColor
@@ -24,6 +26,11 @@ import matplotlib.patches as patches
 from mpl_toolkits.axes_grid1 import make_axes_locatable
 import traceback
 from PIL import ImageFile, ImageStat
+import fs_functions as fs_fun
+import command_broker as cmd_broker
+import native_quantification as native_quant
+import logistic_fitting as log_fit
+import atexit, threading
 
 # set parms for matplotlib
 #plt.rcParams['font.family'] = 'Arial'
@@ -32,6 +39,25 @@ matplotlib.use('Agg')
 # define dirs
 ScriptsDir = "/workdir_app/scripts"
 CondaDir =  "/opt/conda"
+CacheDir = "/cache" # shared across runs, it may not be mounted
+
+# use the artifacts in CacheDir/artifacts (set from run_app.py)
+use_artifact_cache = False
+
+# the engine that quantifies the spots of each image, 'colonyzer' or 'native' (set from run_app.py)
+quantification_engine = "colonyzer"
+
+# the engine that fits the growth curves, 'qfa' (get_fitness_measurements.R) or 'numpy' (logistic_fitting.py). Set from run_app.py
+fitting_engine = "qfa"
+
+# if True, colonyzer only renders the Output_Images of the latest image, and no reports (set from run_app.py)
+lazy_colonyzer_plots = False
+
+# the command broker of each conda env, with (socket file, process). Set from run_app.py with start_command_brokers
+env_to_command_broker = {}
+
+# the pool of R workers of get_fitness_measurements.R, as (socket file, server). Set with start_r_worker_pool
+r_worker_pool = None
 
 # general variables
 PipelineName = "Q-PHAST"
@@ -71,10 +97,7 @@ def id_generator(size=10, chars=string.ascii_uppercase + string.digits, already_
 
 def remove_file(f):
 
-    if os.path.isfile(f): 
-
-        try: run_cmd("rm %s > /dev/null 2>&1"%f)
-        except: pass
+    fs_fun.remove_file(f)
 
 def delete_folder(f):
 
@@ -100,9 +123,98 @@ def run_cmd_simple(cmd):
     if out_stat!=0: raise ValueError("\n%s\n did not finish correctly. Out status: %i"%(cmd, out_stat))
 
 
+def start_command_brokers(envs=("main_env", "colonyzer_env")):
+
+    """Starts one command broker for each env, so that run_cmd does not activate the env each time. They are stopped at exit."""
+
+    tmpdir = '/workdir_app/.tmpdir_cmds'
+    os.makedirs(tmpdir, exist_ok=True)
+
+    for env in envs:
+        socket_file = "%s/command_broker_%s.sock"%(tmpdir, env)
+        broker_process = cmd_broker.start_command_broker(env, socket_file, CondaDir, "%s/command_broker_%s.std"%(tmpdir, env))
+        env_to_command_broker[env] = (socket_file, broker_process)
+
+    atexit.register(stop_command_brokers)
+
+def stop_command_brokers():
+
+    """Stops the command brokers started in this process"""
+
+    for env, (socket_file, broker_process) in list(env_to_command_broker.items()):
+        if broker_process.poll() is None: 
+            broker_process.terminate()
+            broker_process.wait()
+
+        fs_fun.remove_file(socket_file)
+        del env_to_command_broker[env]
+
+def start_r_worker_pool(nworkers):
+
+    """Starts nworkers R workers that load qfa once and run get_fitness_measurements.R for each plate (see run_fitness_measurements_R). They are stopped with stop_r_worker_pool, or at exit."""
+
+    global r_worker_pool
+
+    tmpdir = '/workdir_app/.tmpdir_cmds'
+    os.makedirs(tmpdir, exist_ok=True)
+
+    print_with_runtime("Starting %i R workers..."%nworkers)
+    socket_file = "%s/r_worker_pool.sock"%tmpdir
+    server = cmd_broker.start_r_worker_pool(nworkers, socket_file, CondaDir, "%s/get_fitness_measurements.R"%ScriptsDir, "%s/r_worker_pool.std"%tmpdir)
+    r_worker_pool = (socket_file, server)
+
+    atexit.register(stop_r_worker_pool)
+
+def stop_r_worker_pool():
+
+    """Stops the R workers started in this process"""
+
+    global r_worker_pool
+
+    if r_worker_pool is not None: 
+        cmd_broker.stop_r_worker_pool(r_worker_pool[1])
+        r_worker_pool = None
+
+def run_fitness_measurements_R(input_dir, days_experiment, fitness_measurements_std, threads=1):
+
+    """Runs get_fitness_measurements.R on input_dir, in the pool of R workers if started (from this process or its parent), or with a new Rscript. The spots are fit in threads shards"""
+
+    if r_worker_pool is not None: 
+        reply = cmd_broker.run_request_in_r_worker_pool(r_worker_pool[0], input_dir, days_experiment, fitness_measurements_std, threads=threads)
+        if reply["exit_status"]!=0: raise ValueError("Error in get_fitness_measurements.R. This is the log:\n---\n%s\n---"%("".join(open(fitness_measurements_std, "r").readlines())))
+
+    else:
+        try: run_cmd("/workdir_app/scripts/get_fitness_measurements.R %s %s %i > %s 2>&1"%(input_dir, days_experiment, threads, fitness_measurements_std), env="main_env")
+        except: raise ValueError("Error in get_fitness_measurements.R. This is the log:\n---\n%s\n---"%("".join(open(fitness_measurements_std, "r").readlines())))
+
+def run_cmd_command_broker(cmd, env):
+
+    """Runs cmd with the command broker of env, printing the output of the cmd"""
+
+    # define the files with the output. The process and thread make them unique in parallel runs (forked processes have the same random state)
+    tmpdir = '/workdir_app/.tmpdir_cmds'
+    cmd_id = "%i_%i_%s"%(os.getpid(), threading.get_ident(), id_generator(size=15, chars=string.ascii_uppercase))
+    stdout, stderr = ["%s/%s.%s"%(tmpdir, cmd_id, x) for x in ["stdout", "stderr"]]
+
+    # run
+    reply = cmd_broker.run_cmd_in_command_broker(env_to_command_broker[env][0], cmd, stdout, stderr)
+
+    # print the output (most commands redirect it to files)
+    for f, std in [(stdout, sys.stdout), (stderr, sys.stderr)]:
+        if not file_is_empty(f): 
+            std.write(open(f, "r").read())
+            std.flush()
+        fs_fun.remove_file(f)
+
+    if reply["exit_status"]!=0: raise ValueError("\n%s\n did not finish correctly in the command broker of %s (after %.2f seconds). Out status: %i"%(cmd, env, reply["seconds"], reply["exit_status"]))
+
 def run_cmd(cmd, env='main_env'):
 
-    """This function runs a cmd with a given env"""
+    """This function runs a cmd with a given env. If there is a command broker for env (see start_command_brokers), it is run there"""
+
+    if env in env_to_command_broker: 
+        run_cmd_command_broker(cmd, env)
+        return
 
     # define the cmds
     SOURCE_CONDA_CMD = "source %s/etc/profile.d/conda.sh > /dev/null 2>&1"%CondaDir
@@ -128,7 +240,7 @@ def run_cmd(cmd, env='main_env'):
     if out_stat!=0: raise ValueError("\n%s\n did not finish correctly. Out status: %i"%(cmd_to_run, out_stat))
 
     # remove the script
-    run_cmd_simple("rm %s"%bash_script)
+    fs_fun.remove_file(bash_script)
 
 
 def get_matplotlib_color_as_hex(c):
@@ -349,13 +461,8 @@ def soft_link_files(origin, target):
         # check that the origin exists
         if file_is_empty(origin): raise ValueError("The origin %s should exist"%origin)
 
-        # remove previous lisqnk
-        try: run_cmd("rm %s > /dev/null 2>&1"%target)
-        except: pass
-
-        soft_linking_std = "%s.softlinking.std"%(target)
-        run_cmd("ln -s %s %s > %s 2>&1"%(origin, target, soft_linking_std))
-        remove_file(soft_linking_std)
+        # link, removing any previous link
+        fs_fun.soft_link_file(origin, target)
 
     # check that it worked
     if file_is_empty(target): raise ValueError("The target %s should exist"%target)
@@ -438,17 +545,44 @@ def generates_image_w_appended_image_on_the_right(input_image_file, output_image
         output_image.save(output_image_file_tmp)        
         os.rename(output_image_file_tmp, output_image_file)
 
-def process_image_rotation_all_images_batch(Ibatch, nbatches, raw_outdir, processed_outdir, plate_batch, expected_images, image_ending, enhance_image_contrast, image_highest_contrast):
+def crop_image_to_size(image_file, size):
 
-    """Runs the processing of images for all images in one batch"""
+    """Crops image_file (in place) to the top-left (width, height) of size"""
+
+    PIL_Image.open(image_file).crop((0, 0, size[0], size[1])).save(image_file)
+
+def process_image_rotation_all_images_batch(Ibatch, nbatches, raw_outdir, processed_outdir, plate_batch, expected_images, image_ending, enhance_image_contrast, image_highest_contrast, image_engine="imagej", threads=None, imageJ_memory_mb=None, contrast_LUT=None):
+
+    """Runs the processing of images for all images in one batch. image_engine can be 'imagej' (Fiji macro) or 'numpy' (in-process reimplementation of the same macro). threads are the parallel processes used for the images of this batch, and imageJ_memory_mb the maximum heap of the imageJ JVM (None means the Fiji default). contrast_LUT is a global LUT used instead of image_highest_contrast (only for the numpy engine)."""
 
     # log
     log_txt = "Processing images for batch %i/%i: %s"%(Ibatch, nbatches, plate_batch)
     if enhance_image_contrast is True: log_txt += " (increasing contrast)"
     print_with_runtime(log_txt)
 
-    # if there are no processed files
-    if not os.path.isdir(processed_outdir): 
+    # if there are no processed files, run with the numpy engine
+    if not os.path.isdir(processed_outdir) and image_engine=="numpy":
+
+        # make tmp folder where to save things folder
+        processed_outdir_tmp = "%s_tmp"%processed_outdir
+        delete_folder(processed_outdir_tmp); make_folder(processed_outdir_tmp)
+
+        # get the histogram of the image appended on the right, which only matters for the contrast
+        if contrast_LUT is None and image_highest_contrast is not None: reference_histogram, reference_size = get_imageJ_histogram_RGB_image(get_RGB_array_image(image_highest_contrast))
+        else: reference_histogram, reference_size = None, None
+
+        # process each image
+        inputs_fn = [("%s/%s.%s"%(raw_outdir, img.split(".tif")[0], image_ending), "%s/%s"%(processed_outdir_tmp, img), enhance_image_contrast, reference_histogram, reference_size, contrast_LUT) for img in expected_images]
+        run_function_in_parallel(inputs_fn, process_image_rotation_and_contrast_numpy, threads=threads)
+
+        # at the end save
+        os.rename(processed_outdir_tmp, processed_outdir)
+
+    # if there are no processed files, run with imageJ
+    elif not os.path.isdir(processed_outdir) and image_engine=="imagej": 
+
+        # check
+        if contrast_LUT is not None: raise ValueError("A global contrast LUT can only be used with the numpy image_engine")
 
         # clean
         delete_folder(processed_outdir)
@@ -466,7 +600,7 @@ def process_image_rotation_all_images_batch(Ibatch, nbatches, raw_outdir, proces
 
         # get the merged_images
         inputs_fn = [("%s/%s"%(raw_outdir, img), "%s/%s"%(merged_images_dir, img), image_highest_contrast, image_ending) for img in expected_images]
-        run_function_in_parallel(inputs_fn, generates_image_w_appended_image_on_the_right)
+        run_function_in_parallel(inputs_fn, generates_image_w_appended_image_on_the_right, threads=threads)
 
         # define the contrast as based on enhance_image_contrast
         if enhance_image_contrast is True: 
@@ -497,7 +631,7 @@ def process_image_rotation_all_images_batch(Ibatch, nbatches, raw_outdir, proces
                  ]
 
         lines = header + lines_contrast + footer
-        run_imageJ_macro(lines, "%s.processing_script.ijm"%raw_outdir, delete_files=False)
+        run_imageJ_macro(lines, "%s.processing_script.ijm"%raw_outdir, delete_files=False, memory_mb=imageJ_memory_mb)
 
         # clean
         delete_folder(merged_images_dir)
@@ -505,6 +639,8 @@ def process_image_rotation_all_images_batch(Ibatch, nbatches, raw_outdir, proces
         # at the end save
         os.rename(processed_outdir_tmp, processed_outdir)
 
+    elif not os.path.isdir(processed_outdir): raise ValueError("invalid image_engine: %s"%image_engine)
+
     # check that all images are there
     missing_images = set(expected_images).difference(set(os.listdir(processed_outdir)))
     if len(missing_images)>0: raise ValueError("There are missing images: %s"%missing_images)
@@ -514,6 +650,105 @@ def process_image_rotation_all_images_batch(Ibatch, nbatches, raw_outdir, proces
 
     # clean
 
+def get_RGB_array_image(filename):
+
+    """Loads an image as a (height, width, 3) uint8 array, converting it to RGB as PIL does when pasting into an RGB image."""
+
+    return np.asarray(PIL_Image.open(filename).convert("RGB"))
+
+def get_imageJ_histogram_RGB_image(image_array):
+
+    """Returns the 256-bin histogram that imageJ uses for RGB images (unweighted luminance (int)(r/3 + g/3 + b/3 + 0.5)) and the (width, height) of the image. The luminance is computed with integers, which gives the same bins because (r+g+b)/3 is never 0.5 away from an integer."""
+
+    rgb_sum = image_array.astype(np.uint16).sum(axis=2)
+    luminance = (2*rgb_sum + 3)//6
+    histogram = np.bincount(luminance.ravel(), minlength=256)
+
+    return [int(x) for x in histogram], (image_array.shape[1], image_array.shape[0])
+
+def get_imageJ_enhance_contrast_LUT(histogram, saturated=0.3):
+
+    """Takes a 256-bin histogram and returns the 256-value LUT that imageJ's 'Enhance Contrast... saturated=<saturated>' applies to an RGB image (ContrastEnhancer.getMinAndMax + ColorProcessor.setMinAndMax). It returns None if imageJ would leave the image unchanged."""
+
+    # get the number of pixels that can be saturated at each side
+    histogram = np.array(histogram, dtype=np.int64)
+    threshold = int(histogram.sum()*saturated/200.0)
+
+    # define the first and last bin where the cumulative count exceeds the threshold
+    above_threshold_min = np.nonzero(np.cumsum(histogram)>threshold)[0]
+    above_threshold_max = np.nonzero(np.cumsum(histogram[::-1])>threshold)[0]
+    hmin = above_threshold_min[0] if len(above_threshold_min)>0 else 255
+    hmax = 255 - above_threshold_max[0] if len(above_threshold_max)>0 else 0
+    if hmax<=hmin: return None
+
+    # map each value, truncating as the (int) cast of java
+    lut = np.trunc(256.0*(np.arange(256) - hmin)/(hmax - hmin))
+    return np.clip(lut, 0, 255).astype(np.uint8)
+
+def get_processed_image_array_numpy(raw_image, enhance_image_contrast, reference_histogram, reference_size, contrast_LUT=None):
+
+    """Returns the processed array of raw_image as the imageJ macro of process_image_rotation_all_images_batch does. The contrast is calculated as if the image of reference_histogram (with size reference_size) was appended on the right, without building the merged image. If contrast_LUT is provided (i.e. a global LUT for all images), it is applied instead."""
+
+    # load
+    image_array = get_RGB_array_image(raw_image)
+
+    # enhance contrast with the provided LUT
+    if enhance_image_contrast is True and contrast_LUT is not None: image_array = contrast_LUT[image_array]
+
+    # enhance contrast as in a merged image, where the padding of the shortest image is black
+    elif enhance_image_contrast is True:
+
+        image_histogram, (image_w, image_h) = get_imageJ_histogram_RGB_image(image_array)
+        reference_w, reference_h = reference_size
+        merged_histogram = np.array(image_histogram) + np.array(reference_histogram)
+        merged_histogram[0] += (image_w + reference_w)*max([image_h, reference_h]) - image_w*image_h - reference_w*reference_h
+
+        contrast_LUT = get_imageJ_enhance_contrast_LUT(merged_histogram)
+        if contrast_LUT is not None: image_array = contrast_LUT[image_array]
+
+    # flip vertically and rotate 90 degrees left
+    return np.rot90(image_array[::-1])
+
+def save_image_array_as_tif(image_array, filename):
+
+    """Saves a (height, width, 3) array as a tif in filename, through a tmp file"""
+
+    filename_tmp = "%s.tmp.tif"%filename; remove_file(filename_tmp)
+    PIL_Image.fromarray(np.ascontiguousarray(image_array)).save(filename_tmp)
+    os.rename(filename_tmp, filename)
+
+def process_image_rotation_and_contrast_numpy(raw_image, processed_image, enhance_image_contrast, reference_histogram, reference_size, contrast_LUT=None):
+
+    """Generates a processed_image from raw_image with get_processed_image_array_numpy."""
+
+    if file_is_empty(processed_image): save_image_array_as_tif(get_processed_image_array_numpy(raw_image, enhance_image_contrast, reference_histogram, reference_size, contrast_LUT=contrast_LUT), processed_image)
+
+def process_image_and_crop_plates_numpy(raw_image, processed_image, plate_to_cropped_image, enhance_image_contrast, reference_histogram, reference_size, contrast_LUT=None):
+
+    """Decodes raw_image once, processes it as process_image_rotation_and_contrast_numpy and writes each plate quadrant (plate_to_cropped_image) as generate_croped_image would do from the processed image. The full-size processed_image is only written if it is not None."""
+
+    # define the missing files
+    plate_to_missing_cropped_image = {p : f for p, f in plate_to_cropped_image.items() if file_is_empty(f)}
+    write_processed_image = processed_image is not None and file_is_empty(processed_image)
+
+    if len(plate_to_missing_cropped_image)>0 or write_processed_image:
+
+        # get the processed array
+        image_array = get_processed_image_array_numpy(raw_image, enhance_image_contrast, reference_histogram, reference_size, contrast_LUT=contrast_LUT)
+        if write_processed_image: save_image_array_as_tif(image_array, processed_image)
+
+        # write each quadrant
+        h, w = image_array.shape[0:2]
+        for plate, cropped_image in plate_to_missing_cropped_image.items():
+
+            left, top, right, bottom = get_plate_quadrant_crop_box(w, h, plate, as_int=True)
+            cropped_array = image_array[top:bottom, left:right]
+
+            cropped_h, cropped_w = cropped_array.shape[0:2]
+            if cropped_w<(w*0.1) or cropped_h<(h*0.1): raise ValueError("The size of the cropped image from %s is invalid: %s. The original w,h size was %s"%(raw_image, (cropped_w, cropped_h), (w, h)))
+
+            save_image_array_as_tif(cropped_array, cropped_image)
+
 def process_image_rotation_and_contrast_PIL(Iimage, nimages, raw_image, processed_image):
 
     """Generates a processed image based on raw image that has enhanced contrast and left rotation. This is like process_image_rotation_and_contrast (this is what we originally did) but with PIL. This does not work as well as ImageJ."""
@@ -576,6 +811,87 @@ def get_yyyymmddhhmm_tuple_one_image_name(filename):
 
     return numbers_tuple
 
+def get_sha256_file(filename, chunk_size=1048576):
+
+    """Gets the sha256 of the content of a file, reading it in chunks"""
+
+    file_hash = hashlib.sha256()
+    with open(filename, "rb") as fd:
+        for chunk in iter(lambda: fd.read(chunk_size), b""): file_hash.update(chunk)
+
+    return file_hash.hexdigest()
+
+def get_image_catalog_entry(plate_batch, plates, source_image, raw_image, image):
+
+    """Gets a dict with the info of one image for the image catalog. source_image is the original image (<images>/<plate_batch>/<file>), raw_image the linked image and image the name of the processed images"""
+
+    image_object = PIL_Image.open(source_image)
+    width, height = image_object.size
+
+    return {"plate_batch" : plate_batch,
+            "plates" : plates,
+            "image" : image,
+            "raw_image" : raw_image,
+            "source_image" : "%s/%s"%(plate_batch, get_file(source_image)),
+            "timestamp" : "%i%02i%02i%02i%02i"%get_yyyymmddhhmm_tuple_one_image_name(source_image),
+            "width" : width,
+            "height" : height,
+            "bytes" : os.stat(source_image).st_size,
+            "format" : image_object.format,
+            "sha256" : get_sha256_file(source_image)}
+
+def generate_image_catalog(catalog_file, inputs_fn_catalog):
+
+    """Writes catalog_file, a json with the info of each image (get_image_catalog_entry called with each of inputs_fn_catalog), sorted by plate batch and time. This is read by the later steps (get_sorted_image_names_plate_dir) instead of listing the image folders. If catalog_file exists, only the new images are added (i.e. in --follow mode)."""
+
+    # get the previous entries
+    previous_catalog = load_image_catalog(catalog_file)
+    if previous_catalog is None: previous_entries = []
+    else: previous_entries = previous_catalog["images"]
+
+    # add the missing images
+    previous_pb_images = {(x["plate_batch"], x["image"]) for x in previous_entries}
+    inputs_fn_catalog = [x for x in inputs_fn_catalog if (x[0], x[4]) not in previous_pb_images]
+
+    if len(inputs_fn_catalog)>0:
+
+        print_with_runtime("Adding %i images to the image catalog on %i threads..."%(len(inputs_fn_catalog), multiproc.cpu_count()))
+        all_entries = previous_entries + run_function_in_parallel(inputs_fn_catalog, get_image_catalog_entry)
+        all_entries = sorted(all_entries, key=(lambda x: (x["plate_batch"], x["timestamp"])))
+
+        catalog_file_tmp = "%s.tmp"%catalog_file
+        json.dump({"images" : all_entries}, open(catalog_file_tmp, "w"))
+        os.rename(catalog_file_tmp, catalog_file)
+
+# loaded catalogs, with the modification time of the file as key
+catalog_file_to_mtime_and_catalog = {}
+
+def load_image_catalog(catalog_file):
+
+    """Loads the catalog written by generate_image_catalog, or returns None if it does not exist (i.e. outputs from older versions)"""
+
+    if file_is_empty(catalog_file): return None
+
+    mtime = os.stat(catalog_file).st_mtime_ns
+    if catalog_file not in catalog_file_to_mtime_and_catalog or catalog_file_to_mtime_and_catalog[catalog_file][0]!=mtime: catalog_file_to_mtime_and_catalog[catalog_file] = (mtime, json.load(open(catalog_file, "r")))
+
+    return catalog_file_to_mtime_and_catalog[catalog_file][1]
+
+def get_sorted_image_names_plate_dir(dest_processed_images_dir):
+
+    """Gets the sorted (by time) image names of a <tmp>/processed_images_each_plate/<plate_batch>_plate<plate> folder. They are taken from <tmp>/image_catalog.json, or from listing the folder if there is no catalog"""
+
+    # define the catalog
+    tmpdir = get_dir(get_dir(dest_processed_images_dir))
+    plate_batch, plate = get_file(dest_processed_images_dir).rsplit("_plate", 1)
+    image_catalog = load_image_catalog("%s/image_catalog.json"%tmpdir)
+
+    # list files
+    if image_catalog is None: return sorted({f for f in os.listdir(dest_processed_images_dir) if not f.startswith(".") and f not in {"Colonyzer.txt.tmp", "Colonyzer.txt"}}, key=get_yyyymmddhhmm_tuple_one_image_name)
+
+    # get from the catalog, which is sorted
+    else: return [x["image"] for x in image_catalog["images"] if x["plate_batch"]==plate_batch and int(plate) in x["plates"]]
+
 def get_int_as_str_two_digits(x):
 
     """Returns the int as a string with two digits"""
@@ -729,9 +1045,9 @@ def generate_colonyzer_coordinates_one_plate_batch_and_plate(dest_processed_imag
         open(colonizer_coordinates_tmp, "w").write("".join(non_coordinates_lines + coordinates_lines))
         os.rename(colonizer_coordinates_tmp, colonizer_coordinates)
 
-def run_colonyzer_one_set_of_parms(parms, outdir_all, image_names_withoutExtension, processed_images_dir_each_plate, reference_plate):
+def run_colonyzer_one_set_of_parms(parms, outdir_all, image_names_withoutExtension, processed_images_dir_each_plate, reference_plate, colonyzer_threads=1, image_threads=1):
 
-    """Runs colonyzer for a set of parms. This should be run from a directory where there are imnages"""
+    """Runs colonyzer for a set of parms. This should be run from a directory where there are imnages. If colonyzer_threads>1, the timepoints are split into parallel shards with colonyzer_pool.py, which generates the same outputs. The merged images of reference_plate (only with the colonyzer engine) are generated on image_threads. If lazy_colonyzer_plots is True, only the latest image has Output_Images (and there are no Output_Reports)."""
 
     # get args
     sorted_parms = sorted(parms)
@@ -752,18 +1068,19 @@ def run_colonyzer_one_set_of_parms(parms, outdir_all, image_names_withoutExtensi
     # define the cur_dir
     cur_dir = os.getcwd()
 
-    # if you provided a reference plate, create a running folder
-    if not reference_plate is None: 
+    # Get the last timepoint image of the reference plate as the image to append
+    if not reference_plate is None:
+        dir_ref = "%s/%s_plate%i"%(processed_images_dir_each_plate, reference_plate[0], reference_plate[1])
+        sorted_imgs = get_sorted_image_names_plate_dir(dir_ref)
+        ref_image_file = "%s/%s"%(dir_ref, sorted_imgs[-1])
+
+    # if you provided a reference plate, create a running folder with the merged images (the native engine appends the reference image in memory)
+    if not reference_plate is None and quantification_engine=="colonyzer": 
 
         # define the dest_cur_dir, where to place merged images
         dest_cur_dir = "%s/working_w_ref_plate"%cur_dir
         delete_folder(dest_cur_dir)
 
-        # Get the last timepoint image of the reference plate as the image to append
-        dir_ref = "%s/%s_plate%i"%(processed_images_dir_each_plate, reference_plate[0], reference_plate[1])
-        sorted_imgs = sorted({f for f in os.listdir(dir_ref) if not f.startswith(".") and f not in {"Colonyzer.txt.tmp", "Colonyzer.txt"}}, key=get_yyyymmddhhmm_tuple_one_image_name)
-        ref_image_file = "%s/%s"%(dir_ref, sorted_imgs[-1])
-
         # make folder
         make_folder(dest_cur_dir)
 
@@ -772,10 +1089,9 @@ def run_colonyzer_one_set_of_parms(parms, outdir_all, image_names_withoutExtensi
 
         # generate figures with appended ref_image_file in the right
         imgs_process =  sorted({f for f in os.listdir(cur_dir) if not f.startswith(".") and f.split(".")[0] in image_names_withoutExtension})
-        img_name_to_size = {}
-        for img in imgs_process: 
-            img_name_to_size[img.split(".")[0]] = PIL_Image.open("%s/%s"%(cur_dir, img)).size
-            generates_image_w_appended_image_on_the_right("%s/%s"%(cur_dir, img), "%s/%s"%(dest_cur_dir, img), ref_image_file, imgs_process[0].split(".")[-1])
+        img_name_to_size = {img.split(".")[0] : PIL_Image.open("%s/%s"%(cur_dir, img)).size for img in imgs_process}
+        inputs_fn = [("%s/%s"%(cur_dir, img), "%s/%s"%(dest_cur_dir, img), ref_image_file, imgs_process[0].split(".")[-1]) for img in imgs_process]
+        run_function_in_parallel_threads(inputs_fn, generates_image_w_appended_image_on_the_right, image_threads)
 
         # move to dest_cur_dir and work there
         os.chdir(dest_cur_dir)
@@ -794,12 +1110,25 @@ def run_colonyzer_one_set_of_parms(parms, outdir_all, image_names_withoutExtensi
         delete_folder(outdir)
         delete_folder(outdir_tmp); make_folder(outdir_tmp)
 
+        # get the .dat and .out files with numpy (no plots are generated)
+        if quantification_engine=="native":
+
+            for folder in ["Output_Images", "Output_Data", "Output_Reports"]: delete_folder(folder); make_folder(folder)
+            images = [f for f in os.listdir(".") if f.split(".")[0] in image_names_withoutExtension and f.split(".")[-1].lower() in allowed_image_endings]
+            if reference_plate is None: native_quant.run_native_quantification(os.getcwd(), images, sorted_parms)
+            else: native_quant.run_native_quantification(os.getcwd(), images, sorted_parms, reference_image=ref_image_file)
+
         # run colonizer, which will generate data under . (images_folder)
-        colonyzer_exec = "%s/envs/colonyzer_env/bin/colonyzer"%CondaDir
-        colonyzer_std = "%s.running_colonyzer.std"%outdir_tmp
-        colonyzer_cmd = "%s %s --plots --remove --initpos --fmt 96 > %s 2>&1"%(colonyzer_exec, extra_cmds_parmCombination, colonyzer_std) # --slopefill 0.9 is default, --slopefill 0.5 gave more simialr patterns of growth at high concentrations. slopefill 0.7 did not change
-        run_cmd(colonyzer_cmd, env="colonyzer_env")
-        remove_file(colonyzer_std)
+        else:
+            colonyzer_exec = "%s/envs/colonyzer_env/bin/colonyzer"%CondaDir
+            colonyzer_std = "%s.running_colonyzer.std"%outdir_tmp
+            colonyzer_cmd = "%s %s --plots --remove --initpos --fmt 96 > %s 2>&1"%(colonyzer_exec, extra_cmds_parmCombination, colonyzer_std) # --slopefill 0.9 is default, --slopefill 0.5 gave more simialr patterns of growth at high concentrations. slopefill 0.7 did not change
+
+            # with lazy plots, run colonyzer as a library (colonyzer_pool.py), which only renders the images of the latest timepoint (colonyzer writes the Output_Images of all images, also without --plots)
+            if lazy_colonyzer_plots is True: colonyzer_cmd = "%s/envs/colonyzer_env/bin/python %s/colonyzer_pool.py %i %s/colonyzer_shards %s %s --remove --initpos --fmt 96 > %s 2>&1"%(CondaDir, ScriptsDir, colonyzer_threads, outdir_tmp, sorted(image_names_withoutExtension)[-1], extra_cmds_parmCombination, colonyzer_std)
+            elif colonyzer_threads>1: colonyzer_cmd = "%s/envs/colonyzer_env/bin/python %s/colonyzer_pool.py %i %s/colonyzer_shards all %s --plots --remove --initpos --fmt 96 > %s 2>&1"%(CondaDir, ScriptsDir, colonyzer_threads, outdir_tmp, extra_cmds_parmCombination, colonyzer_std)
+            run_cmd(colonyzer_cmd, env="colonyzer_env")
+            remove_file(colonyzer_std)
 
         # change to initial curdir
         os.chdir(cur_dir)
@@ -808,22 +1137,19 @@ def run_colonyzer_one_set_of_parms(parms, outdir_all, image_names_withoutExtensi
         for folder in ["Output_Images", "Output_Data", "Output_Reports"]: 
 
             # move to tmp
-            if not reference_plate is None: source_folder =  "%s/%s"%(dest_cur_dir, folder)
+            if not reference_plate is None and quantification_engine=="colonyzer": source_folder =  "%s/%s"%(dest_cur_dir, folder)
             else:  source_folder =  "%s/%s"%(cur_dir, folder)
             dest_folder = "%s/%s"%(outdir_tmp, folder)
             os.rename(source_folder, dest_folder)
 
-            # edit the images
-            if not reference_plate is None and folder=="Output_Images": 
-
-                for img in sorted(image_names_withoutExtension):
-                    for suffix in {".png", "_AREA.png"}:
-                        image_file = "%s/%s%s"%(dest_folder, img, suffix)
-                        PIL_Image.open(image_file).crop((0, 0, img_name_to_size[img][0], img_name_to_size[img][1])).save(image_file)
+            # edit the images (only those with plots, with lazy plots)
+            if not reference_plate is None and quantification_engine=="colonyzer" and folder=="Output_Images": 
 
+                inputs_fn = [("%s/%s%s"%(dest_folder, img, suffix), img_name_to_size[img]) for img in sorted(image_names_withoutExtension) for suffix in [".png", "_AREA.png"] if os.path.isfile("%s/%s%s"%(dest_folder, img, suffix))]
+                run_function_in_parallel_threads(inputs_fn, crop_image_to_size, image_threads)
 
         # remove dest_cur_dir
-        if not reference_plate is None: delete_folder(dest_cur_dir) 
+        if not reference_plate is None and quantification_engine=="colonyzer": delete_folder(dest_cur_dir) 
 
         # change the name, which marks that everything finished well
         os.rename(outdir_tmp, outdir)
@@ -896,15 +1222,79 @@ def get_df_fitness_measurements_one_parm_set(outdir_all, outdir_name, plate_batc
     return get_tab_as_df_or_empty_df(df_fitness_measurements_file)
 
 
-def get_growth_measurements_one_plate_batch_and_plate(Ibatch, nbatches, images_folder, outdir_all, plate_batch, plate, sorted_image_names, processed_images_dir_each_plate, reference_plate, df_plate_layout, hours_experiment):
+def write_qfa_input_files(data_path, outdir_parms, df_plate_layout, plate_batch, plate, nrows=8, ncols=12):
+
+    """Writes into outdir_parms the files that the R qfa package needs (all_images_data.dat, ExptDescription.txt, LibraryDescriptions.txt and ORF2GENE.txt) from the .dat files of data_path (colonyzer Output_Data) and the plate layout of plate_batch and plate. The .dat files are read in one concatenation and the tables are built with vectorized operations, so that the runtime is linear in the number of timepoints."""
+
+    # generate a df with fitness info of all images, with the barcode in the first place, instead of the filename
+    all_df = pd.concat([pd.read_csv("%s/%s"%(data_path, f), sep="\t", header=None) for f in os.listdir(data_path) if f.endswith(".dat")])
+    all_df[0] = get_barcode_for_filenames(all_df[0])
+    all_df = all_df.sort_values(by=[0,1,2])
+
+    # write, with the NaNs as "NA"
+    all_df.to_csv("%s/all_images_data.dat"%outdir_parms, sep="\t", index=False, header=False, na_rep="NA")
+
+    # keep the plate layout that is interesting here
+    df_plate_layout = df_plate_layout[(df_plate_layout.plate_batch==plate_batch) & (df_plate_layout.plate==plate)].set_index(["row", "column"])
+
+    # checks
+    if len(df_plate_layout[["drug", "concentration"]].drop_duplicates())!=1: raise ValueError("There should be only one plate and concentration")
+    drug = df_plate_layout.drug.iloc[0]
+    concentration = df_plate_layout.concentration.iloc[0]
+
+    # experiment descrption: file describing the inoculation times (the earliest image), library and plate number for unique plates
+    barcode_and_time = all_df[0].str.split("-", n=1, expand=True)
+    plateBarcode_to_startTime = barcode_and_time.groupby(0)[1].min()
+    exp_df = pd.DataFrame({"Barcode":plateBarcode_to_startTime.index, "Start.Time":plateBarcode_to_startTime.values, "Treatment":plate_batch, "Medium":"[%s]=%s"%(drug, concentration), "Screen":"screen", "Library":"strain", "Plate":plate, "RepQuad":1})
+    exp_df.to_csv("%s/ExptDescription.txt"%outdir_parms, sep="\t", index=False, header=True)
+
+    # library description: where you state, for each plate (from 1, 2, 3 ... and as many plates defined in ExptDescription.Plate), the name and the ORF of each spot
+    rows, cols = [x.flatten() for x in np.meshgrid(range(1, nrows+1), range(1, ncols+1), indexing="ij")]
+    strains = df_plate_layout.loc[list(zip(rows, cols)), "strain"].values
+    lib_df = pd.concat([pd.DataFrame({"Library":"strain", "ORF":strains, "Plate":plateID, "Row":rows, "Column":cols, "Notes":""}) for plateID in exp_df.Plate])
+    lib_df.to_csv("%s/LibraryDescriptions.txt"%outdir_parms, sep="\t", index=False, header=True)
+
+    # orf-to-gene to get the strains in the plot
+    orf_to_gene_df = pd.DataFrame({0:list(df_plate_layout.strain), 1:list(df_plate_layout.strain)})
+    orf_to_gene_df.to_csv("%s/ORF2GENE.txt"%outdir_parms, sep="\t", index=False, header=False)
+
+def get_growth_measurements_one_plate_batch_and_plate(Ibatch, nbatches, images_folder, outdir_all, plate_batch, plate, sorted_image_names, processed_images_dir_each_plate, reference_plate, df_plate_layout, hours_experiment, colonyzer_threads=1, image_threads=1, fitting_threads=1):
 
-    """For one plate batch and plate, runs colonyzer to get raw growth and fitness measurements."""
+    """For one plate batch and plate, runs colonyzer to get raw growth and fitness measurements. colonyzer_threads and image_threads are passed to run_colonyzer_one_set_of_parms. With qfa, the spots are fit in fitting_threads shards."""
 
     print_with_runtime("Getting fitness measurements for plate_batch-plate %i/%i: %s-plate%i"%(Ibatch, nbatches, plate_batch, plate))
 
     # define final file
     outdir_name = "output_%s"%("_".join(sorted(parms_colonyzer)))
     integrated_growth_df_file = "%s/%s/all_images_data.tab"%(outdir_all, outdir_name)
+
+    # get the keys of the artifacts of colonyzer (from the images, coordinates and parameters) and the fitness calculations (adding the plate layout and the R script)
+    if use_artifact_cache is True and file_is_empty(integrated_growth_df_file):
+
+        colonyzer_inputs = [get_sha256_file("%s/%s"%(images_folder, f)) for f in sorted_image_names + ["Colonyzer.txt"]]
+        if not reference_plate is None: colonyzer_inputs.append(get_sha256_file("%s/%s_plate%i/%s"%(processed_images_dir_each_plate, reference_plate[0], reference_plate[1], get_sorted_image_names_plate_dir("%s/%s_plate%i"%(processed_images_dir_each_plate, reference_plate[0], reference_plate[1]))[-1])))
+        # the outputs without the plots of all images (--lazy_colonyzer_plots) are kept apart from those of full runs
+        colonyzer_key_parts = ["colonyzer_v1", colonyzer_inputs, sorted(parms_colonyzer), reference_plate]
+        if quantification_engine!="colonyzer": colonyzer_key_parts.append(quantification_engine)
+        if lazy_colonyzer_plots is True: colonyzer_key_parts.append("lazy_colonyzer_plots")
+        colonyzer_artifact_key = get_artifact_key(colonyzer_key_parts)
+
+        df_plate_layout_plate = df_plate_layout[(df_plate_layout.plate_batch==plate_batch) & (df_plate_layout.plate==plate)].sort_values(by=["row", "column"])
+        if fitting_engine=="qfa": fitness_artifact_key = get_artifact_key(["fitness_v1", colonyzer_artifact_key, plate_batch, int(plate), df_plate_layout_plate[sorted(df_plate_layout_plate.columns)].to_csv(index=False), hours_experiment, get_sha256_file("%s/get_fitness_measurements.R"%ScriptsDir)])
+        else: fitness_artifact_key = get_artifact_key(["fitness_v1", colonyzer_artifact_key, plate_batch, int(plate), df_plate_layout_plate[sorted(df_plate_layout_plate.columns)].to_csv(index=False), hours_experiment, get_sha256_file("%s/logistic_fitting.py"%ScriptsDir), fitting_engine])
+
+        # restore the colonyzer outputs and the fitness files
+        outdir_parms = "%s/%s"%(outdir_all, outdir_name)
+        if not os.path.isdir(outdir_parms): 
+            make_folder(outdir_all)
+            restore_artifact("colonyzer", colonyzer_artifact_key, {outdir_name : outdir_parms})
+
+        fitness_artifact_dir = get_artifact_dir("fitness", fitness_artifact_key)
+        if os.path.isdir(outdir_parms) and os.path.isdir(fitness_artifact_dir): 
+            restore_artifact("fitness", fitness_artifact_key, {f : "%s/%s"%(outdir_parms, f) for f in os.listdir(fitness_artifact_dir)})
+
+        if not file_is_empty(integrated_growth_df_file): print_with_runtime("Growth measurements for %s-plate%i taken from the artifact cache"%(plate_batch, plate))
+
     if file_is_empty(integrated_growth_df_file):
 
         ########## RUN COLONYZER #############
@@ -927,108 +1317,46 @@ def get_growth_measurements_one_plate_batch_and_plate(Ibatch, nbatches, images_f
         image_names_withoutExtension = set({x.split(".")[0] for x in sorted_image_names})
 
         # run colonyzer for all parameters
-        run_colonyzer_one_set_of_parms(parms_colonyzer, outdir_all, image_names_withoutExtension, processed_images_dir_each_plate, reference_plate)
+        run_colonyzer_one_set_of_parms(parms_colonyzer, outdir_all, image_names_withoutExtension, processed_images_dir_each_plate, reference_plate, colonyzer_threads=colonyzer_threads, image_threads=image_threads)
 
         # go back to the initial dir
         os.chdir(initial_dir)
 
+        # keep the colonyzer outputs, before adding any file
+        if use_artifact_cache is True: save_artifact("colonyzer", colonyzer_artifact_key, {outdir_name : "%s/%s"%(outdir_all, outdir_name)})
+
         ######################################
 
-        ############ CREATE DAT FILE ##############
+        ############ CREATE QFA INPUTS ##############
 
         # get the data path
         data_path = "%s/%s/Output_Data"%(outdir_all, outdir_name)
 
-        # generate a df with fitness info of all images
-        all_df = pd.DataFrame()
-
-        for f in [x for x in os.listdir(data_path) if x.endswith(".dat")]: 
-            df = pd.read_csv("%s/%s"%(data_path, f), sep="\t", header=None)
-            all_df = all_df.append(df)
-
-        # add barcode in the first place, instead of the filename
-        all_df[0] = get_barcode_for_filenames(all_df[0])
-
-        # sort the values
-        all_df = all_df.sort_values(by=[0,1,2])
-
-        # change the NaN by "NA"
-        def change_NaN_to_str(cell):
-            if pd.isna(cell): return "NA"
-            else: return cell
-
-        all_df = all_df.applymap(change_NaN_to_str)
-
-        # use qfa to generate the df with growth
-        integrated_growth_df_dat_file = "%s/%s/all_images_data.dat"%(outdir_all, outdir_name)
-        all_df.to_csv(integrated_growth_df_dat_file, sep="\t", index=False, header=False)
-
-        ###########################################
-
-        ######### CREATE EXTRA FIELDS ########
-
-        # create the files that are necessary for the R qfa package to generate the output files
-
-        # keep the plate layout that is interesting here
-        df_plate_layout = df_plate_layout[(df_plate_layout.plate_batch==plate_batch) & (df_plate_layout.plate==plate)].set_index(["row", "column"])
-
-        # checks
-        if len(df_plate_layout[["drug", "concentration"]].drop_duplicates())!=1: raise ValueError("There should be only one plate and concentration")
-        drug = df_plate_layout.drug.iloc[0]
-        concentration = df_plate_layout.concentration.iloc[0]
-
-        # experiment descrption: file describing the inoculation times, library and plate number for unique plates. 
-        exp_df = pd.DataFrame()
-
-        # get all plates
-        for I, plateBarcode in enumerate(set([x.split("-")[0] for x in all_df[0]])): 
-
-            startTime = min(all_df[all_df[0].apply(lambda x: x.startswith(plateBarcode))][0].apply(lambda y: "-".join(y.split("-")[1:])))
-            dict_data = {"Barcode":plateBarcode, "Start.Time":startTime, "Treatment": plate_batch, "Medium":"[%s]=%s"%(drug, concentration) ,"Screen":"screen", "Library":"strain", "Plate": plate, "RepQuad":1}
-
-            exp_df = exp_df.append(pd.DataFrame({k: {I+1 : v} for k, v in dict_data.items()}))
-
-        # write
-        exp_df.to_csv("%s/%s/ExptDescription.txt"%(outdir_all, outdir_name), sep="\t", index=False, header=True)
-
-        # library description: where you state, for each plate (from 1, 2, 3 ... and as many plates defined in ExptDescription.Plate, the name and the ORF, if interestning)
-        lib_df = pd.DataFrame()
-
-        # define the rows and cols
-        nWells_ro_NrowsNcols = {96:(8, 12)}
-
-        for barcode, plateID in exp_df[["Barcode", "Plate"]].values:
-            for row in range(1, nWells_ro_NrowsNcols[96][0]+1):
-                for col in range(1, nWells_ro_NrowsNcols[96][1]+1):
-
-                    # get the strain
-                    strain = df_plate_layout.loc[(row, col), "strain"]
-
-                    # add to df
-                    dict_data = {"Library":"strain", "ORF":strain, "Plate":plateID, "Row":row, "Column":col, "Notes":""}
-                    lib_df = lib_df.append(pd.DataFrame({k: {plateID : v} for k, v in dict_data.items()}))
-
-        # write
-        lib_df.to_csv("%s/%s/LibraryDescriptions.txt"%(outdir_all, outdir_name), sep="\t", index=False, header=True)
-
-        # orf-to-gene to get the strains in the plot
-        orf_to_gene_df = pd.DataFrame({0:list(df_plate_layout.strain), 1:list(df_plate_layout.strain)})
-        orf_to_gene_df.to_csv("%s/%s/ORF2GENE.txt"%(outdir_all, outdir_name), sep="\t", index=False, header=False)
+        # generate the files that are necessary for the R qfa package to generate the output files (all_images_data.dat, ExptDescription.txt, LibraryDescriptions.txt and ORF2GENE.txt)
+        write_qfa_input_files(data_path, "%s/%s"%(outdir_all, outdir_name), df_plate_layout, plate_batch, plate)
 
         ######################################
 
         ########### GET GROWTH DF ##########
 
-        # generate the plots with R
+        # generate the fits and plots with R, or with numpy (in this process)
         fitness_measurements_std = "%s/fitness_measurements.std"%data_path
         days_experiment = hours_experiment/24
-        try: run_cmd("/workdir_app/scripts/get_fitness_measurements.R %s %s > %s 2>&1"%("%s/%s"%(outdir_all, outdir_name), days_experiment, fitness_measurements_std), env="main_env")
-        except: raise ValueError("Error in get_fitness_measurements.R. This is the log:\n---\n%s\n---"%("".join(open(fitness_measurements_std, "r").readlines())))
-        remove_file(fitness_measurements_std)
+        if fitting_engine=="numpy": log_fit.run_fitness_measurements("%s/%s"%(outdir_all, outdir_name), days_experiment)
+        else:
+            run_fitness_measurements_R("%s/%s"%(outdir_all, outdir_name), days_experiment, fitness_measurements_std, threads=fitting_threads)
+            remove_file(fitness_measurements_std)
 
         # keep
         os.rename("%s/%s/processed_all_data.tbl"%(outdir_all, outdir_name), integrated_growth_df_file)
 
+        # keep the files generated after colonyzer (the fitness calculations)
+        if use_artifact_cache is True:
+            colonyzer_artifact_dir = get_artifact_dir("colonyzer", colonyzer_artifact_key)
+            if os.path.isdir(colonyzer_artifact_dir): colonyzer_artifact_files = set(os.listdir("%s/%s"%(colonyzer_artifact_dir, outdir_name)))
+            else: colonyzer_artifact_files = {"Output_Images", "Output_Data", "Output_Reports"}
+            save_artifact("fitness", fitness_artifact_key, {f : "%s/%s/%s"%(outdir_all, outdir_name, f) for f in os.listdir("%s/%s"%(outdir_all, outdir_name)) if f not in colonyzer_artifact_files})
+
         ####################################
     
 
@@ -1504,6 +1832,20 @@ def get_susceptibility_df(fitness_df, fitness_estimates, min_points_to_calculate
 
     return get_tab_as_df_or_empty_df(filename)
 
+def get_plate_quadrant_crop_box(w, h, plate, as_int=False):
+
+    """Gets the box (left, top, right, bottom) of the quadrant of an image of size w,h that has the plate. as_int returns the pixel coordinates that PIL uses to crop with this box (it rounds them), which can be used to slice arrays."""
+
+    # map each quadrant (plate) to the coordinates to crop ((left, top, right, bottom)). These are two points (from, to). The upper-left is 0,0 and the lower-left is w,h
+    plate_to_coords = {1 : (0, 0, w/2, h/2),
+                       2 : (w/2, 0, w, h/2),
+                       3 : (0, h/2, w/2, h),
+                       4 : (w/2, h/2, w, h) 
+                       }
+
+    if as_int is True: return tuple([int(round(x)) for x in plate_to_coords[plate]])
+    else: return plate_to_coords[plate]
+
 def generate_croped_image(origin_image, cropped_image, plate):
 
     """Generates a cropped image which is a quadrant (specified by plate) of the origin_image"""
@@ -1513,16 +1855,9 @@ def generate_croped_image(origin_image, cropped_image, plate):
         # open the image
         image_object = PIL_Image.open(origin_image)
         w, h = image_object.size 
-
-        # map each quadrant (plate) to the coordinates to crop ((left, top, right, bottom)). These are two points (from, to). The upper-left is 0,0 and the lower-left is w,h
-        plate_to_coords = {1 : (0, 0, w/2, h/2),
-                           2 : (w/2, 0, w, h/2),
-                           3 : (0, h/2, w/2, h),
-                           4 : (w/2, h/2, w, h) 
-                           }
           
         # crop the image
-        cropped_image_object = image_object.crop(plate_to_coords[plate])
+        cropped_image_object = image_object.crop(get_plate_quadrant_crop_box(w, h, plate))
 
         # checks
         cropped_w, cropped_h = cropped_image_object.size
@@ -2274,9 +2609,12 @@ def plot_growth_at_different_drugs(df_fitness_measurements, plots_dir_all, fitne
         # not parallel
         for x in inputs_fn: plot_growth_at_different_drugs_one_fitness_estimate_and_drug(x[0], x[1], x[2], x[3], x[4], x[5], x[6], x[7], x[8])
 
-def run_function_in_parallel(inputs_fn, parallel_fun, ntries=1):
+def run_function_in_parallel(inputs_fn, parallel_fun, ntries=1, threads=None):
+
+    """Runs any function in parallel and returns the list of outputs. threads defaults to the number of cpus. If threads is 1 the function is run sequentially in this process (useful when already running within a pool)."""
 
-    """Runs any function in parallel"""
+    # define the threads
+    if threads is None: threads = multiproc.cpu_count()
 
     # init float that indicates if it worked
     fun_worked = False
@@ -2286,12 +2624,16 @@ def run_function_in_parallel(inputs_fn, parallel_fun, ntries=1):
 
         try:
 
+            # run sequentially
+            if threads==1: outputs = [parallel_fun(*inputs) for inputs in inputs_fn]
+
             # run
-            with multiproc.Pool(multiproc.cpu_count()) as pool:
+            else:
+                with multiproc.Pool(threads) as pool:
 
-                pool.starmap(parallel_fun, inputs_fn, chunksize=1)
-                pool.close()
-                pool.terminate()
+                    outputs = pool.starmap(parallel_fun, inputs_fn, chunksize=1)
+                    pool.close()
+                    pool.terminate()
 
             # keep that it worked
             fun_worked = True
@@ -2307,6 +2649,21 @@ def run_function_in_parallel(inputs_fn, parallel_fun, ntries=1):
     # debug. If you arrived here it should have worked
     if fun_worked is False: raise ValueError("Function did not work")
 
+    return outputs
+
+def run_function_in_parallel_threads(inputs_fn, parallel_fun, threads):
+
+    """Runs parallel_fun for each of inputs_fn on threads (which works within the processes of a pool) and returns the list of outputs. This is for functions that spend their time in I/O or PIL (which release the GIL)."""
+
+    if threads==1: return [parallel_fun(*inputs) for inputs in inputs_fn]
+
+    with multiproc.pool.ThreadPool(threads) as pool:
+        outputs = pool.starmap(parallel_fun, inputs_fn, chunksize=1)
+        pool.close()
+        pool.terminate()
+
+    return outputs
+
 def get_only_element_of_list(x):
 
     """Takes a list with only one element"""
@@ -2612,35 +2969,27 @@ def get_df_plate_layout_and_all_drugs_from_long_format(plate_layout_file, images
     return df_plate_layout, all_drugs
 
 
-def save_folder_as_zip(input_dir_path, zip_filename):
+def save_files_as_zip(file_to_arcname, zip_filename, compression="stored"):
 
-    """Converts a folder to .zip."""
+    """Writes the files of file_to_arcname (a dict that maps each file to its name in the zip) into zip_filename, without copying them to a folder first. compression can be 'stored' or 'deflated'."""
 
     # init a tmp file
     zip_filename_tmp = "%s.tmp.zip"%zip_filename
 
-    # Create a new zip file and open it in write mode
-    with zipfile.ZipFile(zip_filename_tmp, "w") as zip_file:
-
-        # Iterate over all the files and folders in the input directory
-        for root, dirs, files in os.walk(input_dir_path):
-            for file in files:
-
-                # Add each file in the input directory to the zip file
-                file_path = os.path.join(root, file)
-                zip_file.write(file_path, os.path.relpath(file_path, input_dir_path))
+    # write each file, following the links
+    with zipfile.ZipFile(zip_filename_tmp, "w", compression={"stored":zipfile.ZIP_STORED, "deflated":zipfile.ZIP_DEFLATED}[compression]) as zip_file:
+        for file, arcname in sorted(file_to_arcname.items(), key=lambda x: x[1]): zip_file.write(file, arcname)
 
     # keep
-    delete_folder(input_dir_path)
     os.rename(zip_filename_tmp, zip_filename)
 
+def run_imageJ_macro(lines, macro_file, delete_files=True, memory_mb=None):
 
-def run_imageJ_macro(lines, macro_file, delete_files=True):
-
-    """Writes and runs an imageJ macro"""
+    """Writes and runs an imageJ macro. memory_mb sets the maximum heap of the JVM, which is needed when several imageJ run at the same time."""
 
     # define the imageJ binary
     imageJ_binary = "/workdir_app/Fiji.app/ImageJ-linux64"
+    if memory_mb is not None: imageJ_binary += " --mem=%im"%memory_mb
 
     # write macro
     remove_file(macro_file)
@@ -2810,6 +3159,39 @@ def get_images_with_enhanced_contrast_all_images_concatenated(tmpdir, plate_batc
     return modified_plate_batch_to_raw_outdir
 
 
+def get_imageJ_histogram_one_image(filename, pixel_stride=1):
+
+    """Gets the imageJ histogram of the RGB image in filename, only considering one every pixel_stride rows and columns"""
+
+    return get_imageJ_histogram_RGB_image(get_RGB_array_image(filename)[::pixel_stride, ::pixel_stride])[0]
+
+def get_global_histogram_contrast_LUT(all_images, histogram_file, pixel_stride=1, artifact_key=None):
+
+    """Gets the contrast LUT that imageJ's 'Enhance Contrast... saturated=0.3' would generate on all images concatenated, without loading them together. The histogram is summed over all images in parallel (one image in memory for each process), optionally from a subsample of pixels (pixel_stride>1), and saved into histogram_file. If artifact_key is provided, the histogram is taken from / saved into the artifacts."""
+
+    # get from the artifacts
+    if file_is_empty(histogram_file) and artifact_key is not None: restore_artifact("global_histogram", artifact_key, {"histogram.txt" : histogram_file})
+
+    # get the histogram
+    if file_is_empty(histogram_file):
+
+        print_with_runtime("Getting the histogram of %i images on %i threads (pixel_stride=%i)..."%(len(all_images), multiproc.cpu_count(), pixel_stride))
+        global_histogram = np.sum(run_function_in_parallel([(img, pixel_stride) for img in all_images], get_imageJ_histogram_one_image), axis=0)
+
+        histogram_file_tmp = "%s.tmp"%histogram_file
+        open(histogram_file_tmp, "w").write("\n".join([str(x) for x in global_histogram])+"\n")
+        os.rename(histogram_file_tmp, histogram_file)
+
+        if artifact_key is not None: save_artifact("global_histogram", artifact_key, {"histogram.txt" : histogram_file})
+
+    global_histogram = [int(l.strip()) for l in open(histogram_file, "r").readlines()]
+
+    # get the LUT. If None, the images are not changed
+    contrast_LUT = get_imageJ_enhance_contrast_LUT(global_histogram)
+    if contrast_LUT is None: contrast_LUT = np.arange(256, dtype=np.uint8)
+
+    return contrast_LUT
+
 def get_contrast_for_image(filename):
 
     """Gets the contrast for the image"""
@@ -2820,31 +3202,373 @@ def get_contrast_for_image(filename):
     # returrn contrast
     return contrast_value
 
+def get_contrast_for_image_reduced(filename, reduce_factor=4):
+
+    """Gets the contrast (RMS of the first band, as get_contrast_for_image) on the image reduced reduce_factor times in each dimension. jpg images are reduced while decoding (draft), and the others with box averaging. Box averaging can only lower the RMS: the squared RMS at full resolution minus the squared RMS of the reduced image is the mean variance within each reduce_factor x reduce_factor block (plus the effect of the <reduce_factor pixels cropped at the edges). Thus the reduced score is a lower bound, and the error is small for smooth scans."""
+
+    # load a reduced image
+    image = PIL_Image.open(filename)
+    reduced_size = (max([1, image.size[0]//reduce_factor]), max([1, image.size[1]//reduce_factor]))
+    image.draft(image.mode, reduced_size)
+    if image.size!=reduced_size: image = image.resize(reduced_size, PIL_Image.BOX, box=(0, 0, reduced_size[0]*(image.size[0]//reduced_size[0]), reduced_size[1]*(image.size[1]//reduced_size[1])))
+
+    return ImageStat.Stat(image).rms[0]
+
+def get_image_to_contrast(all_images, reduce_factor=4):
+
+    """Returns a series that maps each image to get_contrast_for_image_reduced (or get_contrast_for_image if reduce_factor is 1), calculated in parallel. The contrast of each image is saved in CacheDir (in one file named by the path, size and modification time of the image), so that images that were already scored are not read again."""
+
+    # define the key of each image
+    def get_image_key(img): 
+        img_stat = os.stat(img)
+        return "%s|%i|%i|%i"%(os.path.realpath(img), img_stat.st_size, img_stat.st_mtime_ns, reduce_factor)
+
+    image_to_key = {img : get_image_key(img) for img in all_images}
+
+    # load the previously calculated scores. There is one file for each image, so that runs sharing the cache do not overwrite each other's scores
+    cache_dir = get_cache_dir("contrast_scores")
+    key_to_contrast = {}
+    if cache_dir is not None:
+        key_to_scores_file = {key : "%s/%s.txt"%(cache_dir, hashlib.sha256(key.encode()).hexdigest()) for key in set(image_to_key.values())}
+        for key, scores_file in key_to_scores_file.items():
+            if not file_is_empty(scores_file): key_to_contrast[key] = float(open(scores_file, "r").read().strip())
+
+    # get the missing scores in parallel
+    missing_images = [img for img in all_images if image_to_key[img] not in key_to_contrast]
+    if len(missing_images)>0:
+
+        print_with_runtime("Getting the contrast of %i images on %i threads..."%(len(missing_images), multiproc.cpu_count()))
+        if reduce_factor==1: missing_contrasts = run_function_in_parallel([(img,) for img in missing_images], get_contrast_for_image)
+        else: missing_contrasts = run_function_in_parallel([(img, reduce_factor) for img in missing_images], get_contrast_for_image_reduced)
+        for img, contrast in zip(missing_images, missing_contrasts): 
+            key_to_contrast[image_to_key[img]] = contrast
+
+            # save, with a unique tmp file because several runs can share the cache
+            if cache_dir is not None:
+                scores_file = key_to_scores_file[image_to_key[img]]
+                scores_file_tmp = "%s.%s.tmp"%(scores_file, id_generator())
+                open(scores_file_tmp, "w").write("%s\n"%repr(float(contrast)))
+                os.rename(scores_file_tmp, scores_file)
+
+    return pd.Series({img : key_to_contrast[image_to_key[img]] for img in all_images})
+
+def get_image_highest_contrast(all_images, reduce_factor=4, min_candidates=5, min_fraction_best_reduced=0.9):
+
+    """Returns the image of all_images with the highest get_contrast_for_image. The images are first scored on reduced images (get_image_to_contrast), which is a lower bound of their contrast and may not keep the ranking. Thus, the top min_candidates images and all those with a reduced score above min_fraction_best_reduced of the best one are scored again at full resolution, and the best of them is returned."""
+
+    # score the reduced images
+    image_to_contrast_reduced = get_image_to_contrast(all_images, reduce_factor=reduce_factor).sort_values()
+
+    # score the candidates at full resolution
+    candidate_images = set(image_to_contrast_reduced.index[-min_candidates:]).union(set(image_to_contrast_reduced[image_to_contrast_reduced>=(image_to_contrast_reduced.iloc[-1]*min_fraction_best_reduced)].index))
+    image_to_contrast = get_image_to_contrast([img for img in all_images if img in candidate_images], reduce_factor=1)
+
+    return image_to_contrast.sort_values().index[-1]
+
+def get_cache_dir(name):
+
+    """Returns a subfolder of CacheDir (created if needed), or None if the cache is not available"""
+
+    if not os.path.isdir(CacheDir): return None
+
+    cache_dir = "%s/%s"%(CacheDir, name)
+    make_folder(cache_dir)
+    return cache_dir
+
+def get_artifact_key(parts):
+
+    """Gets the key of an artifact, as the sha256 of the (json serializable) parts that define it (i.e. the hashes of the inputs and the parameters)"""
+
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+def get_artifact_dir(kind, key):
+
+    """Returns the folder of an artifact (which may not exist) in CacheDir/artifacts, or None if the artifact cache is not used"""
+
+    if use_artifact_cache is False: return None
+
+    artifacts_dir = get_cache_dir("artifacts")
+    if artifacts_dir is None: return None
+
+    return "%s/%s/%s/%s"%(artifacts_dir, kind, key[0:2], key)
+
+def save_artifact(kind, key, name_to_path):
+
+    """Saves an artifact with the files or folders of name_to_path (copied as <artifact dir>/<name>), if the artifact cache is used and the artifact does not exist"""
+
+    artifact_dir = get_artifact_dir(kind, key)
+    if artifact_dir is None or os.path.isdir(artifact_dir): return
+
+    # copy into a unique tmp folder, because several runs can share the cache
+    artifact_dir_tmp = "%s.%s.tmp"%(artifact_dir, id_generator())
+    os.makedirs(artifact_dir_tmp)
+    for name, path in name_to_path.items():
+        if os.path.isdir(path): shutil.copytree(path, "%s/%s"%(artifact_dir_tmp, name))
+        else: shutil.copyfile(path, "%s/%s"%(artifact_dir_tmp, name))
+
+    # set the permissions here (copytree keeps those of the outputs), so that the whole cache does not need to be changed at the end of each module
+    fs_fun.chmod_recursive(artifact_dir_tmp)
+
+    # keep. If another run saved it in the meantime, keep that one
+    try: os.rename(artifact_dir_tmp, artifact_dir)
+    except OSError: delete_folder(artifact_dir_tmp)
+
+def restore_artifact(kind, key, name_to_path):
+
+    """Copies the files or folders of an artifact (<artifact dir>/<name>) into the paths of name_to_path. Returns False if the artifact is not available"""
+
+    artifact_dir = get_artifact_dir(kind, key)
+    if artifact_dir is None or not os.path.isdir(artifact_dir): return False
+
+    for name, path in name_to_path.items():
+        artifact_path = "%s/%s"%(artifact_dir, name)
+
+        if os.path.isdir(artifact_path):
+            path_tmp = "%s_tmp"%path; delete_folder(path_tmp)
+            shutil.copytree(artifact_path, path_tmp)
+            os.rename(path_tmp, path)
+
+        else: copy_file(artifact_path, path)
+
+    return True
+
+def get_processed_quadrant_artifact_key(raw_image_sha256, plate, enhance_image_contrast, contrast_fingerprint, image_engine):
+
+    """Gets the artifact key of the processed image of one plate"""
+
+    return get_artifact_key(["processed_quadrant_v1", raw_image_sha256, plate, enhance_image_contrast, contrast_fingerprint, image_engine])
+
+def get_processed_quadrant_artifact_inputs(tmpdir, processed_images_dir_each_plate, plate_batch_to_images, plate_batch_to_plates, enhance_image_contrast, contrast_fingerprint, image_engine):
+
+    """Gets a list of (key, cropped image) for all processed images of each plate, based on the sha256 in the image catalog"""
+
+    image_catalog = load_image_catalog("%s/image_catalog.json"%tmpdir)
+    pb_image_to_sha256 = {(x["plate_batch"], x["image"]) : x["sha256"] for x in image_catalog["images"]}
+
+    artifact_inputs = []
+    for plate_batch, images in plate_batch_to_images.items():
+        for plate in plate_batch_to_plates[plate_batch]:
+            for img in images: 
+                key = get_processed_quadrant_artifact_key(pb_image_to_sha256[(plate_batch, img)], plate, enhance_image_contrast, contrast_fingerprint, image_engine)
+                artifact_inputs.append((key, "%s/%s_plate%i/%s"%(processed_images_dir_each_plate, plate_batch, plate, img)))
+
+    return artifact_inputs
+
+def restore_processed_quadrant_artifact(key, cropped_image):
+
+    """Restores one processed image of one plate from the artifacts, if not already there"""
+
+    if file_is_empty(cropped_image): restore_artifact("processed_quadrant", key, {"image.tif" : cropped_image})
+
+def save_processed_quadrant_artifact(key, cropped_image): save_artifact("processed_quadrant", key, {"image.tif" : cropped_image})
+
+def get_auto_image_high_contrast_array(width, height, square_size=100, bg_color_img="black"):
+
+    """Returns the (height, width, 3) array of the checkerboard of generate_auto_image_high_contrast, where the squares with the same parity in x and y are black and the others are bg_color_img"""
+
+    # define the pixels where x and y squares have the same parity
+    squares_x = (np.arange(width)//square_size) % 2
+    squares_y = (np.arange(height)//square_size) % 2
+    same_parity = squares_y[:, None]==squares_x[None, :]
+
+    # create the image
+    image_array = np.empty((height, width, 3), dtype=np.uint8)
+    image_array[:] = ImageColor.getrgb(bg_color_img)
+    image_array[same_parity] = (0, 0, 0)
+
+    return image_array
+
 def generate_auto_image_high_contrast(filename, ref_image, square_size=100, bg_color_img="black"):
 
-    """Generates a image with high contrast. Most testing on square_size=100. bg_color_img="gray". In black I see that it enhances contrast at max. """
+    """Generates a image with high contrast. Most testing on square_size=100. bg_color_img="gray". In black I see that it enhances contrast at max. The image is cached in CacheDir by (width, height, square_size, bg_color_img)."""
 
     if file_is_empty(filename):
 
         # get size
         width, height = PIL_Image.open(ref_image).size
 
-        # Create a new image with the specified size and gray background
-        image = PIL_Image.new('RGB', (width, height), color=bg_color_img)
+        # define the cached image
+        cache_dir = get_cache_dir("auto_image_high_contrast")
+        if cache_dir is None: cached_image = filename
+        else: cached_image = "%s/checkerboard_w%i_h%i_square%i_%s.tif"%(cache_dir, width, height, square_size, bg_color_img.replace("#", ""))
+
+        # generate the image, with a unique tmp file because several runs can share the cache
+        if file_is_empty(cached_image):
+            cached_image_tmp = "%s.%s.tmp.tif"%(cached_image, id_generator())
+            PIL_Image.fromarray(get_auto_image_high_contrast_array(width, height, square_size=square_size, bg_color_img=bg_color_img)).save(cached_image_tmp)
+            os.rename(cached_image_tmp, cached_image)
 
-        # Iterate over the pixels in the image and set their color to black or white based on their position
-        for x in range(width):
-            for y in range(height):
-                if (x // square_size) % 2 == (y // square_size) % 2: # the higher the square_size, the bigger the squares
-                    image.putpixel((x, y), (0, 0, 0))
         # save
-        filename_tmp = "%s.tmp.tif"%filename
-        image.save(filename_tmp)
-        os.rename(filename_tmp, filename)
+        if cached_image!=filename: copy_file(cached_image, filename)
+
+def get_available_memory_bytes():
+
+    """Gets the memory that can be used in this container, as the minimum between the cgroup limit (v2 or v1) and the available memory in /proc/meminfo"""
+
+    available_memory = []
+
+    # cgroup limits, which are 'max' or a huge number if there is no limit (no file_is_empty, these are virtual files)
+    for cgroup_file in ["/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"]:
+        if os.path.isfile(cgroup_file):
+            limit = open(cgroup_file, "r").readlines()[0].strip()
+            if limit.isdigit(): available_memory.append(int(limit))
+
+    # available memory of the system (files in /proc have size 0, so file_is_empty can't be used)
+    if os.path.isfile("/proc/meminfo"):
+        for l in open("/proc/meminfo", "r").readlines():
+            if l.startswith("MemAvailable:"): available_memory.append(int(l.split()[1])*1024)
+
+    if len(available_memory)==0: raise ValueError("The available memory could not be calculated")
+    return min(available_memory)
+
+def get_imageJ_memory_mb_one_batch(image_size, reference_size):
+
+    """Gets the maximum heap (in Mb) for the imageJ JVM that processes one batch. imageJ keeps each merged RGB image as 4 bytes/pixel, with an undo snapshot and the rotated copy, so we allow 32 bytes/pixel plus 256 Mb for Fiji itself."""
+
+    (image_w, image_h), (reference_w, reference_h) = image_size, reference_size
+    merged_pixels = (image_w + reference_w)*max([image_h, reference_h])
+    return int(256 + 32*merged_pixels/1e6) + 1
+
+def get_memory_bytes_one_batch(image_size, reference_size, nimages, threads, image_engine):
+
+    """Estimates the peak memory (in bytes) of processing one batch of nimages with process_image_rotation_all_images_batch, running on threads processes."""
+
+    (image_w, image_h), (reference_w, reference_h) = image_size, reference_size
+    parallel_images = min([nimages, threads])
+
+    # numpy engine. Each process holds the decoded image, the uint16 sums, the luminance, the contrasted and the rotated arrays (~32 bytes/pixel)
+    if image_engine=="numpy": return parallel_images*image_w*image_h*32 + 100*1e6
+
+    # imagej engine. First the merged images are generated in parallel (decoded input, appended and output images ~ 10 bytes/pixel), and then one JVM runs the macro (its heap, plus ~256 Mb of non-heap memory)
+    elif image_engine=="imagej":
+        merged_pixels = (image_w + reference_w)*max([image_h, reference_h])
+        memory_merging = parallel_images*merged_pixels*10
+        memory_imageJ = (get_imageJ_memory_mb_one_batch(image_size, reference_size) + 256)*1e6
+        return max([memory_merging, memory_imageJ])
+
+    else: raise ValueError("invalid image_engine: %s"%image_engine)
+
+def get_n_concurrent_batches_and_threads(plate_batch_to_raw_outdir, plate_batch_to_images, image_highest_contrast, image_ending, image_engine, fraction_available_memory=0.8):
+
+    """Gets the number of batches that can be processed at the same time (and the threads for each of them) so that the estimated memory (from the size and number of images of each batch) does not exceed fraction_available_memory of the available memory"""
+
+    # get the size of one image of each batch, and the reference image
+    plate_batch_to_image_size = {pb : PIL_Image.open("%s/%s.%s"%(plate_batch_to_raw_outdir[pb], images[0].split(".tif")[0], image_ending)).size for pb, images in plate_batch_to_images.items()}
+    if image_highest_contrast is None: reference_size = (0, 0)
+    else: reference_size = PIL_Image.open(image_highest_contrast).size
+
+    # define the memory that can be used
+    available_memory = get_available_memory_bytes()*fraction_available_memory
+
+    # start with one batch per cpu, and decrease until the heaviest batches fit in memory
+    nbatches = len(plate_batch_to_images)
+    n_concurrent = max([1, min([nbatches, multiproc.cpu_count()])])
+    while True:
+
+        threads = max([1, multiproc.cpu_count()//n_concurrent])
+        memory_each_batch = sorted([get_memory_bytes_one_batch(plate_batch_to_image_size[pb], reference_size, len(images), threads, image_engine) for pb, images in plate_batch_to_images.items()], reverse=True)
+        if n_concurrent==1 or sum(memory_each_batch[0:n_concurrent])<=available_memory: break
+        n_concurrent -= 1
+
+    if sum(memory_each_batch[0:n_concurrent])>available_memory: print_with_runtime("WARNING: processing one batch may need %.2f Gb of memory, and only %.2f Gb are available. This may fail."%(memory_each_batch[0]/1e9, available_memory/1e9))
+
+    return n_concurrent, threads, plate_batch_to_image_size, reference_size
+
+def run_process_image_rotation_all_batches_numpy(plate_batch_to_raw_outdir, plate_batch_to_processed_outdir, plate_batch_to_images, image_ending, enhance_image_contrast, image_highest_contrast, contrast_LUT=None, fraction_available_memory=0.8):
+
+    """Runs the numpy engine of process_image_rotation_all_images_batch on the images of all batches, on one pool of processes. The number of processes is the cpus, decreased until the estimated memory (from the size of the largest image) fits in fraction_available_memory of the available memory."""
+
+    # keep the batches without processed files
+    sorted_batches = [pb for pb in sorted(plate_batch_to_images) if not os.path.isdir(plate_batch_to_processed_outdir[pb])]
+    if len(sorted_batches)==0: return
+
+    # get the number of processes
+    plate_batch_to_image_size = {pb : PIL_Image.open("%s/%s.%s"%(plate_batch_to_raw_outdir[pb], plate_batch_to_images[pb][0].split(".tif")[0], image_ending)).size for pb in sorted_batches}
+    largest_image_size = max(plate_batch_to_image_size.values(), key=lambda size: size[0]*size[1])
+    nimages = sum([len(plate_batch_to_images[pb]) for pb in sorted_batches])
+    available_memory = get_available_memory_bytes()*fraction_available_memory
+
+    threads = max([1, multiproc.cpu_count()])
+    while threads>1 and get_memory_bytes_one_batch(largest_image_size, (0, 0), nimages, threads, "numpy")>available_memory: threads -= 1
+    print_with_runtime("Processing the %i images of %i batches on %i processes%s..."%(nimages, len(sorted_batches), threads, {True:" (increasing contrast)", False:""}[enhance_image_contrast]))
+
+    # get the histogram of the image appended on the right, which only matters for the contrast
+    if contrast_LUT is None and image_highest_contrast is not None: reference_histogram, reference_size = get_imageJ_histogram_RGB_image(get_RGB_array_image(image_highest_contrast))
+    else: reference_histogram, reference_size = None, None
+
+    # define the inputs of all images, written into tmp folders
+    inputs_fn = []
+    for plate_batch in sorted_batches:
+
+        processed_outdir_tmp = "%s_tmp"%plate_batch_to_processed_outdir[plate_batch]
+        delete_folder(processed_outdir_tmp); make_folder(processed_outdir_tmp)
+        inputs_fn += [("%s/%s.%s"%(plate_batch_to_raw_outdir[plate_batch], img.split(".tif")[0], image_ending), "%s/%s"%(processed_outdir_tmp, img), enhance_image_contrast, reference_histogram, reference_size, contrast_LUT) for img in plate_batch_to_images[plate_batch]]
 
-def run_analyze_images_process_images(plate_layout_file, images_dir, outdir, enhance_image_contrast, reference_plate, contrast_enhancement_image):
+    # run
+    run_function_in_parallel(inputs_fn, process_image_rotation_and_contrast_numpy, threads=threads)
+
+    # at the end save
+    for plate_batch in sorted_batches: os.rename("%s_tmp"%plate_batch_to_processed_outdir[plate_batch], plate_batch_to_processed_outdir[plate_batch])
+
+def run_process_image_rotation_all_batches_concurrently(plate_batch_to_raw_outdir, plate_batch_to_processed_outdir, plate_batch_to_images, image_ending, enhance_image_contrast, image_highest_contrast, image_engine, contrast_LUT=None):
+
+    """Runs process_image_rotation_all_images_batch for several batches at the same time, limiting the concurrency by the memory. With the imagej engine, the batches are run on threads (the heavy work happens in imageJ subprocesses). With the numpy engine, the images of all batches are run on one pool of processes (see run_process_image_rotation_all_batches_numpy), so that no thread forks its own pool."""
+
+    # the numpy engine runs all images in one pool
+    if image_engine=="numpy": 
+        run_process_image_rotation_all_batches_numpy(plate_batch_to_raw_outdir, plate_batch_to_processed_outdir, plate_batch_to_images, image_ending, enhance_image_contrast, image_highest_contrast, contrast_LUT=contrast_LUT)
+        return
+
+    # get the concurrency
+    n_concurrent, threads, plate_batch_to_image_size, reference_size = get_n_concurrent_batches_and_threads(plate_batch_to_raw_outdir, plate_batch_to_images, image_highest_contrast, image_ending, image_engine)
+    print_with_runtime("Processing %i batches at the same time, each on %i threads..."%(n_concurrent, threads))
+
+    # define the inputs. Each imageJ gets a fixed heap, so that several JVMs do not take all the memory
+    sorted_batches = sorted(plate_batch_to_images)
+    inputs_fn = []
+    for I, plate_batch in enumerate(sorted_batches):
+
+        if n_concurrent>1 and image_engine=="imagej": imageJ_memory_mb = get_imageJ_memory_mb_one_batch(plate_batch_to_image_size[plate_batch], reference_size)
+        else: imageJ_memory_mb = None
+
+        inputs_fn.append((I+1, len(sorted_batches), plate_batch_to_raw_outdir[plate_batch], plate_batch_to_processed_outdir[plate_batch], plate_batch, plate_batch_to_images[plate_batch], image_ending, enhance_image_contrast, image_highest_contrast, image_engine, threads, imageJ_memory_mb, contrast_LUT))
+
+    # run
+    with multiproc.pool.ThreadPool(n_concurrent) as pool:
+        pool.starmap(process_image_rotation_all_images_batch, inputs_fn, chunksize=1)
+        pool.close()
+        pool.terminate()
+
+def run_process_images_and_crop_plates_numpy(plate_batch_to_raw_outdir, plate_batch_to_processed_outdir, plate_batch_to_images, plate_batch_to_plates, processed_images_dir_each_plate, image_ending, enhance_image_contrast, image_highest_contrast, keep_processed_images, contrast_LUT=None):
 
-    """Takes the images and generates processed images that are cropped to be one in each plate"""
+    """Runs process_image_and_crop_plates_numpy for all images of all batches in parallel, writing the quadrants of each plate into processed_images_dir_each_plate/<plate_batch>_plate<plate>. The full-size processed images are only written if keep_processed_images is True."""
+
+    # get the histogram of the image appended on the right, which only matters for the contrast
+    if contrast_LUT is None and image_highest_contrast is not None: reference_histogram, reference_size = get_imageJ_histogram_RGB_image(get_RGB_array_image(image_highest_contrast))
+    else: reference_histogram, reference_size = None, None
+
+    # define the inputs of all images
+    inputs_fn = []
+    for plate_batch in sorted(plate_batch_to_images):
+
+        if keep_processed_images is True: make_folder(plate_batch_to_processed_outdir[plate_batch])
+        for plate in plate_batch_to_plates[plate_batch]: make_folder("%s/%s_plate%i"%(processed_images_dir_each_plate, plate_batch, plate))
+
+        for img in plate_batch_to_images[plate_batch]:
+
+            if keep_processed_images is True: processed_image = "%s/%s"%(plate_batch_to_processed_outdir[plate_batch], img)
+            else: processed_image = None
+
+            plate_to_cropped_image = {plate : "%s/%s_plate%i/%s"%(processed_images_dir_each_plate, plate_batch, plate, img) for plate in plate_batch_to_plates[plate_batch]}
+            inputs_fn.append(("%s/%s.%s"%(plate_batch_to_raw_outdir[plate_batch], img.split(".tif")[0], image_ending), processed_image, plate_to_cropped_image, enhance_image_contrast, reference_histogram, reference_size, contrast_LUT))
+
+    # run
+    print_with_runtime("Processing and cropping %i images in one pass on %i threads..."%(len(inputs_fn), multiproc.cpu_count()))
+    run_function_in_parallel(inputs_fn, process_image_and_crop_plates_numpy)
+
+def run_analyze_images_process_images(plate_layout_file, images_dir, outdir, enhance_image_contrast, reference_plate, contrast_enhancement_image, image_engine, concurrent_batches=False, fused_image_pipeline=False, keep_processed_images=False, global_histogram_pixel_stride=1, min_image_age_seconds=0, reduced_inputs_compression="stored"):
+
+    """Takes the images and generates processed images that are cropped to be one in each plate. If concurrent_batches is True, several batches are processed at the same time. If fused_image_pipeline is True (only with the numpy image_engine), each raw image is decoded once and the plates are written directly, and the full-size processed images are only kept if keep_processed_images is True. global_histogram_pixel_stride is the subsampling used with contrast_enhancement_image=='global_histogram'. Images modified less than min_image_age_seconds ago are skipped (they may be still being written by the scanner). reduced_inputs_compression ('stored' or 'deflated') is the compression of extended_outputs/reduced_input_dir.zip."""
 
     #### LOAD INPUTS ####
 
@@ -2852,6 +3576,12 @@ def run_analyze_images_process_images(plate_layout_file, images_dir, outdir, enh
     #print_with_runtime("Debugging inputs ...")
     df_plate_layout, all_drugs, measure_susceptibility, experiment_name = get_df_plate_layout_and_all_drugs(plate_layout_file, images_dir)
 
+    # check that the fused pipeline can be run
+    if fused_image_pipeline is True and image_engine!="numpy": raise ValueError("The fused image pipeline can only be run with the numpy image_engine")
+
+    # check that the global histogram can be used
+    if contrast_enhancement_image=="global_histogram" and image_engine!="numpy": raise ValueError("The global_histogram contrast_enhancement_image can only be used with the numpy image_engine")
+
     # check that reference_plate is correct
     if not reference_plate is None:
         reference_b, reference_p = reference_plate
@@ -2884,8 +3614,9 @@ def run_analyze_images_process_images(plate_layout_file, images_dir, outdir, enh
     plate_batch_to_processed_outdir = {}
     all_endings = set()
 
-    # init the inputs to softlink images in parallel
+    # init the inputs to softlink images and get the image catalog in parallel
     inputs_fn_linking = []
+    inputs_fn_catalog = []
     
     # go through each image
     for plate_batch in sorted(set(df_plate_layout.plate_batch)):
@@ -2896,6 +3627,7 @@ def run_analyze_images_process_images(plate_layout_file, images_dir, outdir, enh
         raw_images_dir_batch = "%s/%s"%(images_dir, plate_batch)
         plate_batch_to_images[plate_batch] = set()
         plate_batch_to_raw_images[plate_batch] = set()
+        plates_batch = sorted({int(p) for p in df_plate_layout[df_plate_layout.plate_batch==plate_batch].plate})
 
         # save folders
         plate_batch_to_raw_outdir[plate_batch] = linked_raw_images_dir_batch
@@ -2912,6 +3644,11 @@ def run_analyze_images_process_images(plate_layout_file, images_dir, outdir, enh
                 print_with_runtime("WARNING: File <images>/%s/%s not considered as an image. Note that only images ending with %s (and not starting with a '.') are considered"%(plate_batch, f, allowed_image_endings))
                 continue
 
+            # skip recent images
+            if min_image_age_seconds>0 and (time.time() - os.stat("%s/%s"%(raw_images_dir_batch, f)).st_mtime)<min_image_age_seconds:
+                print_with_runtime("Skipping <images>/%s/%s, which was modified less than %i seconds ago"%(plate_batch, f, min_image_age_seconds))
+                continue
+
             # define the file ending
             year, month, day, hour, minute = get_yyyymmddhhmm_tuple_one_image_name(f)
             year = str(year)
@@ -2932,6 +3669,7 @@ def run_analyze_images_process_images(plate_layout_file, images_dir, outdir, enh
             # keep image
             plate_batch_to_images[plate_batch].add(get_file(processed_image))
             plate_batch_to_raw_images[plate_batch].add(get_file(linked_raw_image))
+            inputs_fn_catalog.append((plate_batch, plates_batch, "%s/%s"%(raw_images_dir_batch, f), get_file(linked_raw_image), get_file(processed_image)))
 
         # sort images by date
         plate_batch_to_images[plate_batch] = sorted(plate_batch_to_images[plate_batch], key=get_yyyymmddhhmm_tuple_one_image_name)
@@ -2944,6 +3682,29 @@ def run_analyze_images_process_images(plate_layout_file, images_dir, outdir, enh
     print_with_runtime("Linking images in parallel on %i threads..."%multiproc.cpu_count())
     run_function_in_parallel(inputs_fn_linking, soft_link_files)
 
+    # write the catalog of images, used by the next steps
+    generate_image_catalog("%s/image_catalog.json"%tmpdir, inputs_fn_catalog)
+
+    ######## CREATE FILE TO REPRODUCE #########
+
+    # write a zip that contains the plate_layout.xlsx and a subset of 4 images for each input file. This runs in the background, and it is waited for at the end of this function.
+    reduced_input_dir_file = "%s/reduced_input_dir.zip"%extended_outdir
+    if file_is_empty(reduced_input_dir_file):
+
+        print_with_runtime("Generating reduced inputs in the background...")
+        file_to_arcname = {plate_layout_file : "plate_layout.xlsx", "/small_inputs/command.txt" : "command.txt"}
+        for plate_batch, sorted_raw_images in plate_batch_to_raw_images.items():
+            subset_images = [sorted_raw_images[int(idx)] for idx in np.linspace(0, len(sorted_raw_images)-1, 4)]
+            for img in subset_images: file_to_arcname["%s/%s/%s"%(linked_raw_images_dir, plate_batch, img)] = "%s/%s"%(plate_batch, img)
+
+        reduced_inputs_process = multiproc.Process(target=save_files_as_zip, args=(file_to_arcname, reduced_input_dir_file, reduced_inputs_compression))
+        reduced_inputs_process.start()
+
+    else: reduced_inputs_process = None
+
+    ###########################################
+
+
     # log
     #start_time_rotation_contrast = time.time()
 
@@ -2954,14 +3715,13 @@ def run_analyze_images_process_images(plate_layout_file, images_dir, outdir, enh
         plate_batch_to_raw_outdir = get_images_with_enhanced_contrast_all_images_concatenated(tmpdir, plate_batch_to_raw_outdir, plate_batch_to_images, image_ending) # this is not efficient because it does not scale
     """
 
-    # amongst the images you have get the one with the highest cotrast
-    all_images = sorted(make_flat_listOflists([["%s/%s"%(plate_batch_to_raw_outdir[pb], img) for img in images] for pb, images in plate_batch_to_images.items()]))
-    image_to_contrast = pd.Series(dict(zip(all_images, map(get_contrast_for_image, all_images))))
-    real_image_highest_contrast = image_to_contrast.sort_values().index[-1]
-
-    # define the image of contrast for reference
+    # define the image of contrast for reference. Only global_histogram uses a contrast_LUT
+    contrast_LUT = None
     if contrast_enhancement_image=="image_high_contrast":
-        image_high_contrast = real_image_highest_contrast
+
+        # amongst the images you have get the one with the highest cotrast
+        all_images = sorted(make_flat_listOflists([["%s/%s.%s"%(plate_batch_to_raw_outdir[pb], img.split(".tif")[0], image_ending) for img in images] for pb, images in plate_batch_to_images.items()]))
+        image_high_contrast = get_image_highest_contrast(all_images)
         if enhance_image_contrast is True: print("Using image with highest contrast (%s) as reference for contrast enhancement..."%("/".join(image_high_contrast.split("/")[-2:])))
 
     elif contrast_enhancement_image=="auto":
@@ -2969,14 +3729,55 @@ def run_analyze_images_process_images(plate_layout_file, images_dir, outdir, enh
         generate_auto_image_high_contrast(image_high_contrast, "%s/%s"%(plate_batch_to_raw_outdir[plate_batch], plate_batch_to_images[plate_batch][0]))
         if enhance_image_contrast is True: print("Using automatic high-contrast image as reference for contrast enhancement...")
 
+    elif contrast_enhancement_image=="global_histogram":
+        image_high_contrast = None
+        if enhance_image_contrast is True: 
+            print("Using the histogram of all images for contrast enhancement...")
+            all_raw_images = make_flat_listOflists([["%s/%s.%s"%(plate_batch_to_raw_outdir[pb], img.split(".tif")[0], image_ending) for img in images] for pb, images in sorted(plate_batch_to_images.items())])
+            # the histogram file is named by the hashes of the images and the stride, so that it is recalculated if the images change
+            global_histogram_artifact_key = get_artifact_key(["global_histogram_v1", sorted([x["sha256"] for x in load_image_catalog("%s/image_catalog.json"%tmpdir)["images"]]), global_histogram_pixel_stride])
+            contrast_LUT = get_global_histogram_contrast_LUT(all_raw_images, "%s/global_contrast_histogram_%s.txt"%(tmpdir, global_histogram_artifact_key), pixel_stride=global_histogram_pixel_stride, artifact_key=global_histogram_artifact_key)
+
     else: raise ValueError("invalid contrast_enhancement_image: %s"%contrast_enhancement_image)
 
     # check that contrast correction is reasonable (only reasonable with generate_auto_image_high_contrast run without black)
     # if enhance_image_contrast is True and get_contrast_for_image(real_image_highest_contrast)>get_contrast_for_image(image_high_contrast): raise ValueError("The image with highest contrast has a higher contrast value (RMS=%.2f) than the image used as reference for contrast correction (RMS=%.2f). This is not allowed because it may bias the data. This likely means that your images have high contrast, so that you can run with enhance_image_contrast:False."%(get_contrast_for_image(real_image_highest_contrast), get_contrast_for_image(image_high_contrast)))
 
 
+    # define a folder that will contain the linked images for each individual processing
+    processed_images_dir_each_plate = "%s/processed_images_each_plate"%tmpdir; make_folder(processed_images_dir_each_plate)
+    plate_batch_to_plates = {pb : sorted({int(p) for p in df_plate_layout[df_plate_layout.plate_batch==pb].plate}) for pb in plate_batch_to_images}
+    for pb, plates in plate_batch_to_plates.items(): 
+        for p in plates: make_folder("%s/%s_plate%i"%(processed_images_dir_each_plate, pb, p))
+
+    # get the processed images of each plate from the artifacts, and only process the images that are missing
+    plate_batch_to_images_to_process = plate_batch_to_images
+    if use_artifact_cache is True:
+
+        # define the contrast reference as the hash of the image or the LUT
+        if enhance_image_contrast is False: contrast_fingerprint = None
+        elif contrast_LUT is not None: contrast_fingerprint = hashlib.sha256(contrast_LUT.tobytes()).hexdigest()
+        else: contrast_fingerprint = get_sha256_file(image_high_contrast)
+
+        # restore
+        quadrant_artifact_inputs = get_processed_quadrant_artifact_inputs(tmpdir, processed_images_dir_each_plate, plate_batch_to_images, plate_batch_to_plates, enhance_image_contrast, contrast_fingerprint, image_engine)
+        run_function_in_parallel(quadrant_artifact_inputs, restore_processed_quadrant_artifact)
+
+        # keep the images with some missing plate
+        plate_batch_to_images_to_process = {pb : [img for img in images if any([file_is_empty("%s/%s_plate%i/%s"%(processed_images_dir_each_plate, pb, p, img)) for p in plate_batch_to_plates[pb]])] for pb, images in plate_batch_to_images.items()}
+        plate_batch_to_images_to_process = {pb : images for pb, images in plate_batch_to_images_to_process.items() if len(images)>0}
+        print_with_runtime("%i/%i images taken from the artifact cache"%(sum(map(len, plate_batch_to_images.values())) - sum(map(len, plate_batch_to_images_to_process.values())), sum(map(len, plate_batch_to_images.values()))))
+
+    # rotate, increase contrast and crop all images in one pass
+    if len(plate_batch_to_images_to_process)==0: pass
+    elif fused_image_pipeline is True: run_process_images_and_crop_plates_numpy(plate_batch_to_raw_outdir, plate_batch_to_processed_outdir, plate_batch_to_images_to_process, plate_batch_to_plates, processed_images_dir_each_plate, image_ending, enhance_image_contrast, image_high_contrast, keep_processed_images, contrast_LUT=contrast_LUT)
+
+    # rotate several plate sets at the same time, as many as fit in memory. Also increase contrast.
+    elif concurrent_batches is True: run_process_image_rotation_all_batches_concurrently(plate_batch_to_raw_outdir, plate_batch_to_processed_outdir, plate_batch_to_images_to_process, image_ending, enhance_image_contrast, image_high_contrast, image_engine, contrast_LUT=contrast_LUT)
+
     # rotate each plate set at the same time (not in parallel). Also increase contrast.
-    for I, plate_batch in enumerate(sorted(plate_batch_to_images)): process_image_rotation_all_images_batch(I+1, len(plate_batch_to_raw_outdir),plate_batch_to_raw_outdir[plate_batch], plate_batch_to_processed_outdir[plate_batch], plate_batch, plate_batch_to_images[plate_batch], image_ending, enhance_image_contrast, image_high_contrast)
+    else:
+        for I, plate_batch in enumerate(sorted(plate_batch_to_images_to_process)): process_image_rotation_all_images_batch(I+1, len(plate_batch_to_images_to_process), plate_batch_to_raw_outdir[plate_batch], plate_batch_to_processed_outdir[plate_batch], plate_batch, plate_batch_to_images_to_process[plate_batch], image_ending, enhance_image_contrast, image_high_contrast, image_engine=image_engine, contrast_LUT=contrast_LUT)
 
 
     # log
@@ -2985,59 +3786,141 @@ def run_analyze_images_process_images(plate_layout_file, images_dir, outdir, enh
     #######################################
 
 
-    ######## CREATE FILE TO REPRODUCE #########
-    print("Generating reduced inputs...")
+    ########## CROP IMAGES #########
 
-    # create a folder that contains the plate_layout.xlsx and a subset of 4 images for each input file
-    reduced_input_dir = "%s/reduced_input_dir"%extended_outdir
-    reduced_input_dir_file = "%s.zip"%reduced_input_dir
+    # the fused pipeline already generated the cropped images
+    if fused_image_pipeline is False:
 
-    if file_is_empty(reduced_input_dir_file):
+        print_with_runtime("Cropping images...")
 
-        # create dir
-        delete_folder(reduced_input_dir); make_folder(reduced_input_dir)
+        # define the list of inputs, which will be processed below
+        inputs_fn_cropping = []
 
-        # add the plate layout
-        copy_file(plate_layout_file, "%s/plate_layout.xlsx"%reduced_input_dir)
+        # crop the images
+        for plate_batch, plate in df_plate_layout[["plate_batch", "plate"]].drop_duplicates().values:
+            plateID_to_quadrantName = {1:"upper-left", 2:"upper-right", 3:"lower-left", 4:"lower-right"}
 
-        # add the cmd file
-        copy_file("/small_inputs/command.txt", "%s/command.txt"%reduced_input_dir)
+            # crop all the images (only desired quadrant) to a working dir. Only get files        
+            processed_images_dir_batch = "%s/%s"%(processed_images_dir, plate_batch)
+            dest_processed_images_dir = "%s/%s_plate%i"%(processed_images_dir_each_plate, plate_batch, plate); make_folder(dest_processed_images_dir)
+            for f in plate_batch_to_images[plate_batch]: inputs_fn_cropping.append(("%s/%s"%(processed_images_dir_batch, f), "%s/%s"%(dest_processed_images_dir, f), plate))
 
-        # copy a subset of images
-        for plate_batch, sorted_raw_images in plate_batch_to_raw_images.items():
-            subset_images = [sorted_raw_images[int(idx)] for idx in np.linspace(0, len(sorted_raw_images)-1, 4)]
-            plate_batch_dir = "%s/%s"%(reduced_input_dir, plate_batch); make_folder(plate_batch_dir)
-            for img in subset_images: copy_file("%s/%s/%s"%(linked_raw_images_dir, plate_batch, img), "%s/%s"%(plate_batch_dir, img))
+        # get the cropped images
+        #print_with_runtime("Cropping images in parallel on %i threads..."%multiproc.cpu_count())
+        run_function_in_parallel(inputs_fn_cropping, generate_croped_image)
 
-        # compress and save
-        save_folder_as_zip(reduced_input_dir, reduced_input_dir_file)
+    # save the processed images of each plate as artifacts
+    if use_artifact_cache is True: run_function_in_parallel(quadrant_artifact_inputs, save_processed_quadrant_artifact)
 
-    ###########################################
+    ################################
 
-    ########## CROP IMAGES #########
+    # wait for the reduced inputs
+    if reduced_inputs_process is not None:
+        reduced_inputs_process.join()
+        if reduced_inputs_process.exitcode!=0: raise ValueError("The generation of %s failed"%reduced_input_dir_file)
 
-    print_with_runtime("Cropping images...")
+def get_datetime_from_image_name(filename):
 
-    # define the list of inputs, which will be processed below
-    inputs_fn_cropping = []
+    """Returns a datetime object for one image name"""
 
-    # define a folder that will contain the linked images for each individual processing
-    processed_images_dir_each_plate = "%s/processed_images_each_plate"%tmpdir; make_folder(processed_images_dir_each_plate)
+    year, month, day, hour, minute = get_yyyymmddhhmm_tuple_one_image_name(filename)
+    return datetime.datetime(year, month, day, hour, minute)
 
-    # crop the images
-    for plate_batch, plate in df_plate_layout[["plate_batch", "plate"]].drop_duplicates().values:
-        plateID_to_quadrantName = {1:"upper-left", 2:"upper-right", 3:"lower-left", 4:"lower-right"}
+def add_colonyzer_coordinates_new_images(dest_processed_images_dir, sorted_image_names):
 
-        # crop all the images (only desired quadrant) to a working dir. Only get files        
-        processed_images_dir_batch = "%s/%s"%(processed_images_dir, plate_batch)
-        dest_processed_images_dir = "%s/%s_plate%i"%(processed_images_dir_each_plate, plate_batch, plate); make_folder(dest_processed_images_dir)
-        for f in plate_batch_to_images[plate_batch]: inputs_fn_cropping.append(("%s/%s"%(processed_images_dir_batch, f), "%s/%s"%(dest_processed_images_dir, f), plate))
+    """Adds the images of sorted_image_names that are not in <dest_processed_images_dir>/Colonyzer.txt, with the coordinates (set on an earlier image) of the last line"""
+
+    # get the lines
+    colonizer_coordinates = "%s/Colonyzer.txt"%dest_processed_images_dir
+    if file_is_empty(colonizer_coordinates): raise ValueError("%s should exist. The coordinates are set on the first images."%colonizer_coordinates)
+    all_lines = open(colonizer_coordinates, "r").readlines()
+    coordinates_lines = [l for l in all_lines if not l.startswith("#") and len(l.strip())>0]
 
-    # get the cropped images
-    #print_with_runtime("Cropping images in parallel on %i threads..."%multiproc.cpu_count())
-    run_function_in_parallel(inputs_fn_cropping, generate_croped_image)
+    # add the missing images
+    images_with_coordinates = {l.split(",")[0] for l in coordinates_lines}
+    missing_images = [img for img in sorted_image_names if img not in images_with_coordinates]
 
-    ################################
+    if len(missing_images)>0:
+        wells_and_coordinates = ",".join(coordinates_lines[-1].strip().split(",")[1:])
+        colonizer_coordinates_tmp = "%s.tmp"%colonizer_coordinates
+        open(colonizer_coordinates_tmp, "w").write("".join(all_lines + ["%s,%s\n"%(img, wells_and_coordinates) for img in missing_images]))
+        os.rename(colonizer_coordinates_tmp, colonizer_coordinates)
+
+def run_colonyzer_streaming_one_image(dest_processed_images_dir, streaming_outdir, first_image, image):
+
+    """Runs colonyzer on a folder with only first_image and image (with the coordinates of Colonyzer.txt), and keeps their Output_Data files in streaming_outdir/Output_Data. The lighting correction and the image differences (lc, diffims) use the first image as in a full run. However, colonyzer gets the threshold to segment the spots from the images that it analyzes, so that the values for each timepoint are calculated with a threshold from (first_image, image) instead of the whole time series. Thus, these are only a preview of the growth while the images appear, and the final measurements come from a colonyzer run on the whole time series (get_growth_measurements_one_plate_batch_and_plate)."""
+
+    data_dir = "%s/Output_Data"%streaming_outdir
+    image_name = image.split(".tif")[0]
+
+    if file_is_empty("%s/%s.dat"%(data_dir, image_name)):
+
+        # make a working dir with the two images and their coordinates
+        working_dir = "%s/working_%s"%(streaming_outdir, image_name)
+        delete_folder(working_dir); make_folder(working_dir)
+        for f in [first_image, image]: soft_link_files("%s/%s"%(dest_processed_images_dir, f), "%s/%s"%(working_dir, f))
+
+        coordinates_lines = [l for l in open("%s/Colonyzer.txt"%dest_processed_images_dir, "r").readlines() if l.startswith("#") or l.split(",")[0] in {first_image, image}]
+        open("%s/Colonyzer.txt"%working_dir, "w").write("".join(coordinates_lines))
+
+        # run colonyzer (no plots)
+        sorted_parms = sorted(parms_colonyzer)
+        if sorted_parms==["none"]: extra_cmds_parmCombination = ""
+        else: extra_cmds_parmCombination = "".join([" --%s "%x for x in sorted_parms])
+
+        colonyzer_exec = "%s/envs/colonyzer_env/bin/colonyzer"%CondaDir
+        colonyzer_std = "%s.running_colonyzer.std"%working_dir
+        run_cmd("cd %s && %s %s --remove --initpos --fmt 96 > %s 2>&1"%(working_dir, colonyzer_exec, extra_cmds_parmCombination, colonyzer_std), env="colonyzer_env")
+        remove_file(colonyzer_std)
+
+        # keep the data of both images (the one of first_image is only kept once)
+        make_folder(data_dir)
+        for f in [first_image, image]:
+            for suffix in [".out", ".dat"]:
+                data_file = "%s/%s%s"%(data_dir, f.split(".tif")[0], suffix)
+                if file_is_empty(data_file): os.rename("%s/Output_Data/%s%s"%(working_dir, f.split(".tif")[0], suffix), data_file)
+
+        delete_folder(working_dir)
+
+def run_analyze_images_follow_new_images(plate_layout_file, images_dir, outdir, enhance_image_contrast, contrast_enhancement_image, image_engine, hours_experiment, min_image_age_seconds):
+
+    """Processes the images that appeared in images_dir since the last run (--follow mode), adds them to the Colonyzer.txt of each plate (set on the first images), and gets their growth measurements against the first image (see run_colonyzer_streaming_one_image). The Output_Data of each plate is kept in tmp/growth_calculations/<plate_batch>_plate<plate>/output_<parms>_streaming, as a preview of the growth. Once the experiment finishes, the get_fitness_measurements module runs colonyzer on the whole time series, as in a run without --follow. It writes tmp/follow_status.json, with the hours covered by the images of each plate batch."""
+
+    # process the new images (the processing of each image only depends on itself and the synthetic contrast image)
+    run_analyze_images_process_images(plate_layout_file, images_dir, outdir, enhance_image_contrast, None, contrast_enhancement_image, image_engine, fused_image_pipeline=True, min_image_age_seconds=min_image_age_seconds)
+
+    # define dirs
+    tmpdir = "%s/tmp"%outdir
+    processed_images_dir_each_plate = "%s/processed_images_each_plate"%tmpdir
+    outdir_growth_calculations = "%s/growth_calculations"%tmpdir; make_folder(outdir_growth_calculations)
+    streaming_outdir_name = "output_%s_streaming"%("_".join(sorted(parms_colonyzer)))
+
+    # add coordinates and get the inputs of the growth measurements
+    print_with_runtime("Getting growth measurements of the new images...")
+    inputs_fn_growth = []
+    for d in sorted([x for x in os.listdir(processed_images_dir_each_plate) if not x.startswith(".")]):
+
+        dest_processed_images_dir = "%s/%s"%(processed_images_dir_each_plate, d)
+        sorted_image_names = get_sorted_image_names_plate_dir(dest_processed_images_dir)
+        add_colonyzer_coordinates_new_images(dest_processed_images_dir, sorted_image_names)
+
+        streaming_outdir = "%s/%s/%s"%(outdir_growth_calculations, d, streaming_outdir_name); os.makedirs(streaming_outdir, exist_ok=True)
+        for img in sorted_image_names[1:]: inputs_fn_growth.append((dest_processed_images_dir, streaming_outdir, sorted_image_names[0], img))
+
+    run_function_in_parallel(inputs_fn_growth, run_colonyzer_streaming_one_image)
+
+    # write the status, with the hours covered in each plate batch
+    image_catalog = load_image_catalog("%s/image_catalog.json"%tmpdir)
+    plate_batch_to_images = {}
+    for x in image_catalog["images"]: plate_batch_to_images.setdefault(x["plate_batch"], []).append(x["image"])
+    plate_batch_to_hours = {pb : (get_datetime_from_image_name(images[-1]) - get_datetime_from_image_name(images[0])).total_seconds()/3600 for pb, images in plate_batch_to_images.items()}
+
+    follow_status = {"plate_batch_to_nimages" : {pb : len(images) for pb, images in plate_batch_to_images.items()}, "plate_batch_to_hours" : plate_batch_to_hours, "hours_experiment" : hours_experiment, "finished" : all([h>=hours_experiment for h in plate_batch_to_hours.values()])}
+    follow_status_file = "%s/follow_status.json"%tmpdir
+    json.dump(follow_status, open("%s.tmp"%follow_status_file, "w"))
+    os.rename("%s.tmp"%follow_status_file, follow_status_file)
+
+    print_with_runtime("The images cover %s hours"%(", ".join(["%.2f (%s)"%(h, pb) for pb, h in sorted(plate_batch_to_hours.items())])))
 
 def run_analyze_images_run_colonyzer(outdir_images):
 
@@ -3087,7 +3970,7 @@ def run_analyze_images_run_colonyzer_subset_images_one_plate(processed_images_di
         delete_folder(outdir_tmp); make_folder(outdir_tmp)
 
         # define the sorted images
-        sorted_image_names = sorted({f for f in os.listdir(source_dir) if not f.startswith(".") and f not in {"Colonyzer.txt.tmp", "Colonyzer.txt"}}, key=get_yyyymmddhhmm_tuple_one_image_name)
+        sorted_image_names = get_sorted_image_names_plate_dir(source_dir)
 
         # add files in outdir_tmp to get images
         for f in [sorted_image_names[0], sorted_image_names[-1], "Colonyzer.txt"]: soft_link_files("%s/%s"%(source_dir,f), "%s/%s"%(outdir_tmp,f))
@@ -3103,25 +3986,25 @@ def run_analyze_images_run_colonyzer_subset_images_one_plate(processed_images_di
         run_colonyzer_one_set_of_parms(parms_colonyzer, outdir_tmp, image_names_withoutExtension, processed_images_dir_each_plate, reference_plate)
         os.rename(outdir_tmp, outdir)
 
-def run_analyze_images_run_colonyzer_subset_images(outdir, reference_plate):
+def run_analyze_images_run_colonyzer_subset_images(outdir, reference_plate, plates=None):
 
-    """Runs colonyzer on a subset of 2 images with the generated Colonyzer.txt file"""
+    """Runs colonyzer on a subset of 2 images with the generated Colonyzer.txt file. If plates (a list of <plate_batch>_plate<plate>) is provided, only those plates are run"""
 
     start_time = time.time()
 
     # define dirs
     tmpdir = "%s/tmp"%outdir
     processed_images_dir_each_plate = "%s/processed_images_each_plate"%tmpdir
-    colonyzer_runs_subset_dir = "%s/colonyzer_runs_subset"%tmpdir; make_folder(colonyzer_runs_subset_dir)
+    colonyzer_runs_subset_dir = "%s/colonyzer_runs_subset"%tmpdir; os.makedirs(colonyzer_runs_subset_dir, exist_ok=True) # several plates may be checked at the same time
 
     # define the inputs function to run colonyzer
-    inputs_fn = [(processed_images_dir_each_plate, colonyzer_runs_subset_dir, d, reference_plate) for d in os.listdir(processed_images_dir_each_plate)]
+    inputs_fn = [(processed_images_dir_each_plate, colonyzer_runs_subset_dir, d, reference_plate) for d in os.listdir(processed_images_dir_each_plate) if plates is None or d in plates]
 
     #print_with_runtime("Checking coordinates in parallel on %i threads..."%multiproc.cpu_count())
     run_function_in_parallel(inputs_fn, run_analyze_images_run_colonyzer_subset_images_one_plate)
 
     # give permissions
-    run_cmd("chmod -R 777 %s"%colonyzer_runs_subset_dir)
+    fs_fun.chmod_recursive(colonyzer_runs_subset_dir)
     #print("colonyzer-based grid check took %.2fs"%(time.time()-start_time))
 
 def is_outlier(L, x, multiplier=2.5):
@@ -3530,9 +4413,9 @@ def get_DT_good_rsq(DT_h, rsq, rsq_tshd=0.9):
     if rsq>=rsq_tshd: return DT_h
     else: return maxDT_h
     
-def run_analyze_images_get_fitness_measurements(plate_layout_file, images_dir, outdir, min_nAUC_to_beConsideredGrowing, reference_plate, hours_experiment):
+def run_analyze_images_get_fitness_measurements(plate_layout_file, images_dir, outdir, min_nAUC_to_beConsideredGrowing, reference_plate, hours_experiment, parallel_colonyzer_timepoints=False, generate_bad_spot_images=True):
 
-    """Generates the fitness measurements. Previous_output is a dir with the dirs"""
+    """Generates the fitness measurements. Previous_output is a dir with the dirs. If parallel_colonyzer_timepoints is True and there are less plates than cpus, the timepoints of each plate are split across the free cpus. If generate_bad_spot_images is False (the bad spots are accepted without showing them), the images to validate the bad spots are not generated."""
 
     #### LOAD DATA ####
 
@@ -3570,7 +4453,7 @@ def run_analyze_images_get_fitness_measurements(plate_layout_file, images_dir, o
         inputs_fn_coords.append((dest_processed_images_dir, plate_batch, plate))
 
         # add the images
-        plate_batch_to_images[plate_batch] = sorted({f for f in os.listdir(dest_processed_images_dir) if not f.startswith(".") and f not in {"Colonyzer.txt.tmp", "Colonyzer.txt"}}, key=get_yyyymmddhhmm_tuple_one_image_name)
+        plate_batch_to_images[plate_batch] = get_sorted_image_names_plate_dir(dest_processed_images_dir)
 
     # define dir of growth
     outdir_growth_calculations = "%s/growth_calculations"%tmpdir; make_folder(outdir_growth_calculations)
@@ -3578,8 +4461,19 @@ def run_analyze_images_get_fitness_measurements(plate_layout_file, images_dir, o
     # go through each plate and plate set and run the growth calculations
     print("Getting fitness measurements in parallel on %i threads..."%multiproc.cpu_count())
 
-    inputs_fn_growth = [(I+1, len(inputs_fn_coords), proc_images_folder, "%s/%s_plate%i"%(outdir_growth_calculations, plate_batch, plate), plate_batch, plate, plate_batch_to_images[plate_batch], processed_images_dir_each_plate, reference_plate, cp.deepcopy(df_plate_layout), hours_experiment) for I, (proc_images_folder, plate_batch, plate) in enumerate(inputs_fn_coords)]
-    run_function_in_parallel(inputs_fn_growth, get_growth_measurements_one_plate_batch_and_plate)
+    # define the threads of colonyzer for each plate, and those to generate the images with the reference plate appended and to fit the spots (the cpus left by the plates)
+    image_threads = max(1, int(multiproc.cpu_count()/len(inputs_fn_coords)))
+    fitting_threads = image_threads
+    if parallel_colonyzer_timepoints is True: colonyzer_threads = image_threads
+    else: colonyzer_threads = 1
+    if colonyzer_threads>1: print("Running colonyzer on %i threads for each plate..."%colonyzer_threads)
+
+    inputs_fn_growth = [(I+1, len(inputs_fn_coords), proc_images_folder, "%s/%s_plate%i"%(outdir_growth_calculations, plate_batch, plate), plate_batch, plate, plate_batch_to_images[plate_batch], processed_images_dir_each_plate, reference_plate, cp.deepcopy(df_plate_layout), hours_experiment, colonyzer_threads, image_threads, fitting_threads) for I, (proc_images_folder, plate_batch, plate) in enumerate(inputs_fn_coords)]
+
+    # with qfa, the plates processed at the same time share a pool of R workers, which load qfa only once. Each worker fits the spots of one plate on fitting_threads. The workers are stopped also if a plate fails
+    if fitting_engine=="qfa": start_r_worker_pool(min(multiproc.cpu_count(), len(inputs_fn_growth)))
+    try: run_function_in_parallel(inputs_fn_growth, get_growth_measurements_one_plate_batch_and_plate)
+    finally: stop_r_worker_pool()
 
     ####################################################
 
@@ -3702,7 +4596,7 @@ def run_analyze_images_get_fitness_measurements(plate_layout_file, images_dir, o
 
     # create merged images to validate bad spots
     df_bad_spots_auto = df_bad_spots[df_bad_spots.bad_spot_reason!="manual setting in plate layout"]
-    if len(df_bad_spots_auto)>0:
+    if len(df_bad_spots_auto)>0 and generate_bad_spot_images is True:
 
         # make folder
         merged_images_bad_spots_dir = "%s/merged_images_bad_spots"%tmpdir
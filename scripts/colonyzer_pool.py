@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+
+# Runs colonyzer (as a library, from the colonyzer_env) on the images of the current directory, splitting the timepoints into shards that are analyzed in parallel. The Output_Data, Output_Images and Output_Reports folders are the same as those of running 'colonyzer <args>' in the current directory. This should be run with the python of the colonyzer_env (python 2.7), as 'colonyzer_pool.py <threads> <shards_dir> <plot_images> <colonyzer args>'. plot_images can be 'all' or a comma-separated list of image names (without extension), which are the only ones with Output_Images.
+
+# Colonyzer takes the latest and earliest images (skipping images with lids if --greenlab) to locate the spots and get the threshold, and then measures each image independently. Each shard has these two images plus a chunk of the timepoints, so that each image has the same measurements as in a run on all images.
+
+# imports
+from __future__ import print_function
+import os, sys, shutil, multiprocessing
+
+# functions
+def get_barcode(filename):
+
+    """Returns the barcode of filename, as colonyzer does (barcRange=(0,-24))"""
+
+    return os.path.basename(filename)[0:-24]
+
+def get_images_latest_first(images_dir):
+
+    """Returns the images of images_dir that colonyzer analyzes, sorted from the latest to the earliest (as colonyzer does)"""
+
+    images = [f for f in os.listdir(images_dir) if f[-4:] in ('.jpg','.JPG','.tiff','.TIFF','.tif','.TIF') and os.path.isfile(os.path.join(images_dir, f))]
+    return sorted(images, reverse=True)
+
+def get_checkLid(colonyzer_args):
+
+    """Returns the function that colonyzer uses to skip images with lids (with --greenlab), or None"""
+
+    if not any([x in {"--greenlab", "-g"} for x in colonyzer_args]): return None
+
+    import colonyzer2 as c2
+    from pkg_resources import resource_filename, Requirement
+    posfiles = [resource_filename(Requirement.parse("colonyzer2"),os.path.join("data",f)) for f in ["GreenLabLid.png","CornerLid.png","BottomRightLid.png"]]
+    negfiles = [resource_filename(Requirement.parse("colonyzer2"),os.path.join("data",f)) for f in ["GreenLabNoLid.png","CornerNoLid.png","BottomRightNoLid.png"]]
+    frects = [[0.15,0.85,0.5,1.0],[0.0,0.8,0.125,1.0],[0.85,0.8,1.0,1.0]]
+    return c2.detectlid.makeLidTest(posfiles, negfiles, frects, 50.3, 53.333, False)
+
+def get_shards(images_dir, images_latest_first, threads, checkLid):
+
+    """Returns a list of (images, owned images) for each shard. Each shard has the latest and earliest images without lid, and the owned images are the ones to keep from the shard. Returns [] if the images can't be split."""
+
+    if threads<=1 or len(images_latest_first)<=2 or len(set(map(get_barcode, images_latest_first)))!=1: return []
+
+    # get the latest and earliest images that colonyzer takes as reference
+    if checkLid is None: images_no_lid = images_latest_first
+    else: images_no_lid = [img for img in images_latest_first if not checkLid(os.path.join(images_dir, img))]
+    if len(images_no_lid)==0: return []
+    reference_images = {images_no_lid[0], images_no_lid[-1]}
+
+    # split the other images in contiguous chunks
+    other_images = [img for img in images_latest_first if img not in reference_images]
+    nshards = min(threads, len(other_images))
+    if nshards<=1: return []
+    chunks = [other_images[int(I*len(other_images)/nshards):int((I+1)*len(other_images)/nshards)] for I in range(nshards)]
+
+    # the first shard keeps the reference images
+    shards = []
+    for I, chunk in enumerate(chunks):
+        if I==0: owned_images = chunk + sorted(reference_images)
+        else: owned_images = chunk
+        shards.append((sorted(set(chunk).union(reference_images), reverse=True), owned_images))
+
+    return shards
+
+def set_plot_images(parseAndRun3, plot_images):
+
+    """Makes colonyzer only render the Output_Images of plot_images (a set of image names without extension, or None for all). The other images get a 1-pixel placeholder, which is removed by remove_placeholder_plots"""
+
+    if plot_images is None: return
+    from PIL import Image
+
+    threshPreview = parseAndRun3.c2.threshPreview
+    def threshPreview_plot_images(locations, *args, **kwargs):
+        if locations.Filename.values[0] in plot_images: return threshPreview(locations, *args, **kwargs)
+        return Image.new("RGB", (1,1))
+
+    parseAndRun3.c2.threshPreview = threshPreview_plot_images
+
+def remove_placeholder_plots(images_dir, plot_images):
+
+    """Removes the Output_Images of images_dir that are not from plot_images"""
+
+    if plot_images is None: return
+    for f in os.listdir(os.path.join(images_dir, "Output_Images")):
+        if f.split(".")[0].replace("_AREA", "") not in plot_images: os.unlink(os.path.join(images_dir, "Output_Images", f))
+
+def run_colonyzer_one_dir(shard_dir, colonyzer_args, plot_images=None):
+
+    """Runs colonyzer as a library in shard_dir. Only the images of plot_images (or all if None) get Output_Images"""
+
+    from scripts import parseAndRun3
+    set_plot_images(parseAndRun3, plot_images)
+    os.chdir(shard_dir)
+    parseAndRun3.main(" ".join(colonyzer_args))
+    remove_placeholder_plots(shard_dir, plot_images)
+
+def run_colonyzer_one_dir_args(args):
+
+    """Runs run_colonyzer_one_dir from a tuple of args (for Pool.map in python 2)"""
+
+    run_colonyzer_one_dir(*args)
+
+def move_file_if_exists(origin, dest):
+
+    """Moves origin into dest if it exists"""
+
+    if os.path.isfile(origin): shutil.move(origin, dest)
+
+def run_colonyzer_in_shards(images_dir, shards_dir, threads, colonyzer_args, plot_images=None):
+
+    """Runs colonyzer on the images of images_dir, in parallel shards of timepoints written in shards_dir. The outputs are merged into images_dir. Only the images of plot_images (or all if None) get Output_Images"""
+
+    images_dir = os.path.realpath(images_dir)
+
+    # get the shards. If they can't be split, run as usual
+    shards = get_shards(images_dir, get_images_latest_first(images_dir), threads, get_checkLid(colonyzer_args))
+    if len(shards)==0:
+        print("Running colonyzer without shards")
+        run_colonyzer_one_dir(images_dir, colonyzer_args, plot_images=plot_images)
+        return
+
+    print("Running colonyzer in %i shards of timepoints"%len(shards))
+
+    # create the shard dirs, with links to the images and the Colonyzer.txt file
+    if os.path.isdir(shards_dir): shutil.rmtree(shards_dir)
+    os.makedirs(shards_dir)
+    shard_dirs = []
+    for I, (images, owned_images) in enumerate(shards):
+        shard_dir = os.path.join(shards_dir, "shard%i"%I); os.makedirs(shard_dir)
+        for f in images + ["Colonyzer.txt"]: os.symlink(os.path.join(images_dir, f), os.path.join(shard_dir, f))
+        shard_dirs.append(shard_dir)
+
+    # run
+    pool = multiprocessing.Pool(len(shards))
+    pool.map(run_colonyzer_one_dir_args, [(d, colonyzer_args, plot_images) for d in shard_dirs], chunksize=1)
+    pool.close()
+    pool.join()
+
+    # merge the outputs of the owned images
+    for folder in ["Output_Data", "Output_Images", "Output_Reports"]:
+        if os.path.isdir(os.path.join(images_dir, folder)): shutil.rmtree(os.path.join(images_dir, folder))
+        os.makedirs(os.path.join(images_dir, folder))
+
+    for I, (shard_dir, (images, owned_images)) in enumerate(zip(shard_dirs, shards)):
+        for img in owned_images:
+            img_name = img.split(".")[0]
+            for suffix in [".out", ".dat"]: move_file_if_exists(os.path.join(shard_dir, "Output_Data", img_name+suffix), os.path.join(images_dir, "Output_Data"))
+            for suffix in [".png", "_AREA.png"]: move_file_if_exists(os.path.join(shard_dir, "Output_Images", img_name+suffix), os.path.join(images_dir, "Output_Images"))
+
+        # the reports are named after the earliest image, which is the same in all shards
+        if I==0 and os.path.isdir(os.path.join(shard_dir, "Output_Reports")):
+            for f in os.listdir(os.path.join(shard_dir, "Output_Reports")): shutil.move(os.path.join(shard_dir, "Output_Reports", f), os.path.join(images_dir, "Output_Reports"))
+
+    shutil.rmtree(shards_dir)
+
+if __name__=="__main__": 
+
+    if sys.argv[3]=="all": plot_images = None
+    else: plot_images = set(sys.argv[3].split(","))
+    run_colonyzer_in_shards(".", sys.argv[2], int(sys.argv[1]), sys.argv[4:], plot_images=plot_images)
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+
+# A long-lived process that runs shell commands within an already activated conda env, so that run_cmd does not need to activate the env for each command. The broker listens on a unix socket, and it is started (one per env) from app_functions.start_command_brokers. It can be run with any python3, as 'command_broker.py <socket file>' from a shell where the env is activated.
+
+# This also has a pool of long-lived R workers (get_fitness_measurements.R --worker), which load qfa once and fit many plates. The pool is served on a unix socket from a thread of app_functions, started with start_r_worker_pool.
+
+# imports
+import os, sys, time, json, socket, socketserver, subprocess, threading, queue
+
+# functions
+class CommandBrokerHandler(socketserver.StreamRequestHandler):
+
+    """Runs one command. The request is a json line with 'cmd', 'cwd', 'stdout' and 'stderr', and the reply a json line with 'exit_status', 'stdout', 'stderr' and 'seconds'"""
+
+    def handle(self):
+
+        request = json.loads(self.rfile.readline().decode("utf-8"))
+
+        # run with the environment of the broker (the activated env)
+        start_time = time.time()
+        with open(request["stdout"], "w") as stdout, open(request["stderr"], "w") as stderr:
+            exit_status = subprocess.call(["bash", "-c", request["cmd"]], cwd=request["cwd"], stdout=stdout, stderr=stderr)
+
+        reply = {"exit_status":exit_status, "stdout":request["stdout"], "stderr":request["stderr"], "seconds":time.time()-start_time}
+        self.wfile.write((json.dumps(reply)+"\n").encode("utf-8"))
+
+class CommandBrokerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+
+    """Runs each request in a thread, so that several commands (i.e. from parallel processes) run at the same time"""
+
+    daemon_threads = True
+
+def serve_command_broker(socket_file):
+
+    """Runs the broker on socket_file until it is killed"""
+
+    if os.path.exists(socket_file): os.unlink(socket_file)
+    server = CommandBrokerServer(socket_file, CommandBrokerHandler)
+    server.serve_forever()
+
+def start_command_broker(env, socket_file, CondaDir, broker_std):
+
+    """Starts a broker for env in the background, and waits until it listens on socket_file. Returns the subprocess.Popen object"""
+
+    if os.path.exists(socket_file): os.unlink(socket_file)
+
+    # the broker runs with the current python, but with the environment variables of the activated env
+    cmd = "source %s/etc/profile.d/conda.sh > /dev/null 2>&1 && conda activate %s > /dev/null 2>&1 && exec %s %s %s"%(CondaDir, env, sys.executable, os.path.realpath(__file__), socket_file)
+    broker_process = subprocess.Popen(["bash", "-c", cmd], stdout=open(broker_std, "w"), stderr=subprocess.STDOUT)
+
+    # wait
+    start_time = time.time()
+    while not os.path.exists(socket_file):
+
+        if broker_process.poll() is not None: raise ValueError("The command broker of %s exited with status %i. Check %s"%(env, broker_process.returncode, broker_std))
+        if (time.time()-start_time)>120: raise ValueError("The command broker of %s did not start in 120 seconds. Check %s"%(env, broker_std))
+        time.sleep(0.05)
+
+    return broker_process
+
+def run_cmd_in_command_broker(socket_file, cmd, stdout, stderr):
+
+    """Runs cmd through the broker listening on socket_file, from the current directory. The output of cmd is written into the stdout and stderr files. Returns the reply of the broker (a dict with 'exit_status', 'stdout', 'stderr' and 'seconds')"""
+
+    request = {"cmd":cmd, "cwd":os.getcwd(), "stdout":stdout, "stderr":stderr}
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(socket_file)
+        client.sendall((json.dumps(request)+"\n").encode("utf-8"))
+        reply = client.makefile("rb").readline()
+
+    if len(reply)==0: raise ValueError("The command broker at %s did not reply to '%s'"%(socket_file, cmd))
+    return json.loads(reply.decode("utf-8"))
+
+class RWorkerPoolHandler(socketserver.StreamRequestHandler):
+
+    """Runs one request in an idle R worker. The request is a json line with 'input_dir', 'days_experiment', 'log' and 'threads', and the reply a json line with 'exit_status' (0 if the worker replied 'OK'), 'log' and 'seconds'. If the slot of the worker was lost (a dead worker could not be restarted), the reply has an 'error' instead"""
+
+    def handle(self):
+
+        request = json.loads(self.rfile.readline().decode("utf-8"))
+
+        # wait for an idle worker. A lost slot is None
+        worker_process = self.server.idle_workers.get()
+        start_time = time.time()
+        try:
+
+            if worker_process is None: reply = {"exit_status":1, "log":request["log"], "seconds":0.0, "error":"An R worker died and could not be restarted: %s"%self.server.worker_start_error}
+
+            else:
+                try:
+                    worker_process.stdin.write(("%s\t%s\t%s\t%i\n"%(request["input_dir"], request["days_experiment"], request["log"], request["threads"])).encode("utf-8"))
+                    worker_process.stdin.flush()
+                    status = worker_process.stdout.readline().decode("utf-8").strip()
+
+                except BrokenPipeError: status = ""
+
+                # a worker that died (no reply) is replaced. If the replacement does not start, the slot is kept as None
+                if status=="": 
+                    worker_process.wait()
+                    worker_process = None
+                    try: worker_process = self.server.start_worker()
+                    except Exception as err: self.server.worker_start_error = str(err)
+
+                reply = {"exit_status":{"OK":0}.get(status, 1), "log":request["log"], "seconds":time.time()-start_time}
+
+        # always give back the slot, so that later requests do not wait forever
+        finally: self.server.idle_workers.put(worker_process)
+
+        self.wfile.write((json.dumps(reply)+"\n").encode("utf-8"))
+
+class RWorkerPoolServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+
+    """Keeps nworkers R processes running 'worker_cmd' (which loads the packages once, and replies 'READY'). Each request runs in a thread that takes an idle worker"""
+
+    daemon_threads = True
+
+    def __init__(self, socket_file, worker_cmd, nworkers, worker_std):
+
+        socketserver.UnixStreamServer.__init__(self, socket_file, RWorkerPoolHandler)
+        self.worker_cmd = worker_cmd
+        self.worker_std = worker_std
+        self.worker_processes = []
+        self.idle_workers = queue.Queue()
+        self.worker_start_error = None
+
+        # start all workers before waiting for them, so that they load the packages at the same time
+        for worker_process in [self.start_worker(wait=False) for I in range(nworkers)]: 
+            self.wait_worker(worker_process)
+            self.idle_workers.put(worker_process)
+
+    def start_worker(self, wait=True):
+
+        """Starts one worker, and returns its subprocess.Popen object"""
+
+        worker_process = subprocess.Popen(["bash", "-c", self.worker_cmd], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=open(self.worker_std, "a"))
+        self.worker_processes.append(worker_process)
+        if wait is True: self.wait_worker(worker_process)
+        return worker_process
+
+    def wait_worker(self, worker_process):
+
+        """Waits until worker_process is ready to get requests"""
+
+        if worker_process.stdout.readline().decode("utf-8").strip()!="READY": raise ValueError("The R worker '%s' did not start. Check %s"%(self.worker_cmd, self.worker_std))
+
+    def stop_workers(self):
+
+        """Stops all the workers"""
+
+        for worker_process in self.worker_processes:
+            if worker_process.poll() is None:
+                worker_process.terminate()
+                worker_process.wait()
+
+def start_r_worker_pool(nworkers, socket_file, CondaDir, r_script, worker_std, env="main_env"):
+
+    """Starts nworkers 'Rscript <r_script> --worker' in env, and a server that sends them the requests of socket_file (in a thread of this process, so that the requests can come from forked processes). Returns the server, which should be stopped with stop_r_worker_pool"""
+
+    if os.path.exists(socket_file): os.unlink(socket_file)
+
+    worker_cmd = "source %s/etc/profile.d/conda.sh > /dev/null 2>&1 && conda activate %s > /dev/null 2>&1 && exec Rscript %s --worker"%(CondaDir, env, r_script)
+    server = RWorkerPoolServer(socket_file, worker_cmd, nworkers, worker_std)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+def stop_r_worker_pool(server):
+
+    """Stops the server and the R workers of start_r_worker_pool"""
+
+    server.shutdown()
+    server.server_close()
+    server.stop_workers()
+    if os.path.exists(server.server_address): os.unlink(server.server_address)
+
+def run_request_in_r_worker_pool(socket_file, input_dir, days_experiment, log, threads=1):
+
+    """Runs the R script of the pool listening on socket_file on input_dir and days_experiment (with threads), writing its output into log. Returns the reply of the pool (a dict with 'exit_status', 'log' and 'seconds')"""
+
+    request = {"input_dir":input_dir, "days_experiment":days_experiment, "log":log, "threads":threads}
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(socket_file)
+        client.sendall((json.dumps(request)+"\n").encode("utf-8"))
+        reply = client.makefile("rb").readline()
+
+    if len(reply)==0: raise ValueError("The R worker pool at %s did not reply to %s"%(socket_file, input_dir))
+    reply = json.loads(reply.decode("utf-8"))
+    if "error" in reply: raise ValueError("The R worker pool at %s could not run %s. %s"%(socket_file, input_dir, reply["error"]))
+    return reply
+
+if __name__=="__main__": serve_command_broker(sys.argv[1])
@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+
+# Filesystem operations that are run within python (no shell commands through run_cmd, which activate a conda env each time). This should be imported from the main_env
+
+# imports
+import os
+
+# functions
+def set_permissive_umask():
+
+    """Sets a umask of 0, so that all the files and folders created by this process (and the commands that it runs) are accessible for all users (as with chmod 777)"""
+
+    os.umask(0)
+
+def remove_file(f):
+
+    """Removes a file or a link (also broken links) if it exists"""
+
+    if os.path.isfile(f) or os.path.islink(f):
+
+        try: os.unlink(f)
+        except FileNotFoundError: pass
+
+def soft_link_file(origin, target):
+
+    """Makes origin accessible through the link target, replacing any previous file or link in target"""
+
+    remove_file(target)
+    os.symlink(origin, target)
+
+def chmod_recursive(path, mode=0o777):
+
+    """Sets mode to path and all the files and folders under it. Links are skipped (as in chmod -R), which means that the files that they point to are not changed. Files that are removed meanwhile (i.e. by other containers writing into the same folder) are skipped."""
+
+    if os.path.islink(path) or not os.path.exists(path): return
+    os.chmod(path, mode)
+
+    for root, dirs, files in os.walk(path):
+        for f in dirs + files:
+            path_f = os.path.join(root, f)
+            if os.path.islink(path_f): continue
+
+            try: os.chmod(path_f, mode)
+            except FileNotFoundError: pass
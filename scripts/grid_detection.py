@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+
+# Detects the 96-spot grid of one plate image (the latest timepoint) from the intensity profiles of its rows and columns, with numpy only (this is imported from main_functions, in the host). It returns the centres of the A1 and H12 spots (as the coordinates clicked in the GUI) and a confidence score, so that the plates with a clear grid do not need the manual coordinates.
+
+# The spots are brighter than the agar, so that the mean intensity of the columns (or rows) has one peak per spot column (row). The grid of each axis is the comb of n equally spaced peaks that best separates the peaks from the midpoints between them, and it is refined with the centroid of each peak.
+
+# imports
+import numpy as np
+from PIL import Image as PIL_Image
+
+# functions
+def get_gray_array_image(image_file, max_width=900):
+
+    """Returns the grayscale array (float) of image_file, resized to have at most max_width, and the resize factor"""
+
+    image_object = PIL_Image.open(image_file).convert("L")
+    original_w, original_h = image_object.size
+    factor_resize = min(1.0, max_width/original_w)
+    if factor_resize<1: image_object = image_object.resize((int(original_w*factor_resize), int(original_h*factor_resize)), PIL_Image.BILINEAR)
+
+    return np.array(image_object, dtype=float), factor_resize
+
+def get_detrended_profile(profile, window):
+
+    """Returns the profile minus its moving average on window (so that the gradients of illumination do not create peaks)"""
+
+    window = max(3, int(window) | 1)
+    padded = np.pad(profile, window//2, mode="edge")
+    trend = np.convolve(padded, np.ones(window)/window, mode="valid")
+    return profile - trend
+
+def get_smoothed_profile(profile, window):
+
+    """Returns the moving average of profile on window, so that narrow peaks (i.e. the border of the plate) weigh less than the spots"""
+
+    window = max(1, int(window) | 1)
+    return np.convolve(np.pad(profile, window//2, mode="edge"), np.ones(window)/window, mode="valid")
+
+def get_comb_scores(profile, pitch, offsets, n):
+
+    """Returns, for each offset, the mean of profile at the n peaks (offset + k*pitch) minus the mean at the n+1 midpoints (including those before the first and after the last peak)"""
+
+    k = np.arange(n)
+    peaks = np.interp(offsets[:,None] + k[None,:]*pitch, np.arange(len(profile)), profile).mean(axis=1)
+    midpoints = np.interp(offsets[:,None] + (np.arange(-1, n)[None,:]+0.5)*pitch, np.arange(len(profile)), profile).mean(axis=1)
+    return peaks - midpoints
+
+def get_grid_one_axis(profile, n, min_span_fraction=0.3):
+
+    """Returns the position of the first peak, the pitch and the confidence (0-1) of a comb of n peaks in profile. The grid spans at least min_span_fraction of the profile, and there is at least half a pitch between the first (last) peak and the start (end) of the profile"""
+
+    length = len(profile)
+    pitches = np.arange(min_span_fraction*length/(n-1), (length-1)/n, 0.5)
+    if len(pitches)==0: return None, None, 0.0
+
+    # find the comb with the highest contrast between peaks and midpoints, on the profile detrended with the maximum pitch
+    detrended_profile = get_detrended_profile(profile, 2*pitches[-1])
+    best_score, best_offset, best_pitch = -np.inf, None, None
+    for pitch in pitches:
+        offsets = np.arange(pitch/2, length-1-(n-0.5)*pitch+1e-6, 1.0)
+        if len(offsets)==0: continue
+        scores = get_comb_scores(get_smoothed_profile(detrended_profile, pitch/4), pitch, offsets, n)
+        I = np.argmax(scores)
+        if scores[I]>best_score: best_score, best_offset, best_pitch = scores[I], offsets[I], pitch
+
+    if best_offset is None or best_score<=0: return None, None, 0.0
+
+    # refine on the profile detrended with the pitch of the comb, which removes the peaks from the trend (a window of several pitches leaves a slope at the first and last peaks, that shifts them outwards)
+    return get_grid_fit_one_axis(get_detrended_profile(profile, best_pitch), best_offset, best_pitch, n)
+
+def get_grid_fit_one_axis(profile, first_peak, pitch, n, max_shift_fraction=0.0):
+
+    """Refines a comb of n peaks (first_peak, pitch) in a detrended profile with the centroid of each peak, and returns the refined first_peak, pitch and the confidence (0-1) of the comb. With max_shift_fraction>0, the confidence is also penalized if the refined comb moved more than half of max_shift_fraction (as a fraction of the pitch), and it is 0 above max_shift_fraction"""
+
+    # refine each peak with the centroid of the profile within half a pitch (only the values above the half of the peak, so that the shoulders of the neighbouring peaks do not pull it), and fit a line to the peaks
+    length = len(profile)
+    centroids = []
+    for k in range(n):
+        centre = first_peak + k*pitch
+        positions = np.arange(max(0, int(np.floor(centre-pitch/2))), min(length, int(np.ceil(centre+pitch/2))+1))
+        if len(positions)==0: return first_peak, pitch, 0.0
+        weights = np.maximum(0, profile[positions] - (profile[positions].min() + profile[positions].max())/2)
+        if weights.sum()>0: centroids.append(np.sum(positions*weights)/weights.sum())
+        else: centroids.append(centre)
+
+    refined_pitch, refined_first_peak = np.polyfit(np.arange(n), centroids, 1)
+    residuals = np.array(centroids) - (refined_first_peak + np.arange(n)*refined_pitch)
+
+    # the confidence is the fraction of peaks that are above their neighbouring midpoints, penalized by the irregularity of the peaks
+    peak_values = np.interp(refined_first_peak + np.arange(n)*refined_pitch, np.arange(length), profile)
+    midpoint_values = np.interp(refined_first_peak + (np.arange(-1, n)+0.5)*refined_pitch, np.arange(length), profile)
+    fraction_peaks = np.mean((peak_values>midpoint_values[:-1]) & (peak_values>midpoint_values[1:]))
+    regularity = max(0.0, 1.0 - np.sqrt(np.mean(residuals**2))/(0.2*refined_pitch))
+    confidence = fraction_peaks*regularity
+
+    # penalize the shift of the first and last peaks
+    if max_shift_fraction>0:
+        shift = max(abs(refined_first_peak-first_peak), abs((refined_first_peak+(n-1)*refined_pitch)-(first_peak+(n-1)*pitch)))
+        confidence *= min(1.0, max(0.0, 2.0 - 2.0*shift/(max_shift_fraction*pitch)))
+
+    return refined_first_peak, refined_pitch, float(confidence)
+
+def get_grid_coordinates(image_file, nrows=8, ncols=12):
+
+    """Returns the (x, y) of the A1 and H12 spots of image_file (in pixels of the original image, as ints) and the confidence (0-1) of the grid. The coordinates are None if no grid is found"""
+
+    arr, factor_resize = get_gray_array_image(image_file)
+
+    # get the grid of each axis from the mean of the columns (x) and rows (y)
+    x0, pitch_x, confidence_x = get_grid_one_axis(arr.mean(axis=0), ncols)
+    y0, pitch_y, confidence_y = get_grid_one_axis(arr.mean(axis=1), nrows)
+    if x0 is None or y0 is None: return None, None, 0.0
+
+    # the spots are round, so that the pitch should be similar in both axes
+    confidence = min(confidence_x, confidence_y) * max(0.0, 1.0 - abs(pitch_x-pitch_y)/(0.2*max(pitch_x, pitch_y)))
+
+    # get the coordinates in the original image
+    A1 = (int(round(x0/factor_resize)), int(round(y0/factor_resize)))
+    H12 = (int(round((x0+(ncols-1)*pitch_x)/factor_resize)), int(round((y0+(nrows-1)*pitch_y)/factor_resize)))
+
+    return A1, H12, float(confidence)
+
+def get_grid_fit(image_file, A1, H12, nrows=8, ncols=12, max_shift_fraction=0.5):
+
+    """Fits a known grid (the (x, y) of the A1 and H12 spots, i.e. from a previous experiment) to the spots of image_file. Returns the refined A1 and H12 (in pixels of the original image, as ints) and the confidence (0-1) of the fit. The grid does not fit if the spots are more than max_shift_fraction of a pitch away, or if the grid shifted by one row (column) fits better"""
+
+    arr, factor_resize = get_gray_array_image(image_file)
+
+    first_peaks, pitches, confidences = [], [], []
+    for profile, start, end, n in [(arr.mean(axis=0), A1[0], H12[0], ncols), (arr.mean(axis=1), A1[1], H12[1], nrows)]:
+
+        pitch = (end-start)*factor_resize/(n-1)
+        if pitch<=0: return None, None, 0.0
+        profile = get_detrended_profile(profile, pitch)
+        first_peak, pitch, confidence = get_grid_fit_one_axis(profile, start*factor_resize, pitch, n, max_shift_fraction=max_shift_fraction)
+
+        # the refined grid shifted by one pitch should not have more contrast (before the refinement, a grid that is a fraction of a pitch away can have the same contrast as the shifted one)
+        comb_scores = get_comb_scores(get_smoothed_profile(profile, pitch/4), pitch, np.array([first_peak-pitch, first_peak, first_peak+pitch]), n)
+        if comb_scores[1]<max(comb_scores[0], comb_scores[2]): return None, None, 0.0
+
+        first_peaks.append(first_peak); pitches.append(pitch); confidences.append(confidence)
+
+    A1 = (int(round(first_peaks[0]/factor_resize)), int(round(first_peaks[1]/factor_resize)))
+    H12 = (int(round((first_peaks[0]+(ncols-1)*pitches[0])/factor_resize)), int(round((first_peaks[1]+(nrows-1)*pitches[1])/factor_resize)))
+
+    return A1, H12, float(min(confidences))
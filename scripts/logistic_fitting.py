@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+
+# A numpy implementation of get_fitness_measurements.R (qfa.fit with a logistic model, glog=FALSE, plus the rsquare and DT_h of the script). It reads the same inputs (all_images_data.dat, ExptDescription.txt, LibraryDescriptions.txt) and writes processed_all_data.tbl, logRegression_fits.tbl and output_plots.pdf, without starting R. This should be imported from the main_env.
+
+# All the spots of a plate have the same timepoints, so that the growth curves are a (spots x timepoints) matrix. The logistic model (K, r, g) is fit to all spots at once with a batched Levenberg-Marquardt, and the loess smoothing of the model-free estimates is a matrix that only depends on the timepoints. The loess is evaluated directly (R interpolates it on a kd tree), so that nr, maxslp and DT_h are close to those of R but not identical. testing/compare_fitting_engines.py reports the differences against a run with qfa.
+
+# imports
+import os
+import numpy as np
+import pandas as pd
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+# the columns of the .dat files, as named by colonyzer.read
+dat_fields = ["Image.Name", "Row", "Column", "X.Offset", "Y.Offset", "Area", "Trimmed", "Threshold", "Intensity", "Edge.Pixels", "redMean", "greenMean", "blueMean", "redMeanBack", "greenMeanBack", "blueMeanBack", "Edge.Length", "Tile.Dimensions.X", "Tile.Dimensions.Y"]
+
+# the parameters of get_fitness_measurements.R
+pseudocount_g = 0.001
+max_dt = 25.0
+
+# functions
+def get_df_colonyzer_data(input_dir, fmt="%Y-%m-%d_%H-%M-%S"):
+
+    """Returns the df of colonyzer.read (plus the Growth of get_fitness_measurements.R) for the files of input_dir"""
+
+    # read the image analysis and the descriptions
+    df = pd.read_csv("%s/all_images_data.dat"%input_dir, sep="\t", header=None, names=dat_fields)
+    df_expt = pd.read_csv("%s/ExptDescription.txt"%input_dir, sep="\t")
+    df_lib = pd.read_csv("%s/LibraryDescriptions.txt"%input_dir, sep="\t")
+
+    # the image names are <barcode>-<date time>
+    df["Barcode"] = df["Image.Name"].apply(lambda x: x[:-20])
+    df["Date.Time"] = df["Image.Name"].apply(lambda x: x[-19:])
+
+    # add the experiment descriptions
+    df_expt = df_expt.rename(columns={"Start.Time":"Inoc.Time", "Treatment":"Treatments", "Screen":"Screen.Name", "Library":"Library.Name", "Plate":"MasterPlate.Number"})
+    df = df.merge(df_expt[["Barcode", "Inoc.Time", "Treatments", "Medium", "Screen.Name", "Library.Name", "MasterPlate.Number", "RepQuad"]], on="Barcode", how="left", validate="many_to_one")
+    if any(pd.isna(df["Inoc.Time"])): raise ValueError("There are barcodes in all_images_data.dat that are not in ExptDescription.txt")
+
+    # add the time (days) since the inoculation, and the order of each timepoint
+    date_time = pd.to_datetime(df["Date.Time"], format=fmt)
+    df["Expt.Time"] = (date_time - pd.to_datetime(df["Inoc.Time"], format=fmt)).dt.total_seconds() / (24*60*60)
+    df["Timeseries.order"] = date_time.groupby(df.Barcode).rank(method="dense").astype(int)
+
+    # add the centre and diameter of each spot
+    df["x"] = df["X.Offset"] + df["Tile.Dimensions.X"]/2
+    df["y"] = df["Y.Offset"] + df["Tile.Dimensions.Y"]/2
+    df["Diameter"] = 2*np.sqrt(df.Area/np.pi)
+
+    # add the strains
+    df_lib = df_lib.rename(columns={"Library":"Library.Name", "Plate":"MasterPlate.Number"})[["Library.Name", "MasterPlate.Number", "Row", "Column", "ORF"]]
+    df = df.merge(df_lib, on=["Library.Name", "MasterPlate.Number", "Row", "Column"], how="left", validate="many_to_one")
+    df["Gene"] = df.ORF
+
+    # get the Growth
+    df["Growth"] = df.Trimmed/(df["Tile.Dimensions.X"]*df["Tile.Dimensions.Y"]*255)
+    if any(df.Growth<0): raise ValueError("There are spots with <0 Growth")
+    if any(df[df["Timeseries.order"]==1].Growth>0): raise ValueError("There are spots with >0 growth in t=0")
+    if any(pd.isna(df.Growth)): raise ValueError("There are nans in Growth")
+    df["Growth"] = df.Growth*1e7 + pseudocount_g
+
+    return df.sort_values(by=["Barcode", "Row", "Column", "Expt.Time"]).reset_index(drop=True)
+
+def get_loess_matrix(x, x_eval, span, degree=2):
+
+    """Returns the (len(x_eval), len(x)) matrix that gives the loess fit (as R's loess, with a direct evaluation) at x_eval of any y measured at x"""
+
+    # the neighbourhood of each point has the floor(n*span) closest x
+    q = min(len(x), max(int(np.floor(len(x)*span)), degree+1))
+    distances = np.abs(x_eval[:,None] - x[None,:])
+    h = np.sort(distances, axis=1)[:,q-1][:,None]
+    weights = np.clip(1 - (distances/h)**3, 0, 1)**3
+
+    # the local polynomial regression, centered on each x_eval
+    X = (x[None,:,None] - x_eval[:,None,None])**np.arange(degree+1)[None,None,:]
+    XtW = np.transpose(X*weights[:,:,None], (0,2,1))
+    return np.einsum("mk,mkn->mn", np.linalg.pinv(XtW @ X)[:,0,:], XtW)
+
+def get_interpolation_matrix(x, x_eval):
+
+    """Returns the (len(x_eval), len(x)) matrix that gives the linear interpolation (as R's approxfun with rule=2) at x_eval of any y measured at x"""
+
+    return np.stack([np.interp(x_eval, x, e) for e in np.eye(len(x))], axis=1)
+
+def get_numerical_r(times, growth, span, log_fun, nBrute=1000):
+
+    """Returns the arrays of nr, nr_t, maxslp and maxslp_t of each row of growth (measured at times), as numerical_r of qfa (or numerical_r_log2 of get_fitness_measurements.R). The curves are loess-smoothed and interpolated on nBrute points, and the slopes are central differences of the interpolation"""
+
+    stimes = np.linspace(times.min(), times.max(), nBrute)
+    L = get_loess_matrix(times, stimes, span)
+
+    results = []
+    for values in [log_fun(growth) @ L.T, growth @ L.T]:
+
+        # the central difference with a tiny delta at each knot is the mean of the slopes of the adjacent segments (half the slope at the ends, as the interpolation is constant outside)
+        segment_slopes = np.diff(values, axis=1)/np.diff(stimes)
+        slopes = np.concatenate([segment_slopes[:,:1]/2, (segment_slopes[:,:-1]+segment_slopes[:,1:])/2, segment_slopes[:,-1:]/2], axis=1)
+
+        Imax = np.argmax(slopes, axis=1)
+        results += [slopes[np.arange(len(slopes)), Imax], stimes[Imax]]
+
+    return results
+
+def get_model_free_metrics(times, growth, days_experiment):
+
+    """Returns a dict with the arrays of the model-free estimates of each row of growth (measured at times): the numerical AUC until days_experiment and the growth at days_experiment (nAUC and nSTP of qfa, with AUCLim=STP=days_experiment), the maximum slopes of numerical_r (nr, nr_t, maxslp, maxslp_t) and the minimum doubling time in hours (DT_h of get_fitness_measurements.R, from the maximum log2 slope)"""
+
+    metrics = {}
+
+    # the AUC is the integral of the linear interpolation (constant outside times), which is the trapezoidal rule on the knots
+    knots = np.unique(np.concatenate([[0.0, days_experiment], times[(times>0) & (times<days_experiment)]]))
+    knots_growth = growth @ get_interpolation_matrix(times, knots).T
+    metrics["nAUC"] = np.sum((knots_growth[:,1:]+knots_growth[:,:-1])/2*np.diff(knots), axis=1)
+    metrics["nSTP"] = (growth @ get_interpolation_matrix(times, np.array([days_experiment])).T)[:,0]
+
+    # the rates of qfa (natural log and span 0.5) and the log2 rate of get_fitness_measurements.R (span 0.3)
+    metrics["nr"], metrics["nr_t"], metrics["maxslp"], metrics["maxslp_t"] = get_numerical_r(times, growth, 0.5, np.log)
+    with np.errstate(divide="ignore"): metrics["DT_h"] = np.minimum(24/get_numerical_r(times, growth, 0.3, np.log2)[0], max_dt)
+
+    return metrics
+
+def get_logistic_and_jacobian(log_parms, times):
+
+    """Returns the logistic curves (spots x timepoints) of the log(K), log(r), log(g) of each spot (rows of log_parms), and their jacobian (spots x timepoints x 3) on the log parameters"""
+
+    K, r, g = [np.exp(log_parms[:,I])[:,None] for I in range(3)]
+    E = np.exp(-r*times[None,:])
+    D = 1 + (K/g - 1)*E
+    curves = K/D
+
+    jacobian = np.stack([K*(1-E)/D**2, r*K*(K/g - 1)*times[None,:]*E/D**2, (K**2/g)*E/D**2], axis=2)
+    return curves, jacobian
+
+def fit_logistic_batch(times, growth, log_parms, lower, upper, max_iterations=200, tolerance=1e-10):
+
+    """Fits the logistic model to each row of growth (measured at times) with a Levenberg-Marquardt on the log parameters, starting from log_parms (spots x 3) and within the lower and upper log bounds. Returns the fitted log parameters and the sum of squared residuals of each spot"""
+
+    log_parms = np.clip(log_parms, lower, upper)
+    curves, jacobian = get_logistic_and_jacobian(log_parms, times)
+    ssr = np.sum((curves-growth)**2, axis=1)
+    damping = np.full(len(growth), 1e-3)
+    active = np.ones(len(growth), dtype=bool)
+
+    for iteration in range(max_iterations):
+        if not any(active): break
+        I = np.where(active)[0]
+
+        # get the step of the active spots, with the damping scaled to the curvature of each parameter
+        residuals = curves[I] - growth[I]
+        JtJ = np.einsum("snk,snl->skl", jacobian[I], jacobian[I])
+        Jtr = np.einsum("snk,sn->sk", jacobian[I], residuals)
+        A = JtJ + damping[I][:,None,None]*(np.eye(3)[None,:,:]*JtJ + 1e-12*np.eye(3)[None,:,:])
+        new_log_parms = np.clip(log_parms[I] - np.linalg.solve(A, Jtr[:,:,None])[:,:,0], lower[I], upper[I])
+
+        # keep the steps that improve the fit
+        new_curves, new_jacobian = get_logistic_and_jacobian(new_log_parms, times)
+        new_ssr = np.sum((new_curves-growth[I])**2, axis=1)
+        improved = new_ssr<ssr[I]
+        converged = (improved & ((ssr[I]-new_ssr)<=tolerance*ssr[I])) | (damping[I]>1e10) | (new_ssr==0)
+
+        Iimproved = I[improved]
+        log_parms[Iimproved] = new_log_parms[improved]
+        curves[Iimproved] = new_curves[improved]
+        jacobian[Iimproved] = new_jacobian[improved]
+        ssr[Iimproved] = new_ssr[improved]
+        damping[I] = np.where(improved, damping[I]/3, damping[I]*4)
+        active[I[converged]] = False
+
+    return log_parms, ssr
+
+def get_logistic_parms(times, growth, inocguess, minK=0.025, max_r=100.0):
+
+    """Returns the K, r, g and sum of squared residuals of the logistic fit of each row of growth (measured at times). g is bound to (inocguess/100, inocguess*10), as qfa.fit with fixG=FALSE. Each spot is fit from several initial rates, keeping the best fit. The spots that never reach minK are not fit (they have r=0, K=g=inocguess)"""
+
+    maxG = growth.max(axis=1)
+    lower = np.tile(np.log([inocguess/100, 1e-8, inocguess/100]), (len(growth), 1))
+    upper = np.column_stack([np.log(np.maximum(1.5*maxG, inocguess*10)), np.full(len(growth), np.log(max_r)), np.full(len(growth), np.log(inocguess*10))])
+
+    # the initial guesses are the maximum growth, the inoculum and several rates, from the steepest slope of log(growth) to the rate that reaches K at the end of the experiment
+    K0 = np.maximum(maxG, inocguess)
+    log_slopes = np.diff(np.log(growth), axis=1)/np.maximum(np.diff(times), 1e-12)
+    r_reach_K = np.maximum(np.log(K0/inocguess), 1.0)/max(times.max(), 1e-12)
+    best_log_parms, best_ssr = None, None
+    for r0 in [np.max(log_slopes, axis=1), r_reach_K, 2*r_reach_K, 4*r_reach_K]:
+        log_parms = np.column_stack([np.log(K0), np.log(np.clip(r0, 1e-6, max_r)), np.full(len(growth), np.log(inocguess))])
+        log_parms, ssr = fit_logistic_batch(times, growth, log_parms, lower, upper)
+        if best_ssr is None: best_log_parms, best_ssr = log_parms, ssr
+        else:
+            improved = ssr<best_ssr
+            best_log_parms[improved] = log_parms[improved]
+            best_ssr[improved] = ssr[improved]
+
+    K, r, g = [np.exp(best_log_parms[:,I]) for I in range(3)]
+
+    # the dead spots
+    dead = maxG<minK
+    K[dead], r[dead], g[dead] = inocguess, 0.0, inocguess
+    best_ssr[dead] = np.sum((growth[dead]-inocguess)**2, axis=1)
+
+    return K, r, g, best_ssr
+
+def get_logistic_curves(K, r, g, times):
+
+    """Returns the logistic curves (spots x timepoints) of each K, r and g"""
+
+    return K[:,None]/(1 + (K/g - 1)[:,None]*np.exp(-r[:,None]*times[None,:]))
+
+def get_rsquare(growth, predicted):
+
+    """Returns the squared pearson correlation of each row of growth and predicted (nan if any is constant, as R's cor)"""
+
+    growth_c = growth - growth.mean(axis=1)[:,None]
+    predicted_c = predicted - predicted.mean(axis=1)[:,None]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (np.sum(growth_c*predicted_c, axis=1)/np.sqrt(np.sum(growth_c**2, axis=1)*np.sum(predicted_c**2, axis=1)))**2
+
+def get_df_fitness_one_barcode(df_barcode, inocguess, days_experiment):
+
+    """Returns the fitness df (as qfa.fit plus makeFitness, rsquare and DT_h of get_fitness_measurements.R) of the spots of one barcode"""
+
+    # get the growth matrix
+    df_growth = df_barcode.pivot(index=["Row", "Column"], columns="Expt.Time", values="Growth")
+    if df_growth.isna().values.any(): raise ValueError("All the spots should have the same timepoints")
+    times = np.array(df_growth.columns, dtype=float)
+    growth = df_growth.values.astype(float)
+
+    # init the df with the data of each spot
+    df_spots = df_barcode.drop_duplicates(subset=["Row", "Column"]).set_index(["Row", "Column"]).loc[df_growth.index].reset_index()
+    df_fit = df_spots[["Barcode", "Row", "Column", "Screen.Name", "Treatments", "Medium", "ORF", "Gene", "Inoc.Time", "X.Offset", "Y.Offset", "Library.Name", "MasterPlate.Number", "RepQuad"]].rename(columns={"Screen.Name":"ScreenName", "Treatments":"Treatment", "X.Offset":"XOffset", "Y.Offset":"YOffset", "Library.Name":"Library", "MasterPlate.Number":"Plate"})
+
+    # fit the logistic model
+    K, r, g, ssr = get_logistic_parms(times, growth, inocguess)
+    df_fit["K"], df_fit["r"], df_fit["g"], df_fit["v"], df_fit["objval"], df_fit["d0"] = K, r, g, 1.0, ssr, growth[:,0]
+
+    # get the model-free estimates
+    for field, values in get_model_free_metrics(times, growth, days_experiment).items(): df_fit[field] = values
+
+    # get the fitness estimates of makeFitness. The spots that do not double (K<=2g) have a MDR of 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        doubles = K>2*g
+        df_fit["MDR"] = np.where(doubles, r/np.log(2*(K-g)/np.where(doubles, K-2*g, 1.0)), 0.0)
+        df_fit["MDP"] = np.maximum(np.log(K/g)/np.log(2), 0.0)
+        df_fit["MDRMDP"] = df_fit.MDR*df_fit.MDP
+        df_fit["glog_maxslp"] = r*K/4
+        df_fit["DT"] = 24/df_fit.MDR
+        df_fit["AUC"] = np.where(r>0, (K/np.where(r>0, r, 1.0))*np.log((g*np.exp(r*days_experiment) + K - g)/K), g*days_experiment)
+
+    # add the rsquare of get_fitness_measurements.R
+    df_fit["rsquare"] = get_rsquare(growth, get_logistic_curves(K, r, g, times))
+
+    return df_fit, times, growth
+
+def plot_growth_curves(output_plots, barcode_to_fit_data, maxt, nrows=8, ncols=12):
+
+    """Writes one page of output_plots for each barcode, with the growth of each spot and its logistic fit (as qfa.plot)"""
+
+    from matplotlib.backends.backend_pdf import PdfPages
+    output_plots_tmp = "%s.tmp.pdf"%output_plots
+    with PdfPages(output_plots_tmp) as pdf:
+        for barcode, (df_fit, times, growth) in sorted(barcode_to_fit_data.items()):
+
+            fig, axes = plt.subplots(nrows, ncols, figsize=(ncols*2, nrows*2), sharex=True, sharey=True)
+            fit_times = np.linspace(0, maxt, 100)
+            fit_curves = get_logistic_curves(df_fit.K.values, df_fit.r.values, df_fit.g.values, fit_times)
+            for I, r in enumerate(df_fit.itertuples()):
+                ax = axes[r.Row-1, r.Column-1]
+                ax.plot(times, growth[I], "o", color="black", markersize=2)
+                ax.plot(fit_times, fit_curves[I], "-", color="red", linewidth=1)
+                ax.set_title("%s (%i,%i)"%(r.ORF, r.Row, r.Column), fontsize=6)
+                ax.tick_params(labelsize=5)
+
+            fig.suptitle(barcode)
+            fig.subplots_adjust(left=0.03, right=0.99, bottom=0.03, top=0.94, wspace=0.15, hspace=0.35)
+            pdf.savefig(fig)
+            plt.close(fig)
+
+    os.rename(output_plots_tmp, output_plots)
+
+def run_fitness_measurements(input_dir, days_experiment):
+
+    """Writes <input_dir>/processed_all_data.tbl, logRegression_fits.tbl and output_plots.pdf as get_fitness_measurements.R <input_dir> <days_experiment>"""
+
+    df = get_df_colonyzer_data(input_dir)
+
+    # the inoculum guess is the median growth in the first timepoint
+    inocguess = np.median(df[df["Timeseries.order"]==1].Growth)
+
+    # fit each barcode
+    barcode_to_fit_data = {barcode : get_df_fitness_one_barcode(df_barcode, inocguess, days_experiment) for barcode, df_barcode in df.groupby("Barcode")}
+    df_fit = pd.concat([barcode_to_fit_data[b][0] for b in sorted(barcode_to_fit_data)]).reset_index(drop=True)
+
+    # write
+    plot_growth_curves("%s/output_plots.pdf"%input_dir, barcode_to_fit_data, days_experiment)
+    for df_write, name in [(df, "processed_all_data.tbl"), (df_fit, "logRegression_fits.tbl")]:
+        df_write.to_csv("%s/%s.tmp"%(input_dir, name), sep="\t", index=False, header=True, na_rep="NA")
+        os.rename("%s/%s.tmp"%(input_dir, name), "%s/%s"%(input_dir, name))
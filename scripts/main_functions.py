@@ -1,16 +1,14 @@
 # Functions that can be run in any OS
 
 # universal imports
-import os, sys, argparse, shutil, subprocess, time
+import os, sys, argparse, shutil, subprocess, time, json
 
 # environment checks
 #print("Testing that the python packages are correctly installed...")
 try: 
 
-    # try to import PIL and tk and pandas
+    # try to import PIL and pandas (the libraries of the windows are checked in import_GUI_libraries)
     from PIL import Image as PIL_Image
-    from PIL import ImageTk
-    import tkinter as tk
     import pandas as pd
 
 except:
@@ -18,16 +16,9 @@ except:
     # log
     print("ERROR: Some of the python libraries necessary to run this are not installed. You can install them with Anaconda Navigator, as explained in https://github.com/Gabaldonlab/Q-PHAST.")
 
-    # tk debug
-    try: import tkinter as tk
-    except:
-        print("ERROR: the library 'tk' is not installed. You can install it with Anaconda Navigator, as explained in https://github.com/Gabaldonlab/Q-PHAST.")
-        sys.exit(1)
-
     # PIL debug
     try:
         from PIL import Image as PIL_Image
-        from PIL import ImageTk
 
     except:
         print("ERROR: the library 'pillow' is not installed. You can install it with Anaconda Navigator, as explained in https://github.com/Gabaldonlab/Q-PHAST.")
@@ -45,19 +36,37 @@ except:
 
 # specific (non-general) imports
 from pathlib import Path
-import tkinter as tk
-from tkinter.filedialog import askopenfilename, askdirectory
 import subprocess
 import webbrowser
 from PIL import Image as PIL_Image
-from PIL import ImageTk
 from datetime import date
+import grid_detection as grid_det
 
 # define general variables
 window_width = 400 # width of all windows
 pipeline_name = "Q-PHAST"
 
 # functions
+def import_GUI_libraries():
+
+    """Imports the libraries of the windows (tk and ImageTk) as globals. This is not done with --headless, so that Q-PHAST can run without a display"""
+
+    global tk, ImageTk, askopenfilename, askdirectory
+
+    # tk debug
+    try: 
+        import tkinter as tk
+        from tkinter.filedialog import askopenfilename, askdirectory
+    except:
+        print("ERROR: the library 'tk' is not installed. You can install it with Anaconda Navigator, as explained in https://github.com/Gabaldonlab/Q-PHAST.")
+        sys.exit(1)
+
+    # PIL debug
+    try: from PIL import ImageTk
+    except:
+        print("ERROR: the library 'pillow' is not installed. You can install it with Anaconda Navigator, as explained in https://github.com/Gabaldonlab/Q-PHAST.")
+        sys.exit(1)
+
 def get_fullpath(x): return os.path.realpath(x)
 
 
@@ -160,7 +169,11 @@ def generate_os_window():
 
 def generate_closing_window(text_print):
 
-    """Generates a closing window, depending on the os"""
+    """Generates a closing window, depending on the os. With --headless the text is only printed"""
+
+    if opt.headless is True: 
+        print_with_runtime(text_print)
+        return
 
     # define a function that closes window
     def close_window(): 
@@ -565,6 +578,12 @@ def generate_analyze_images_window_optional_old():
     # run and debug
     window.mainloop()
 
+def get_docker_cmd_run_app(initial_docker_cmd, docker_stderr_name="docker_stderr.txt"):
+
+    """Returns the docker cmd that runs run_app.py, with the stderr in <output>/<docker_stderr_name>"""
+
+    return initial_docker_cmd + ' %s bash -c "source /opt/conda/etc/profile.d/conda.sh && conda activate main_env > /dev/null 2>&1 && /workdir_app/scripts/run_app.py 2>/output/%s"'%(opt.docker_image, docker_stderr_name)
+
 def run_docker_cmd(initial_docker_cmd, final_files, print_cmd=True):
 
     """Runs docker cmd with proper debugging"""
@@ -575,7 +594,7 @@ def run_docker_cmd(initial_docker_cmd, final_files, print_cmd=True):
         return
 
     # add the run_app.py command
-    docker_cmd = initial_docker_cmd + ' %s bash -c "source /opt/conda/etc/profile.d/conda.sh && conda activate main_env > /dev/null 2>&1 && /workdir_app/scripts/run_app.py 2>/output/docker_stderr.txt"'%opt.docker_image
+    docker_cmd = get_docker_cmd_run_app(initial_docker_cmd)
 
     # log
     #if print_cmd is True: print("Running docker image with the following cmd:\n---\n%s\n---\n"%docker_cmd)
@@ -597,7 +616,29 @@ def run_docker_cmd(initial_docker_cmd, final_files, print_cmd=True):
     # clean
     remove_file(docker_stderr)
 
+def start_docker_cmd_background(initial_docker_cmd, docker_stderr_name):
+
+    """Starts the docker cmd in the background (without -it, as there is no terminal), so that it runs while the GUI is used. The stderr is in <output>/<docker_stderr_name>. Returns the subprocess.Popen object"""
+
+    docker_cmd = get_docker_cmd_run_app(initial_docker_cmd.replace(" -it ", " "), docker_stderr_name=docker_stderr_name)
+    return subprocess.Popen(docker_cmd, shell=True, stdout=subprocess.DEVNULL)
+
+def wait_docker_cmd_background(initial_docker_cmd, docker_process, docker_stderr_name):
+
+    """Waits for a docker cmd started with start_docker_cmd_background, with the debugging of run_docker_cmd"""
+
+    docker_stderr = "%s%s%s"%(opt.output, get_os_sep(), docker_stderr_name)
+    if docker_process.wait()!=0:
+
+        # give permissions to output
+        run_cmd('%s %s bash -c "chmod -R 777 /output"'%(initial_docker_cmd, opt.docker_image)) 
+
+        # print error log
+        print("\n\nERROR: The run of the docker image failed. The docker command is:\n---\n%s\n---\n\nThis is the error log (check it to fix the error):\n---\n%s\n---\nExiting with code 1!"%(docker_process.args.replace("2>/output/%s"%docker_stderr_name,""), "".join(open(docker_stderr, "r").readlines())))
+        sys.exit(1)
 
+    # clean
+    remove_file(docker_stderr)
 
 
 def get_coords_one_image_GUIapp(colonizer_coordinates_one_spot, coordinate_obtention_dir_plate, latest_image, backbone_title):
@@ -882,11 +923,30 @@ def get_yyyymmddhhmm_tuple_one_image_name(filename):
 
     return numbers_tuple
 
+def get_sorted_image_names_plate_dir(dest_processed_images_dir):
+
+    """Gets the sorted (by time) image names of a <tmp>/processed_images_each_plate/<plate_batch>_plate<plate> folder. They are taken from <tmp>/image_catalog.json (written in the docker image), or from listing the folder if there is no catalog"""
+
+    # define the catalog
+    tmpdir = get_os_sep().join(dest_processed_images_dir.split(get_os_sep())[0:-2])
+    plate_batch, plate = dest_processed_images_dir.split(get_os_sep())[-1].rsplit("_plate", 1)
+    catalog_file = "%s%simage_catalog.json"%(tmpdir, get_os_sep())
+
+    # list files
+    if file_is_empty(catalog_file): return sorted({f for f in os.listdir(dest_processed_images_dir) if not f.startswith(".") and f not in {"Colonyzer.txt.tmp", "Colonyzer.txt"}}, key=get_yyyymmddhhmm_tuple_one_image_name)
+
+    # get from the catalog, which is sorted
+    else: return [x["image"] for x in json.load(open(catalog_file, "r"))["images"] if x["plate_batch"]==plate_batch and int(plate) in x["plates"]]
+
 
 def validate_colonyzer_coordinates_one_plate_batch_and_plate_GUI(tmpdir, plate_batch, plate, sorted_image_names):
 
     """This function opens an image for a given plate and asks for the user input. If the colonyzer coordinates are bad, it removes the coordinates and also the colonyzer_subset runs"""
 
+    # with --auto_accept, the coordinates are accepted without showing them
+    if opt.auto_accept is True: return
+    elif not opt.auto_accept is False: raise ValueError("auto_accept should be T/F")
+
     # define dirs
     processed_images_dir_plate = "%s%sprocessed_images_each_plate%s%s_plate%i"%(tmpdir, get_os_sep(), get_os_sep(), plate_batch, plate)
     colonyzer_runs_subset_dir_plate = "%s%scolonyzer_runs_subset%s%s_plate%i"%(tmpdir, get_os_sep(), get_os_sep(), plate_batch, plate)
@@ -939,14 +999,6 @@ def validate_colonyzer_coordinates_one_plate_batch_and_plate_GUI(tmpdir, plate_b
     window.bind("<y>", yes_click)
     window.bind("<n>", no_click)
 
-    # if autoacceptance is set, kill the image after 1s
-    if opt.auto_accept is True: 
-        def close_window(): window.destroy()
-        window.after(1000, close_window)
-        dict_data["correct_coords"] = True
-
-    elif not opt.auto_accept is False: raise ValueError("auto_accept should be T/F")
-
     # run the window
     window.mainloop() 
 
@@ -974,6 +1026,157 @@ def generate_colonyzer_coordinates_one_plate_batch_and_plate_transfer_from_1st_p
     open(coords_file_tmp, "w").write("".join(coords_lines))
     os.rename(coords_file_tmp, coords_file)
 
+def generate_colonyzer_coordinates_one_plate_batch_and_plate_grid_detection(dest_processed_images_dir, sorted_image_names, plate_batch, plate, min_confidence):
+
+    """Generates a 'Colonyzer.txt' file in dest_processed_images_dir from the grid detected in the latest image, if the confidence is at least min_confidence. Returns whether the file was generated"""
+
+    # detect the grid
+    latest_image = sorted_image_names[-1]
+    A1, H12, confidence = grid_det.get_grid_coordinates("%s%s%s"%(dest_processed_images_dir, get_os_sep(), latest_image))
+    if A1 is None or confidence<min_confidence:
+        print_with_runtime("The automatic coordinates of %s-plate%i have a confidence of %.2f. Getting them manually..."%(plate_batch, plate, confidence))
+        return False
+
+    print_with_runtime("Using the automatic coordinates of %s-plate%i (confidence %.2f)"%(plate_batch, plate, confidence))
+    write_colonyzer_coordinates_all_images(dest_processed_images_dir, sorted_image_names, A1, H12)
+
+    return True
+
+def write_colonyzer_coordinates_all_images(dest_processed_images_dir, sorted_image_names, A1, H12):
+
+    """Writes the 'Colonyzer.txt' file of dest_processed_images_dir (as the GUI does), with the (x, y) of the A1 and H12 spots for all images"""
+
+    coordinates_str = "%i,%i,%i,%i"%(A1[0], A1[1], H12[0], H12[1])
+    coords_lines = ["######\n", "default,96,%s,%s\n"%(coordinates_str, date.today()), "######\n"] + ["%s,96,%s\n"%(image, coordinates_str) for image in sorted_image_names]
+
+    colonizer_coordinates = "%s%sColonyzer.txt"%(dest_processed_images_dir, get_os_sep())
+    colonizer_coordinates_tmp = "%s.tmp"%colonizer_coordinates
+    open(colonizer_coordinates_tmp, "w").write("".join(coords_lines))
+    os.rename(colonizer_coordinates_tmp, colonizer_coordinates)
+
+def get_scanner_profiles(scanner_profiles_file):
+
+    """Returns the scanner profiles (a dict that maps '<plate_batch>-plate<plate>-<width>x<height>' to the coordinates and date of the last validated coordinates), or an empty dict"""
+
+    if file_is_empty(scanner_profiles_file): return {}
+    return json.load(open(scanner_profiles_file, "r"))
+
+def get_candidate_coordinates_scanner_profiles(scanner_profiles_file, plate_batch, plate, image_size):
+
+    """Returns the list of (A1, H12) stored for the plate (quadrant) and image size, first those of the same plate batch (scanner) and then those of other plate batches (the most recent first)"""
+
+    key_suffix = "-plate%i-%ix%i"%(plate, image_size[0], image_size[1])
+    key = "%s%s"%(plate_batch, key_suffix)
+    scanner_profiles = get_scanner_profiles(scanner_profiles_file)
+    sorted_keys = [k for k in [key] if k in scanner_profiles] + sorted([k for k in scanner_profiles if k.endswith(key_suffix) and k!=key], key=lambda k: scanner_profiles[k]["date"], reverse=True)
+
+    return [(tuple(scanner_profiles[k]["coordinates"][0:2]), tuple(scanner_profiles[k]["coordinates"][2:4])) for k in sorted_keys]
+
+def save_coordinates_scanner_profiles(scanner_profiles_file, plate_batch, plate, image_size, colonizer_coordinates):
+
+    """Saves the coordinates of colonizer_coordinates (a Colonyzer.txt file) into the scanner profiles, for the plate batch, plate and image size"""
+
+    coordinates = [int(x) for x in open(colonizer_coordinates, "r").readlines()[3].strip().split(",")[2:6]]
+
+    scanner_profiles = get_scanner_profiles(scanner_profiles_file)
+    scanner_profiles["%s-plate%i-%ix%i"%(plate_batch, plate, image_size[0], image_size[1])] = {"coordinates":coordinates, "date":time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())}
+
+    scanner_profiles_file_tmp = "%s.tmp"%scanner_profiles_file
+    json.dump(scanner_profiles, open(scanner_profiles_file_tmp, "w"), indent=4, sort_keys=True)
+    os.rename(scanner_profiles_file_tmp, scanner_profiles_file)
+
+def generate_colonyzer_coordinates_one_plate_batch_and_plate_scanner_profiles(dest_processed_images_dir, sorted_image_names, plate_batch, plate, min_confidence, scanner_profiles_file):
+
+    """Generates a 'Colonyzer.txt' file in dest_processed_images_dir from the coordinates of the scanner profiles that fit the latest image (the first with a confidence of at least min_confidence). Returns whether the file was generated"""
+
+    latest_image_file = "%s%s%s"%(dest_processed_images_dir, get_os_sep(), sorted_image_names[-1])
+    candidate_coordinates = get_candidate_coordinates_scanner_profiles(scanner_profiles_file, plate_batch, plate, PIL_Image.open(latest_image_file).size)
+
+    for A1_stored, H12_stored in candidate_coordinates:
+
+        A1, H12, confidence = grid_det.get_grid_fit(latest_image_file, A1_stored, H12_stored)
+        if A1 is not None and confidence>=min_confidence:
+            print_with_runtime("Using the coordinates of the scanner profiles for %s-plate%i (confidence %.2f)"%(plate_batch, plate, confidence))
+            write_colonyzer_coordinates_all_images(dest_processed_images_dir, sorted_image_names, A1, H12)
+            return True
+
+    if len(candidate_coordinates)>0: print_with_runtime("The coordinates of the scanner profiles do not fit %s-plate%i"%(plate_batch, plate))
+    return False
+
+def get_input_images_follow(input_dir):
+
+    """Returns a dict that maps each image in the subfolders of input_dir (one for each plate batch) to its (size, modification time)"""
+
+    image_to_size_and_mtime = {}
+    for d in sorted(os.listdir(input_dir)):
+        plate_batch_dir = "%s%s%s"%(input_dir, get_os_sep(), d)
+        if d.startswith(".") or not os.path.isdir(plate_batch_dir): continue
+
+        for f in os.listdir(plate_batch_dir):
+            if f.startswith(".") or f.split(".")[-1].lower() not in {"tiff", "jpg", "jpeg", "png", "tif", "gif"}: continue
+            image = "%s%s%s"%(plate_batch_dir, get_os_sep(), f)
+            image_to_size_and_mtime[image] = (os.path.getsize(image), os.path.getmtime(image))
+
+    return image_to_size_and_mtime
+
+def wait_for_first_images_follow(input_dir, poll_seconds, min_images=2):
+
+    """Waits until each subfolder of input_dir has at least min_images images, and they were not modified in the last poll_seconds"""
+
+    while True:
+
+        image_to_size_and_mtime = get_input_images_follow(input_dir)
+        plate_batch_to_nimages = {}
+        for image, (size, mtime) in image_to_size_and_mtime.items():
+            if (time.time()-mtime)>=poll_seconds: 
+                plate_batch = image.split(get_os_sep())[-2]
+                plate_batch_to_nimages[plate_batch] = plate_batch_to_nimages.setdefault(plate_batch, 0) + 1
+
+        plate_batches = [d for d in os.listdir(input_dir) if not d.startswith(".") and os.path.isdir("%s%s%s"%(input_dir, get_os_sep(), d))]
+        if all([plate_batch_to_nimages.get(pb, 0)>=min_images for pb in plate_batches]): break
+
+        print_with_runtime("Waiting for at least %i images in each plate batch (%s)..."%(min_images, ", ".join(["%s:%i"%(pb, plate_batch_to_nimages.get(pb, 0)) for pb in sorted(plate_batches)])))
+        time.sleep(poll_seconds)
+
+def run_follow_new_images(input_dir, outdir, docker_cmd, poll_seconds, timeout_hours):
+
+    """Watches input_dir and runs the analyze_images_follow_new_images module each time that there are new images, until the images cover the hours of the experiment or there are no new images for timeout_hours"""
+
+    follow_status_file = "%s%stmp%sfollow_status.json"%(outdir, get_os_sep(), get_os_sep())
+    analyzed_image_to_size_and_mtime = None
+    previous_image_to_size_and_mtime = {}
+    last_new_images_time = time.time()
+
+    while True:
+
+        # get the images that did not change since the last poll. The others may be still being written by the scanner, and they are analyzed once their size stops changing
+        image_to_size_and_mtime = get_input_images_follow(input_dir)
+        stable_image_to_size_and_mtime = {image : size_and_mtime for image, size_and_mtime in image_to_size_and_mtime.items() if previous_image_to_size_and_mtime.get(image)==size_and_mtime}
+        previous_image_to_size_and_mtime = image_to_size_and_mtime
+
+        # run on the new images
+        if len(stable_image_to_size_and_mtime)>0 and stable_image_to_size_and_mtime!=analyzed_image_to_size_and_mtime:
+
+            print_with_runtime("Analyzing new images...")
+            run_docker_cmd("%s -e MODULE=analyze_images_follow_new_images"%(docker_cmd), [])
+            last_new_images_time = time.time()
+
+            # keep the images that were old enough to be analyzed (the recent ones are skipped in the docker image)
+            analyzed_image_to_size_and_mtime = {image : (size, mtime) for image, (size, mtime) in stable_image_to_size_and_mtime.items() if (time.time()-mtime)>=poll_seconds}
+
+            # check if the experiment finished
+            follow_status = json.load(open(follow_status_file, "r"))
+            if follow_status["finished"] is True: 
+                print_with_runtime("The images cover the %.2f hours of the experiment."%follow_status["hours_experiment"])
+                break
+
+        # stop if there were no images for a while
+        elif (time.time()-last_new_images_time)>(timeout_hours*3600):
+            print_with_runtime("WARNING: There were no new images in the last %.2f hours, so that the experiment is considered finished."%timeout_hours)
+            break
+
+        time.sleep(poll_seconds)
+
 def get_colonyzer_coordinates_GUI(outdir, docker_cmd):
 
     """Generates the colonyzer coordinates for each plate from outdir"""
@@ -998,7 +1201,7 @@ def get_colonyzer_coordinates_GUI(outdir, docker_cmd):
         coordinate_obtention_dir_plate = "%s%s%s_plate%i"%(coordinate_obtention_dir, get_os_sep(), plate_batch, plate); make_folder(coordinate_obtention_dir_plate)
 
         # define the images name
-        sorted_images = sorted({f for f in os.listdir(dest_processed_images_dir) if not f.startswith(".") and f not in {"Colonyzer.txt.tmp", "Colonyzer.txt"}}, key=get_yyyymmddhhmm_tuple_one_image_name)
+        sorted_images = get_sorted_image_names_plate_dir(dest_processed_images_dir)
 
         # keep
         args_coordinates.append((dest_processed_images_dir, coordinate_obtention_dir_plate, sorted_images, plate_batch, plate))
@@ -1007,53 +1210,99 @@ def get_colonyzer_coordinates_GUI(outdir, docker_cmd):
     final_files = ["%s%sColonyzer.txt"%(x[0], get_os_sep()) for x in args_coordinates]
     final_file_correct = "%s%scoordinates_checking_worked_well.txt"%(tmpdir, get_os_sep())
 
-    # keep trying to generate these files while they are not generated
-    while any([file_is_empty(x) for x in final_files]) or file_is_empty(final_file_correct):
+    # define the plates where the automatic coordinates were tried (the rejected ones are then set manually)
+    plates_automatic_coordinates_tried = set()
+    scanner_profiles_file = "%s%sscanner_profiles.json"%(opt.cache_dir, get_os_sep())
+
+    # define the background checks of each plate (run with colonyzer as soon as the coordinates are set, at most one for each cpu) and the plates that were validated
+    plate_to_check_process = {}
+    validated_plates = set()
+    max_background_checks = max(1, os.cpu_count() or 1)
 
-        print_with_runtime("Getting the coordinates...")
+    # keep trying to generate these files while they are not generated. If anything fails, the background checks that are running are waited for, so that no containers are left behind
+    try:
+        while any([file_is_empty(x) for x in final_files]) or file_is_empty(final_file_correct):
 
-        # define the missing files
-        missing_final_files = [x for x in final_files if file_is_empty(x)]
+            print_with_runtime("Getting the coordinates...")
 
-        # define the coordinates file of the 1st plate tested
-        coords_file_1st_plate = "%s%sColonyzer.txt"%(args_coordinates[0][0], get_os_sep())
+            # define the missing files
+            missing_final_files = [x for x in final_files if file_is_empty(x)]
 
-        # get the corrdinates files
-        for I, (dest_processed_images_dir, coordinate_obtention_dir_plate, sorted_images, plate_batch, plate) in enumerate(args_coordinates):
+            # define the coordinates file of the 1st plate tested
+            coords_file_1st_plate = "%s%sColonyzer.txt"%(args_coordinates[0][0], get_os_sep())
 
-            # define the final file
-            coords_file = "%s%sColonyzer.txt"%(dest_processed_images_dir, get_os_sep())
-            if I==0 and coords_file_1st_plate!=coords_file: raise ValueError("error in coords_file_1st_plate")
+            # get the corrdinates files
+            for I, (dest_processed_images_dir, coordinate_obtention_dir_plate, sorted_images, plate_batch, plate) in enumerate(args_coordinates):
 
-            # generate file
-            if file_is_empty(coords_file):
+                # define the final file
+                coords_file = "%s%sColonyzer.txt"%(dest_processed_images_dir, get_os_sep())
+                if I==0 and coords_file_1st_plate!=coords_file: raise ValueError("error in coords_file_1st_plate")
 
-                # default behavior: get coords manually
-                if opt.coords_1st_plate is False or I==0:
-                    generate_colonyzer_coordinates_one_plate_batch_and_plate_inHouseGUI(dest_processed_images_dir, coordinate_obtention_dir_plate, sorted_images, plate_batch, plate, docker_cmd)
+                # try to get the coordinates from the scanner profiles or automatically (only once for each plate)
+                if file_is_empty(coords_file) and (plate_batch, plate) not in plates_automatic_coordinates_tried:
+                    plates_automatic_coordinates_tried.add((plate_batch, plate))
 
-                # for I>0 if --coords_1st_plate, get the coordinates of the first plate
-                elif opt.coords_1st_plate is True and I>0:
-                    print("Getting coordinates of the first plate...")
-                    generate_colonyzer_coordinates_one_plate_batch_and_plate_transfer_from_1st_plate(coords_file, coords_file_1st_plate, sorted_images)
+                    if opt.scanner_profiles is True: generate_colonyzer_coordinates_one_plate_batch_and_plate_scanner_profiles(dest_processed_images_dir, sorted_images, plate_batch, plate, opt.automatic_coordinates_min_confidence, scanner_profiles_file)
+                    if file_is_empty(coords_file) and opt.automatic_coordinates is True: generate_colonyzer_coordinates_one_plate_batch_and_plate_grid_detection(dest_processed_images_dir, sorted_images, plate_batch, plate, opt.automatic_coordinates_min_confidence)
 
-        # generate a succes window
-        generate_closing_window("Coordinates set. Checking them...")
+                # generate file
+                if file_is_empty(coords_file):
 
-        # run colonyzer in parallel using a subset of the images 
-        run_docker_cmd("%s -e MODULE=analyze_images_run_colonyzer_subset_images"%(docker_cmd), [], print_cmd=False)
+                    # default behavior: get coords manually
+                    if opt.coords_1st_plate is False or I==0:
+                        if opt.headless is True: raise ValueError("The coordinates of %s-plate%i could not be obtained automatically (or they were rejected), and they can't be set manually with --headless"%(plate_batch, plate))
+                        generate_colonyzer_coordinates_one_plate_batch_and_plate_inHouseGUI(dest_processed_images_dir, coordinate_obtention_dir_plate, sorted_images, plate_batch, plate, docker_cmd)
 
-        # show the images for validation, and remove the colonyzer coordinates that did not work well
-        print_with_runtime("Validating the coordinates...")
-        for I, (dest_processed_images_dir, coordinate_obtention_dir_plate, sorted_images, plate_batch, plate) in enumerate(args_coordinates):
-            #print('Validating coordinates for plate_batch %s and plate %i %i/%i'%(plate_batch, plate, I+1, len(all_dirs)))
-            validate_colonyzer_coordinates_one_plate_batch_and_plate_GUI(tmpdir, plate_batch, plate, sorted_images)
+                    # for I>0 if --coords_1st_plate, get the coordinates of the first plate
+                    elif opt.coords_1st_plate is True and I>0:
+                        print("Getting coordinates of the first plate...")
+                        generate_colonyzer_coordinates_one_plate_batch_and_plate_transfer_from_1st_plate(coords_file, coords_file_1st_plate, sorted_images)
 
-        # create the final file indicating that this worked well
-        if not any([file_is_empty(x) for x in final_files]): open(final_file_correct, "w").write("coodinates selection worked well...")
+                # check the coordinates of this plate (running colonyzer on a subset of the images) in the background, while the next plates are set. With --auto_accept the checks are not shown, but they still stop the run if colonyzer fails with these coordinates
+                if (plate_batch, plate) not in plate_to_check_process: 
 
-        # generate a success 
-        generate_closing_window("Coordinates validated. Running analysis...")
+                    # at most max_background_checks run at the same time, so that the oldest one is waited for before starting a new one
+                    running_checks = [(pb_p, docker_process) for pb_p, docker_process in plate_to_check_process.items() if docker_process is not None]
+                    if len(running_checks)>=max_background_checks:
+                        (pb_oldest, p_oldest), docker_process = running_checks[0]
+                        wait_docker_cmd_background(docker_cmd, docker_process, "docker_stderr_%s_plate%i.txt"%(pb_oldest, p_oldest))
+                        plate_to_check_process[(pb_oldest, p_oldest)] = None
+
+                    plate_to_check_process[(plate_batch, plate)] = start_docker_cmd_background("%s -e MODULE=analyze_images_run_colonyzer_subset_images -e subset_plate=%s_plate%i"%(docker_cmd, plate_batch, plate), "docker_stderr_%s_plate%i.txt"%(plate_batch, plate))
+
+            # generate a succes window
+            generate_closing_window("Coordinates set. Checking them...")
+
+            # wait for the checks of each plate
+            for (plate_batch, plate), docker_process in plate_to_check_process.items():
+                if docker_process is not None: 
+                    wait_docker_cmd_background(docker_cmd, docker_process, "docker_stderr_%s_plate%i.txt"%(plate_batch, plate))
+                    plate_to_check_process[(plate_batch, plate)] = None
+
+            # show the images for validation (only for the plates that were not validated), and remove the colonyzer coordinates that did not work well. The rejected plates are set and checked again
+            print_with_runtime("Validating the coordinates...")
+            for I, (dest_processed_images_dir, coordinate_obtention_dir_plate, sorted_images, plate_batch, plate) in enumerate(args_coordinates):
+                #print('Validating coordinates for plate_batch %s and plate %i %i/%i'%(plate_batch, plate, I+1, len(all_dirs)))
+                if (plate_batch, plate) in validated_plates: continue
+                validate_colonyzer_coordinates_one_plate_batch_and_plate_GUI(tmpdir, plate_batch, plate, sorted_images)
+
+                if not file_is_empty("%s%sColonyzer.txt"%(dest_processed_images_dir, get_os_sep())): 
+                    validated_plates.add((plate_batch, plate))
+
+                    # keep the validated coordinates for the next runs (only if they were checked by a person, not with --auto_accept)
+                    if opt.scanner_profiles is True and opt.auto_accept is False: save_coordinates_scanner_profiles(scanner_profiles_file, plate_batch, plate, PIL_Image.open("%s%s%s"%(dest_processed_images_dir, get_os_sep(), sorted_images[-1])).size, "%s%sColonyzer.txt"%(dest_processed_images_dir, get_os_sep()))
+
+                else: plate_to_check_process.pop((plate_batch, plate))
+
+            # create the final file indicating that this worked well
+            if not any([file_is_empty(x) for x in final_files]): open(final_file_correct, "w").write("coodinates selection worked well...")
+
+            # generate a success 
+            generate_closing_window("Coordinates validated. Running analysis...")
+
+    finally:
+        for docker_process in plate_to_check_process.values():
+            if docker_process is not None: docker_process.wait()
 
 def get_if_excels_are_equal(file1, file2):
 
@@ -1157,14 +1406,6 @@ def validate_automatic_bad_spot(r, tmpdir):
         window.bind("<b>", bad_click)
         window.bind("<g>", good_click)
 
-        # automatic validation
-        if opt.auto_accept is True:
-            def close_window(): window.destroy()
-            window.after(1000, close_window)
-            dict_data["is_bad_spot"] = True
-
-        elif not opt.auto_accept is False: raise ValueError("auto_accept should be T/F")
-
         # run the window
         window.mainloop() 
 
@@ -1217,14 +1458,18 @@ def generate_df_bad_spots_automatic_validated(outdir):
 
             print_with_runtime("Validating bad spots...")
 
-            for I, (idx,r) in enumerate(df_bad_spots_all_auto.iterrows()):
-                #print("Validating bad spot %i/%i..."%(I+1, len(df_bad_spots_all_auto)))
+            # with --auto_accept, all the potential bad spots are bad spots (without writing one validation file for each)
+            if opt.auto_accept is True: df_bad_spots_validated = df_bad_spots_all.reset_index(drop=True)
+
+            else:
+                for I, (idx,r) in enumerate(df_bad_spots_all_auto.iterrows()):
+                    #print("Validating bad spot %i/%i..."%(I+1, len(df_bad_spots_all_auto)))
 
-                # define if this is a true bad spot
-                true_bad_spot = validate_automatic_bad_spot(r, tmpdir)
+                    # define if this is a true bad spot
+                    true_bad_spot = validate_automatic_bad_spot(r, tmpdir)
 
-                # add to df if necessary
-                if true_bad_spot is True: df_bad_spots_validated = pd.concat([df_bad_spots_validated, pd.DataFrame({0 : r}).transpose()]).reset_index(drop=True)
+                    # add to df if necessary
+                    if true_bad_spot is True: df_bad_spots_validated = pd.concat([df_bad_spots_validated, pd.DataFrame({0 : r}).transpose()]).reset_index(drop=True)
 
             # closing windows
             generate_closing_window("Bad spots validated!")
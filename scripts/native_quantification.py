@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+
+# A numpy implementation of the quantification of colonyzer (Colonyzer2 1.1.22, run as 'colonyzer --initpos --fmt 96 [--lc]'), which writes the same Output_Data/<image>.dat files for all the images of one plate. This should be imported from the main_env.
+
+# Colonyzer runs on python 2, so that the rounding of the spot coordinates follows python 2 (half away from zero). Only the parameters lc and diffims are implemented (the lids of --greenlab are not detected, and --cut and --edgemask are not available), and all images are analyzed.
+
+# define the colonyzer parameters that can be used
+native_parms_colonyzer = {"lc", "diffims", "none"}
+
+# imports
+import os, math, warnings
+import numpy as np
+import pandas as pd
+from PIL import Image as PIL_Image
+from scipy import ndimage
+
+# functions
+def round_py2(x):
+
+    """Rounds as python 2 (half away from zero), returning an int"""
+
+    return int(math.floor(abs(x)+0.5)*(1 if x>=0 else -1))
+
+def get_colonyzer_instructions(colonyzer_txt):
+
+    """Returns a dict that maps each image name (or 'default') to the [format, tlx, tly, brx, bry] of Colonyzer.txt"""
+
+    instructions = {}
+    for line in open(colonyzer_txt, "r").readlines():
+        if line[0] in {"#", "\n", "\r"}: continue
+        fields = line.strip().split(",")
+        instructions[fields[0]] = [fields[1]] + [int(x) for x in fields[2:6]]
+
+    return instructions
+
+def get_spot_grid(instruction, nrows=8, ncols=12):
+
+    """Returns the candidate spot centres (candx, candy, as lists) and the tile dimensions (dx, dy) for one line of Colonyzer.txt, as colonyzer SetUp"""
+
+    tlx, tly, brx, bry = instruction[1:5]
+    xdimf = float(abs(brx-tlx))/float(ncols-1)
+    ydimf = float(abs(bry-tly))/float(nrows-1)
+    xstart = max(0, round_py2(float(tlx)-0.5*xdimf))
+    ystart = max(0, round_py2(float(tly)-0.5*ydimf))
+
+    candx, candy = [], []
+    for row in range(nrows):
+        for col in range(ncols):
+            candy.append(round_py2(ystart+ydimf/2.0+float(row)*ydimf))
+            candx.append(round_py2(xstart+xdimf/2.0+float(col)*xdimf))
+
+    return candx, candy, round_py2(xdimf), round_py2(ydimf)
+
+def open_image(image):
+
+    """Returns the RGB array (uint8) and the grayscale array (float, as PIL 'F') of image"""
+
+    im = PIL_Image.open(image).convert("RGB")
+    return np.array(im, dtype=np.uint8), np.array(im.convert("F"), dtype=float)
+
+def get_arrays_w_appended_arrays(rgb, arr, rgb_appended, arr_appended):
+
+    """Returns the RGB and grayscale arrays of an image with another image appended on the right (the missing rows are black), as the images of app_functions.generates_image_w_appended_image_on_the_right"""
+
+    shape = (max(arr.shape[0], arr_appended.shape[0]), arr.shape[1]+arr_appended.shape[1])
+    rgb_all = np.zeros(shape+(3,), dtype=np.uint8)
+    arr_all = np.zeros(shape, dtype=float)
+
+    for a, a_all in [(rgb, rgb_all), (arr, arr_all)]: a_all[0:a.shape[0], 0:a.shape[1]] = a
+    for a, a_all in [(rgb_appended, rgb_all), (arr_appended, arr_all)]: a_all[0:a.shape[0], arr.shape[1]:] = a
+
+    return rgb_all, arr_all
+
+def get_mquantile(arr, p):
+
+    """Returns the p quantile of arr, as scipy.stats.mstats.mquantiles (alphap=betap=0.4)"""
+
+    values = arr.ravel()
+    n = len(values)
+    aleph = n*p + 0.4 + p*(1-0.4-0.4)
+    k = int(math.floor(min(max(aleph, 1), n-1)))
+    gamma = min(max(aleph-k, 0), 1)
+    lower, upper = np.partition(values, [k-1, k])[[k-1, k]]
+
+    return (1.0-gamma)*lower + gamma*upper
+
+def get_edges(arr, cutoff):
+
+    """Returns a boolean array with the edges (sobel above the cutoff quantile) of a 2D array, as colonyzer getEdges"""
+
+    sobel = np.hypot(ndimage.sobel(arr, axis=0), ndimage.sobel(arr, axis=1))
+    return np.logical_and(sobel>=get_mquantile(sobel, cutoff), sobel>0)
+
+def get_edge_fill(arr, slopefill=0.9):
+
+    """Returns the mask of the spots of a 2D array, as colonyzer edgeFill2"""
+
+    edges = get_edges(arr, slopefill)
+    edge_map = np.logical_and(ndimage.binary_dilation(ndimage.binary_erosion(edges, iterations=2), iterations=4), edges)
+    return ndimage.binary_fill_holes(edge_map)
+
+def get_located_cultures(candx, candy, dx, dy, arr, maxupdates=5, fuzzy=0.01):
+
+    """Takes the top-left corners of each tile (candx, candy) and moves them towards the centre of mass of each tile, as colonyzer locateCultures. Returns the x and y of the centre of each spot (arrays)"""
+
+    def measure(pos):
+        cy0, cx0 = max(0, pos[0]), max(0, pos[1])
+        tile = arr[cy0:min(cy0+dy, arr.shape[0]-1), cx0:min(cx0+dx, arr.shape[1]-1)]
+        com = ndimage.center_of_mass(tile)
+        if sum(np.isnan(com))>0: com = (dy/2.0, dx/2.0)
+        cy = min(max(0, round_py2(cy0+com[0]-dy/2.0)), arr.shape[0]-1)
+        cx = min(max(0, round_py2(cx0+com[1]-dx/2.0)), arr.shape[1]-1)
+        if tile.size<=0: edge_brightness = 99999999999
+        else: edge_brightness = np.mean(np.concatenate((tile[0,:], tile[-1,:], tile[1:-1,0], tile[1:-1,-1])))
+        return (pos, (cy, cx), edge_brightness, tile.sum())
+
+    def update_location(pos):
+        res = [measure(pos)]
+        new = measure(res[-1][1])
+        while new!=res[-1] and len(res)<=maxupdates:
+            res.append(new)
+            new = measure(res[-1][1])
+
+        edge_min = min([r[2] for r in res])
+        res_sort = [r for r in res if (r[2]<=(1+fuzzy)*edge_min and np.linalg.norm(np.array(r[0])-np.array(r[1]))<=max(dx,dy)/2.0)]
+        if len(res_sort)>0 and res_sort[-1][3]<2*res[0][3]: return res_sort[-1][0]
+        return pos
+
+    positions = [update_location(p) for p in zip(candy, candx)]
+    return np.array([p[1]+dx/2.0 for p in positions]), np.array([p[0]+dy/2.0 for p in positions])
+
+def get_otsu_threshold(values):
+
+    """Returns the otsu threshold of a uint8 array, as cv2.threshold with THRESH_OTSU"""
+
+    hist = np.bincount(values.ravel(), minlength=256).astype(float)/values.size
+    mu = np.sum(np.arange(256)*hist)
+    q1, mu1, max_sigma, max_val = 0.0, 0.0, 0.0, 0
+    epsilon = np.finfo(np.float32).eps
+
+    for i in range(256):
+        p_i = hist[i]
+        q1_next = q1 + p_i
+        q2 = 1.0 - q1_next
+        if min(q1_next, q2)<epsilon or max(q1_next, q2)>1.0-epsilon:
+            q1 = q1_next
+            continue
+        mu1 = (mu1*q1 + i*p_i)/q1_next
+        mu2 = (mu - q1_next*mu1)/q2
+        q1 = q1_next
+        sigma = q1*q2*(mu1-mu2)**2
+        if sigma>max_sigma: max_sigma, max_val = sigma, i
+
+    return float(max_val)
+
+def get_tile_measurements(arr, rgb, thresh_mask, edges, x, y, diameter):
+
+    """Returns a dict with the measurements of colonyzer (sizeSpots and getColours) for each spot of one image, as arrays"""
+
+    # define the pixels of each tile (the tiles that are clipped by the image have less pixels)
+    rad = int(math.ceil(diameter/2.0))
+    rows = np.array([round_py2(yi-rad) for yi in y])[:,None] + np.arange(2*rad+1)[None,:]
+    cols = np.array([round_py2(xi-rad) for xi in x])[:,None] + np.arange(2*rad+1)[None,:]
+    valid = ((rows>=0) & (rows<arr.shape[0]))[:,:,None] & ((cols>=0) & (cols<arr.shape[1]))[:,None,:]
+    rows_idx, cols_idx = np.clip(rows, 0, arr.shape[0]-1), np.clip(cols, 0, arr.shape[1]-1)
+
+    tile = arr[rows_idx[:,:,None], cols_idx[:,None,:]]
+    tile_thresh = thresh_mask[rows_idx[:,:,None], cols_idx[:,None,:]] & valid
+    tile_background = ~thresh_mask[rows_idx[:,:,None], cols_idx[:,None,:]] & valid
+    tile_edges = edges[rows_idx[:,:,None], cols_idx[:,None,:]] & valid
+    size = valid.sum(axis=(1,2)).astype(float)
+
+    # sizes and intensities
+    area = tile_thresh.sum(axis=(1,2))
+    perimeter = tile_edges.sum(axis=(1,2))
+    n_thresh = tile_thresh.sum(axis=(1,2))
+    n_background = tile_background.sum(axis=(1,2))
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        thresh_values = np.where(tile_thresh, tile, np.nan).reshape(len(x), -1)/255.0
+        background_values = np.where(tile_background, tile, np.nan).reshape(len(x), -1)/255.0
+
+        measurements = {"Intensity" : np.maximum(0, np.where(valid, tile, 0).sum(axis=(1,2))/(size*255.0)),
+                        "Area" : np.maximum(0, area/size),
+                        "Trimmed" : np.maximum(0, np.where(n_thresh>1, np.where(tile_thresh, tile, 0).sum(axis=(1,2))/(size*255.0), 0)),
+                        "FeatureMedian" : np.where(n_thresh>1, np.nanmedian(thresh_values, axis=1), 0),
+                        "FeatureVariance" : np.where(n_thresh>1, np.nanvar(thresh_values, axis=1), 0),
+                        "BackgroundMedian" : np.where(n_background>1, np.nanmedian(background_values, axis=1), 0),
+                        "Circularity" : np.where(perimeter>0, 4*math.pi*area/np.maximum(perimeter, 1)**2, 0),
+                        "Perimeter" : perimeter/size}
+
+        # colonyzer takes the colours from the diagonal of each tile (only the pixels within the image, as the tile)
+        valid_diagonal = (rows>=0) & (rows<arr.shape[0]) & (cols>=0) & (cols<arr.shape[1])
+        diagonal_thresh = thresh_mask[rows_idx, cols_idx]
+        for I, colour in enumerate(["red", "green", "blue"]):
+            diagonal = rgb[rows_idx, cols_idx, I].astype(float)
+            for suffix, mask in [("", diagonal_thresh & valid_diagonal), ("Back", ~diagonal_thresh & valid_diagonal)]:
+                values = np.where(mask, diagonal, np.nan)
+                measurements["%sMean%s"%(colour, suffix)] = np.nanmean(values, axis=1)
+                measurements["%sMedian%s"%(colour, suffix)] = np.nanmedian(values, axis=1)
+
+    return measurements
+
+def run_native_quantification(images_dir, images, parms_colonyzer, reference_image=None, slopefill=0.9, nrows=8, ncols=12):
+
+    """Writes <images_dir>/Output_Data/<image>.out and .dat for each image (files in images_dir), as 'colonyzer --initpos --fmt 96' with the parameters of parms_colonyzer (any of native_parms_colonyzer, passed as --<parm>). The spots are located with <images_dir>/Colonyzer.txt. If reference_image is provided, it is appended on the right of each image (in memory), as colonyzer does on the merged images of --reference_plate"""
+
+    # check the parameters
+    strange_parms = set(parms_colonyzer).difference(native_parms_colonyzer)
+    if len(strange_parms)>0: raise ValueError("The native quantification engine can't be used with the colonyzer parameters %s"%strange_parms)
+
+    # as in colonyzer, the lighting differences between images (diffims) are only corrected with the lighting correction (lc)
+    lighting_correction = "lc" in parms_colonyzer
+    correct_image_differences = lighting_correction and "diffims" in parms_colonyzer
+
+    # define the function to open the images, which appends the reference image (decoded once)
+    if reference_image is None: open_image_plate = open_image
+    else:
+        rgb_ref, arr_ref = open_image(reference_image)
+        def open_image_plate(image): return get_arrays_w_appended_arrays(*open_image(image), rgb_ref, arr_ref)
+
+    # colonyzer takes the latest image to locate spots and threshold, and the earliest for the lighting correction
+    images = sorted(images, reverse=True)
+    latest_image, earliest_image = images[0], images[-1]
+    rgbN, arrN = open_image_plate("%s/%s"%(images_dir, latest_image))
+    if latest_image==earliest_image: arr0, arrloc = arrN, arrN
+    else:
+        arr0 = open_image_plate("%s/%s"%(images_dir, earliest_image))[1]
+        arrloc = arrN - arr0
+
+    # locate the spots
+    instructions = get_colonyzer_instructions("%s/Colonyzer.txt"%images_dir)
+    if latest_image in instructions: candx, candy, dx, dy = get_spot_grid(instructions[latest_image], nrows=nrows, ncols=ncols)
+    else: candx, candy, dx, dy = get_spot_grid(instructions["default"], nrows=nrows, ncols=ncols)
+    x, y = get_located_cultures([round_py2(cx-dx/2.0) for cx in candx], [round_py2(cy-dy/2.0) for cy in candy], dx, dy, arrloc)
+    diameter = min(dx, dy)
+
+    # define the grid, and the agar to correct the lighting differences between images
+    grid = np.zeros(arrN.shape, dtype=bool)
+    grid[round_py2(min(y-dy/2)):round_py2(max(y+dy/2)), round_py2(min(x-dx/2)):round_py2(max(x+dx/2))] = True
+    if correct_image_differences is True:
+        agar = np.logical_and(grid, ~get_edge_fill(arrN, slopefill=slopefill))
+        ave0 = np.mean(arr0[agar])
+
+    # get the threshold from the latest image
+    if lighting_correction is True: pseudoempty = arr0
+    else: pseudoempty = 0
+    thresh = get_otsu_threshold(np.array(np.round(np.maximum((arrN-pseudoempty)[grid], 0)), dtype=np.uint8)) - 15
+
+    # measure each image
+    outdir_data = "%s/Output_Data"%images_dir
+    if not os.path.isdir(outdir_data): os.mkdir(outdir_data)
+    cols_grid, rows_grid = np.meshgrid(np.arange(1, ncols+1), np.arange(1, nrows+1))
+
+    for image in images:
+
+        rgb, arr = open_image_plate("%s/%s"%(images_dir, image))
+        if correct_image_differences is True: arr = np.maximum(0, np.minimum(255, arr-(np.mean(arr[agar])-ave0)))
+        arr = np.maximum(arr-pseudoempty, 0)
+        thresh_mask = np.logical_and(grid, arr>=thresh)
+
+        measurements = get_tile_measurements(arr, rgb, thresh_mask, get_edges(arr, 0.925), x, y, diameter)
+
+        # write the .out file
+        image_name = image.split(".")[0]
+        df_out = pd.DataFrame({"Row":rows_grid.flatten(), "Column":cols_grid.flatten(), "y":y, "x":x, "Diameter":diameter})
+        for k, v in measurements.items(): df_out[k] = v
+        df_out["Barcode"] = image[0:-24]
+        df_out["Filename"] = image_name
+        df_out.to_csv("%s/%s.out"%(outdir_data, image_name), sep="\t", index=False)
+
+        # write the .dat file
+        df_dat = pd.DataFrame({"FILENAME" : image_name, "ROW" : df_out.Row, "COLUMN" : df_out.Column, "TOPLEFTX" : x-diameter/2.0, "TOPLEFTY" : y-diameter/2.0,
+                               "WHITEAREA" : measurements["Area"]*dx*dy*255.0, "TRIMMED" : measurements["Trimmed"]*dx*dy*255.0, "THRESHOLD" : thresh, "INTENSITY" : measurements["Intensity"]*dx*dy*255.0,
+                               "EDGEPIXELS" : measurements["FeatureMedian"], "COLR" : measurements["redMedian"], "COLG" : measurements["greenMedian"], "COLB" : measurements["blueMedian"],
+                               "BKR" : measurements["redMedianBack"], "BKG" : measurements["greenMedianBack"], "BKB" : measurements["blueMedianBack"], "EDGELEN" : measurements["Perimeter"], "XDIM" : dx, "YDIM" : dy})
+
+        df_dat[["FILENAME", "ROW", "COLUMN", "TOPLEFTX", "TOPLEFTY", "WHITEAREA", "TRIMMED", "THRESHOLD", "INTENSITY", "EDGEPIXELS", "COLR", "COLG", "COLB", "BKR", "BKG", "BKB", "EDGELEN", "XDIM", "YDIM"]].to_csv("%s/%s.dat"%(outdir_data, image_name), sep="\t", index=False, header=False)
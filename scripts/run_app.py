@@ -19,6 +19,10 @@ ImagesDir = "/images"
 # import the functions
 sys.path.insert(0, ScriptsDir)
 import app_functions as fun
+import fs_functions as fs_fun
+
+# create all files and folders accessible for all users
+fs_fun.set_permissive_umask()
 
 # log
 #fun.print_with_runtime("running %s %s"%(fun.PipelineName, os.environ["MODULE"]))
@@ -26,9 +30,24 @@ import app_functions as fun
 # define the colonyzer parameters
 fun.parms_colonyzer = tuple(sorted(os.environ["PARMS_COLONYZER"].split(",")))
 
+# define if the artifact cache is used (it needs the cache dir)
+fun.use_artifact_cache = (os.environ["artifact_cache"]=="True" and os.path.isdir(fun.CacheDir))
+
+# define the engine that quantifies the spots of the fitness measurements (the checks of the coordinates need the plots of colonyzer)
+if os.environ["MODULE"]=="get_fitness_measurements": fun.quantification_engine = os.environ["quantification_engine"]
+
+# define the engine that fits the growth curves
+if os.environ["MODULE"]=="get_fitness_measurements": fun.fitting_engine = os.environ["fitting_engine"]
+
+# define if colonyzer only renders the plots of the latest image in the fitness measurements
+if os.environ["MODULE"]=="get_fitness_measurements": fun.lazy_colonyzer_plots = (os.environ["lazy_colonyzer_plots"]=="True")
+
 # get the start time
 start_time = time.time()
 
+# start one command broker for each conda env, used by fun.run_cmd
+fun.start_command_brokers()
+
 ################################
 
 ######### TEST ENV ########
@@ -50,21 +69,28 @@ elif len(reference_plate.split("-"))==2 and reference_plate.split("-")[1].starts
 else: raise ValueError("The argument passed to --reference_plate (%s) should have the format <plate_batch>-plate<plateID>. For example 'SC1-plate1'."%reference_plate)
 
 # process images
-if os.environ["MODULE"]=="analyze_images_process_images": fun.run_analyze_images_process_images("%s/plate_layout.xlsx"%SmallInputs, ImagesDir, OutDir, bool_dict[str(os.environ["enhance_image_contrast"])], reference_plate, str(os.environ["contrast_enhancement_image"]))
+if os.environ["MODULE"]=="analyze_images_process_images": fun.run_analyze_images_process_images("%s/plate_layout.xlsx"%SmallInputs, ImagesDir, OutDir, bool_dict[str(os.environ["enhance_image_contrast"])], reference_plate, str(os.environ["contrast_enhancement_image"]), str(os.environ["image_engine"]), bool_dict[str(os.environ["concurrent_batches"])], bool_dict[str(os.environ["fused_image_pipeline"])], bool_dict[str(os.environ["keep_processed_images"])], int(os.environ["global_histogram_pixel_stride"]), min_image_age_seconds=int(os.environ["min_image_age_seconds"]), reduced_inputs_compression=str(os.environ["reduced_inputs_compression"]))
+
+# process the new images in --follow mode
+elif os.environ["MODULE"]=="analyze_images_follow_new_images": fun.run_analyze_images_follow_new_images("%s/plate_layout.xlsx"%SmallInputs, ImagesDir, OutDir, bool_dict[str(os.environ["enhance_image_contrast"])], str(os.environ["contrast_enhancement_image"]), str(os.environ["image_engine"]), float(os.environ["hours_experiment"]), int(os.environ["min_image_age_seconds"]))
 
 # perform growth measurements for one image
-elif os.environ["MODULE"]=="analyze_images_run_colonyzer_subset_images": fun.run_analyze_images_run_colonyzer_subset_images(OutDir, reference_plate)
+elif os.environ["MODULE"]=="analyze_images_run_colonyzer_subset_images": 
+
+    # the plates can be checked one at a time (with -e subset_plate=<plate_batch>_plate<plate>), as their coordinates are set
+    if "subset_plate" in os.environ: fun.run_analyze_images_run_colonyzer_subset_images(OutDir, reference_plate, plates=[os.environ["subset_plate"]])
+    else: fun.run_analyze_images_run_colonyzer_subset_images(OutDir, reference_plate)
 
 # perform fitness measurements
-elif os.environ["MODULE"]=="get_fitness_measurements": fun.run_analyze_images_get_fitness_measurements("%s/plate_layout.xlsx"%SmallInputs, ImagesDir, OutDir, float(os.environ["min_nAUC_to_beConsideredGrowing"]), reference_plate, float(os.environ["hours_experiment"]))
+elif os.environ["MODULE"]=="get_fitness_measurements": fun.run_analyze_images_get_fitness_measurements("%s/plate_layout.xlsx"%SmallInputs, ImagesDir, OutDir, float(os.environ["min_nAUC_to_beConsideredGrowing"]), reference_plate, float(os.environ["hours_experiment"]), bool_dict[str(os.environ["parallel_colonyzer_timepoints"])], generate_bad_spot_images=not bool_dict[str(os.environ["auto_accept"])])
 
 # final tables and plots
 elif os.environ["MODULE"]=="get_rel_fitness_and_susceptibility_measurements": fun.run_analyze_images_get_rel_fitness_and_susceptibility_measurements("%s/plate_layout.xlsx"%SmallInputs, ImagesDir, OutDir, bool_dict[str(os.environ["KEEP_TMP_FILES"])], float(os.environ["min_nAUC_to_beConsideredGrowing"]), float(os.environ["hours_experiment"]))
 
 else: raise ValueError("The module is incorrect")
 
-# set permissions to be accessible in all cases
-fun.run_cmd("chmod -R 777 %s"%OutDir)
+# set permissions to be accessible in all cases. The files in CacheDir are created with the umask of 0, and the artifacts are changed as they are saved (save_artifact)
+fs_fun.chmod_recursive(OutDir)
 
 ###############
 
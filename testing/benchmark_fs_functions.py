@@ -0,0 +1,75 @@
+# This is a python script to compare the per-file cost of linking, removing and giving permissions through shell commands (as run_cmd did) and through fs_functions.
+
+# for testing run python benchmark_fs_functions.py <nfiles> (default 1000). Run it inside the docker image (with /opt/conda) to include the activation of the conda env in the shell commands, as in run_cmd.
+
+# imports
+import os, sys, time, tempfile, shutil
+
+# define the current directory
+CurDir = os.path.dirname(os.path.realpath(__file__))
+
+# import the fs functions
+sys.path.insert(0, '%s/../scripts'%CurDir)
+import fs_functions as fs_fun
+
+# get args
+if len(sys.argv)>1: nfiles = int(sys.argv[1])
+else: nfiles = 1000
+
+# define the shell prefix, as in run_cmd (only if conda is available)
+CondaDir = "/opt/conda"
+if os.path.isfile("%s/etc/profile.d/conda.sh"%CondaDir): cmd_prefix = "source %s/etc/profile.d/conda.sh > /dev/null 2>&1 && conda activate main_env > /dev/null 2>&1 && "%CondaDir
+else:
+    print("WARNING: %s not found, so that the shell commands do not activate a conda env (the real cost of run_cmd is higher)"%CondaDir)
+    cmd_prefix = ""
+
+def run_shell(cmd):
+
+    """Runs cmd through a bash script, as run_cmd does"""
+
+    bash_script = "%s/cmd.sh"%tmpdir
+    open(bash_script, "w").write(cmd_prefix + cmd + "\n")
+    out_stat = os.system("bash %s"%bash_script)
+    if out_stat!=0: raise ValueError("%s did not finish correctly"%cmd)
+    os.system("rm %s"%bash_script)
+
+# create the origin files
+tmpdir = tempfile.mkdtemp(prefix="benchmark_fs_functions_")
+origin_dir = "%s/origin"%tmpdir; os.mkdir(origin_dir)
+origin_files = ["%s/img_%i.tif"%(origin_dir, I) for I in range(nfiles)]
+for f in origin_files: open(f, "w").write("image")
+
+# define the functions of each approach
+approach_to_functions = {"shell" : {"link" : lambda o, t: run_shell("ln -s %s %s > /dev/null 2>&1"%(o, t)),
+                                    "remove" : lambda t: run_shell("rm %s > /dev/null 2>&1"%t),
+                                    "chmod" : lambda d: run_shell("chmod -R 777 %s"%d)},
+
+                         "fs_functions" : {"link" : fs_fun.soft_link_file,
+                                           "remove" : fs_fun.remove_file,
+                                           "chmod" : fs_fun.chmod_recursive}}
+
+# run each approach
+print("Running with %i files..."%nfiles)
+for approach, functions in approach_to_functions.items():
+
+    links_dir = "%s/links_%s"%(tmpdir, approach); os.mkdir(links_dir)
+    links = ["%s/%s"%(links_dir, os.path.basename(f)) for f in origin_files]
+
+    start_time = time.time()
+    for o, t in zip(origin_files, links): functions["link"](o, t)
+    time_link = time.time() - start_time
+    if not all([os.path.islink(t) for t in links]): raise ValueError("The %s links were not created"%approach)
+
+    start_time = time.time()
+    functions["chmod"](origin_dir)
+    time_chmod = time.time() - start_time
+
+    start_time = time.time()
+    for t in links: functions["remove"](t)
+    time_remove = time.time() - start_time
+    if any([os.path.lexists(t) for t in links]): raise ValueError("The %s links were not removed"%approach)
+
+    print("%s: %.3f ms/file to link, %.3f ms/file to remove, %.3f ms for chmod of the %i files"%(approach, 1000*time_link/nfiles, 1000*time_remove/nfiles, 1000*time_chmod, nfiles))
+
+# clean
+shutil.rmtree(tmpdir)
@@ -0,0 +1,100 @@
+# This is a python script to compare the cost of building the qfa inputs (all_images_data.dat, ExptDescription.txt, LibraryDescriptions.txt and ORF2GENE.txt) of one plate with appends of one row (or file) at a time, as the pipeline did before, and with app_functions.write_qfa_input_files. It also checks that both write the same files.
+
+# for testing run python benchmark_qfa_inputs.py <ntimepoints> (default 300). It simulates the colonyzer Output_Data of a 96-spot plate with <ntimepoints> images.
+
+# imports
+import os, sys, time, tempfile, shutil, filecmp
+import numpy as np
+import pandas as pd
+
+# define the current directory
+CurDir = os.path.dirname(os.path.realpath(__file__))
+
+# import the functions
+sys.path.insert(0, '%s/../scripts'%CurDir)
+import app_functions as fun
+
+# get args
+if len(sys.argv)>1: ntimepoints = int(sys.argv[1])
+else: ntimepoints = 300
+
+def write_qfa_input_files_appends(data_path, outdir_parms, df_plate_layout, plate_batch, plate):
+
+    """Writes the qfa inputs as the pipeline did before write_qfa_input_files (pd.concat of one df stands for the removed DataFrame.append)"""
+
+    append = lambda df1, df2: pd.concat([df1, df2])
+
+    all_df = pd.DataFrame()
+    for f in [x for x in os.listdir(data_path) if x.endswith(".dat")]:
+        df = pd.read_csv("%s/%s"%(data_path, f), sep="\t", header=None)
+        all_df = append(all_df, df)
+
+    all_df[0] = fun.get_barcode_for_filenames(all_df[0])
+    all_df = all_df.sort_values(by=[0,1,2])
+
+    def change_NaN_to_str(cell):
+        if pd.isna(cell): return "NA"
+        else: return cell
+
+    try: all_df = all_df.applymap(change_NaN_to_str)
+    except AttributeError: all_df = all_df.map(change_NaN_to_str)
+    all_df.to_csv("%s/all_images_data.dat"%outdir_parms, sep="\t", index=False, header=False)
+
+    df_plate_layout = df_plate_layout[(df_plate_layout.plate_batch==plate_batch) & (df_plate_layout.plate==plate)].set_index(["row", "column"])
+    drug = df_plate_layout.drug.iloc[0]
+    concentration = df_plate_layout.concentration.iloc[0]
+
+    exp_df = pd.DataFrame()
+    for I, plateBarcode in enumerate(set([x.split("-")[0] for x in all_df[0]])):
+        startTime = min(all_df[all_df[0].apply(lambda x: x.startswith(plateBarcode))][0].apply(lambda y: "-".join(y.split("-")[1:])))
+        dict_data = {"Barcode":plateBarcode, "Start.Time":startTime, "Treatment": plate_batch, "Medium":"[%s]=%s"%(drug, concentration) ,"Screen":"screen", "Library":"strain", "Plate": plate, "RepQuad":1}
+        exp_df = append(exp_df, pd.DataFrame({k: {I+1 : v} for k, v in dict_data.items()}))
+
+    exp_df.to_csv("%s/ExptDescription.txt"%outdir_parms, sep="\t", index=False, header=True)
+
+    lib_df = pd.DataFrame()
+    for barcode, plateID in exp_df[["Barcode", "Plate"]].values:
+        for row in range(1, 9):
+            for col in range(1, 13):
+                strain = df_plate_layout.loc[(row, col), "strain"]
+                dict_data = {"Library":"strain", "ORF":strain, "Plate":plateID, "Row":row, "Column":col, "Notes":""}
+                lib_df = append(lib_df, pd.DataFrame({k: {plateID : v} for k, v in dict_data.items()}))
+
+    lib_df.to_csv("%s/LibraryDescriptions.txt"%outdir_parms, sep="\t", index=False, header=True)
+
+    orf_to_gene_df = pd.DataFrame({0:list(df_plate_layout.strain), 1:list(df_plate_layout.strain)})
+    orf_to_gene_df.to_csv("%s/ORF2GENE.txt"%outdir_parms, sep="\t", index=False, header=False)
+
+# simulate the Output_Data of one plate, with one image every 15 minutes. The background of the spots without growth is NaN, as in empty plates
+tmpdir = tempfile.mkdtemp(prefix="benchmark_qfa_inputs_")
+data_path = "%s/Output_Data"%tmpdir; os.mkdir(data_path)
+rng = np.random.RandomState(0)
+start = pd.Timestamp("2023-01-01 10:00")
+for I in range(ntimepoints):
+    image_name = "img_0_%s"%((start + pd.Timedelta(minutes=15*I)).strftime("%Y%m%d_%H%M"))
+    rows = []
+    for row in range(1, 9):
+        for col in range(1, 13):
+            growing = (col!=12 and I>0)
+            bk = rng.uniform(20, 40, 3).round(6) if growing else [np.nan]*3
+            rows.append([image_name, row, col, 50*col, 50*row, rng.randint(0, 2000) if growing else 0, rng.uniform(0, 1e5) if growing else 0.0, 0.3, 0.5, 10, 50.5, 60.5, 70.5] + list(bk) + [20, 45, 45])
+    pd.DataFrame(rows).to_csv("%s/%s.dat"%(data_path, image_name), sep="\t", index=False, header=False, na_rep="NA")
+
+df_plate_layout = pd.DataFrame([{"plate_batch":"SC1", "plate":1, "row":row, "column":col, "strain":"strain%i"%((row*12+col)%10), "drug":"FLZ", "concentration":0.0} for row in range(1, 9) for col in range(1, 13)])
+
+# run each approach
+print("Building the qfa inputs of one plate with %i timepoints..."%ntimepoints)
+approach_to_outdir = {}
+for approach, write_function in [("appends", write_qfa_input_files_appends), ("write_qfa_input_files", fun.write_qfa_input_files)]:
+    outdir_parms = "%s/%s"%(tmpdir, approach); os.mkdir(outdir_parms)
+    start_time = time.time()
+    write_function(data_path, outdir_parms, df_plate_layout, "SC1", 1)
+    print("%s: %.3f seconds"%(approach, time.time()-start_time))
+    approach_to_outdir[approach] = outdir_parms
+
+# check that the files are the same
+for f in ["all_images_data.dat", "ExptDescription.txt", "LibraryDescriptions.txt", "ORF2GENE.txt"]:
+    if not filecmp.cmp("%s/%s"%(approach_to_outdir["appends"], f), "%s/%s"%(approach_to_outdir["write_qfa_input_files"], f), shallow=False): raise ValueError("%s is different between the approaches"%f)
+
+print("Both approaches write the same files")
+shutil.rmtree(tmpdir)
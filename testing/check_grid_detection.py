@@ -0,0 +1,93 @@
+# This is a python script to check grid_detection.get_grid_coordinates (--automatic_coordinates) and grid_detection.get_grid_fit (--scanner_profiles) on synthetic plates. It draws 96-spot plates of several sizes (with the plate border, a gradient of illumination and noise), and checks that the detected A1 and H12 are close to the drawn ones and that the confidence of these clean grids is high. The fit starts from the drawn grid moved by a tenth of a pitch, and a grid moved by one row should not fit. It also checks that images without a grid get a low confidence.
+
+# for testing run python check_grid_detection.py [<number of plates>] (default 10). It raises an error if any check fails.
+
+# imports
+import os, sys, tempfile, shutil
+import numpy as np
+from PIL import Image as PIL_Image
+
+# define the current directory
+CurDir = os.path.dirname(os.path.realpath(__file__))
+
+# import the functions
+sys.path.insert(0, '%s/../scripts'%CurDir)
+import grid_detection as grid_det
+
+# get args
+if len(sys.argv)>1: nplates = int(sys.argv[1])
+else: nplates = 10
+
+# define the thresholds of the checks
+min_confidence_clean_grid = 0.9 # well above the default --automatic_coordinates_min_confidence (0.8)
+max_error_pitch_fraction = 0.1 # maximum distance between the detected and the drawn A1 (or H12), as a fraction of the pitch
+max_confidence_no_grid = 0.5
+
+def generate_synthetic_plate(image_file, width, pitch, spot_radius, rng, nrows=8, ncols=12):
+
+    """Writes a grayscale image_file with a 96-spot plate, and returns the (x, y) of the A1 and H12 spots"""
+
+    height = int(width*0.7)
+    A1 = ((width-(ncols-1)*pitch)/2 + rng.uniform(-pitch/3, pitch/3), (height-(nrows-1)*pitch)/2 + rng.uniform(-pitch/3, pitch/3))
+    H12 = (A1[0]+(ncols-1)*pitch, A1[1]+(nrows-1)*pitch)
+    yy, xx = np.mgrid[0:height, 0:width]
+
+    # the agar is brighter than the scanner, and there is a gradient of illumination and noise
+    arr = np.full((height, width), 30.0)
+    arr[(xx>A1[0]-0.9*pitch) & (xx<H12[0]+0.9*pitch) & (yy>A1[1]-0.9*pitch) & (yy<H12[1]+0.9*pitch)] = 90.0
+    arr += np.linspace(0, 20, width)[None,:] + rng.normal(0, 3, (height, width))
+
+    # draw the spots, with some variation in size and intensity
+    for row in range(nrows):
+        for col in range(ncols):
+            spot = ((xx-(A1[0]+col*pitch))**2 + (yy-(A1[1]+row*pitch))**2)<(spot_radius*rng.uniform(0.8, 1.1))**2
+            arr[spot] = rng.uniform(170, 230)
+
+    PIL_Image.fromarray(np.clip(arr, 0, 255).astype(np.uint8)).save(image_file)
+    return A1, H12
+
+# check the synthetic plates
+tmpdir = tempfile.mkdtemp(prefix="check_grid_detection_")
+rng = np.random.RandomState(0)
+errors = []
+print("plate\twidth\tpitch\tconfidence\terror_A1\terror_H12\tconfidence_fit\terror_fit")
+for I in range(nplates):
+
+    width = rng.randint(1000, 2600)
+    pitch = rng.uniform(0.055, 0.07)*width
+    image_file = "%s/plate%i.tif"%(tmpdir, I)
+    A1, H12 = generate_synthetic_plate(image_file, width, pitch, rng.uniform(0.3, 0.4)*pitch, rng)
+
+    A1_detected, H12_detected, confidence = grid_det.get_grid_coordinates(image_file)
+    if A1_detected is None:
+        errors.append("plate%i: no grid detected"%I)
+        continue
+
+    error_A1 = np.hypot(A1_detected[0]-A1[0], A1_detected[1]-A1[1])/pitch
+    error_H12 = np.hypot(H12_detected[0]-H12[0], H12_detected[1]-H12[1])/pitch
+
+    # fit the grid of a previous run, moved by a tenth of a pitch
+    A1_fit, H12_fit, confidence_fit = grid_det.get_grid_fit(image_file, (int(A1[0]+0.1*pitch), int(A1[1]-0.1*pitch)), (int(H12[0]+0.1*pitch), int(H12[1]-0.1*pitch)))
+    if A1_fit is None: error_fit = np.inf
+    else: error_fit = max(np.hypot(A1_fit[0]-A1[0], A1_fit[1]-A1[1]), np.hypot(H12_fit[0]-H12[0], H12_fit[1]-H12[1]))/pitch
+    print("plate%i\t%i\t%.1f\t%.3f\t%.3f\t%.3f\t%.3f\t%.3f"%(I, width, pitch, confidence, error_A1, error_H12, confidence_fit, error_fit))
+
+    if confidence<min_confidence_clean_grid: errors.append("plate%i: the confidence is %.3f"%(I, confidence))
+    if max(error_A1, error_H12)>max_error_pitch_fraction: errors.append("plate%i: the coordinates are %.3f pitches away"%(I, max(error_A1, error_H12)))
+    if confidence_fit<min_confidence_clean_grid: errors.append("plate%i: the confidence of the fit is %.3f"%(I, confidence_fit))
+    if error_fit>max_error_pitch_fraction: errors.append("plate%i: the fitted coordinates are %.3f pitches away"%(I, error_fit))
+
+    # a grid moved by one row should not fit
+    confidence_fit_shifted = grid_det.get_grid_fit(image_file, (int(A1[0]), int(A1[1]+pitch)), (int(H12[0]), int(H12[1]+pitch)))[2]
+    if confidence_fit_shifted>max_confidence_no_grid: errors.append("plate%i: the grid moved by one row fits with a confidence of %.3f"%(I, confidence_fit_shifted))
+
+# check an image without spots
+image_file = "%s/no_grid.tif"%tmpdir
+PIL_Image.fromarray(np.clip(rng.normal(90, 10, (1000, 1400)), 0, 255).astype(np.uint8)).save(image_file)
+confidence_no_grid = grid_det.get_grid_coordinates(image_file)[2]
+print("no_grid\t1400\t-\t%.3f\t-\t-"%confidence_no_grid)
+if confidence_no_grid>max_confidence_no_grid: errors.append("no_grid: the confidence is %.3f"%confidence_no_grid)
+
+shutil.rmtree(tmpdir)
+if len(errors)>0: raise ValueError("The grid detection failed some checks:\n%s"%("\n".join(errors)))
+print("The grid detection passed all checks")
@@ -0,0 +1,79 @@
+# This is a python script to compare the growth fits of --fitting_engine numpy with those of qfa (get_fitness_measurements.R). It re-fits each plate of a run with qfa (from the inputs kept in <output>/tmp/growth_calculations/<plate>/output_<parms>) with logistic_fitting.py, and reports the differences of each field of logRegression_fits.tbl and processed_all_data.tbl (all_images_data.tab).
+
+# for testing run python compare_fitting_engines.py <output dir of a Q-PHAST run with qfa> <hours_experiment> [<relative tolerance>] (default 0.05). It writes <output dir>/fitting_engines_tolerance_report.tsv, with one row for each field, and the fraction of spots within the tolerance.
+
+# imports
+import os, sys, time, tempfile, shutil
+import numpy as np
+import pandas as pd
+
+# define the current directory
+CurDir = os.path.dirname(os.path.realpath(__file__))
+
+# import the fitting functions
+sys.path.insert(0, '%s/../scripts'%CurDir)
+import logistic_fitting as log_fit
+
+# get args
+output_dir = os.path.realpath(sys.argv[1])
+days_experiment = float(sys.argv[2])/24
+if len(sys.argv)>3: rtol = float(sys.argv[3])
+else: rtol = 0.05
+
+# define the fields to compare
+fields_fits = ["K", "r", "g", "objval", "d0", "nAUC", "nSTP", "nr", "nr_t", "maxslp", "maxslp_t", "MDR", "MDP", "MDRMDP", "glog_maxslp", "DT", "AUC", "rsquare", "DT_h"]
+fields_data = ["Expt.Time", "Timeseries.order", "x", "y", "Diameter", "Growth"]
+
+def get_df_differences(df_qfa, df_numpy, fields, merge_fields, plate_name, type_data):
+
+    """Returns a df with the absolute and relative differences of each field in fields, for each row of df_qfa and df_numpy (merged on merge_fields)"""
+
+    df = df_qfa[merge_fields + fields].merge(df_numpy[merge_fields + fields], on=merge_fields, how="inner", validate="one_to_one", suffixes=("_qfa", "_numpy"))
+    if len(df)!=len(df_qfa): raise ValueError("The spots of qfa and numpy should be the same in %s"%plate_name)
+
+    dfs = []
+    for f in fields:
+        qfa_vals = df["%s_qfa"%f].astype(float).values
+        numpy_vals = df["%s_numpy"%f].astype(float).values
+        with np.errstate(divide="ignore", invalid="ignore"):
+            abs_diff = np.abs(qfa_vals - numpy_vals)
+            rel_diff = abs_diff/np.abs(qfa_vals)
+        equal = (qfa_vals==numpy_vals) | (pd.isna(qfa_vals) & pd.isna(numpy_vals))
+        abs_diff[equal], rel_diff[equal] = 0.0, 0.0
+        dfs.append(pd.DataFrame({"plate":plate_name, "type_data":type_data, "field":f, "abs_diff":abs_diff, "rel_diff":rel_diff}))
+
+    return pd.concat(dfs)
+
+# go through each plate
+growth_calculations_dir = "%s/tmp/growth_calculations"%output_dir
+tmpdir = tempfile.mkdtemp(prefix="compare_fitting_engines_")
+dfs_differences = []
+time_numpy = 0.0
+for plate_name in sorted(os.listdir(growth_calculations_dir)):
+    for outdir_name in [x for x in os.listdir("%s/%s"%(growth_calculations_dir, plate_name)) if x.startswith("output_")]:
+        qfa_dir = "%s/%s/%s"%(growth_calculations_dir, plate_name, outdir_name)
+        if not os.path.isfile("%s/logRegression_fits.tbl"%qfa_dir): continue
+        print("Comparing %s..."%plate_name)
+
+        # run the numpy engine on a copy of the inputs of qfa
+        numpy_dir = "%s/%s"%(tmpdir, plate_name); os.mkdir(numpy_dir)
+        for f in ["all_images_data.dat", "ExptDescription.txt", "LibraryDescriptions.txt"]: shutil.copyfile("%s/%s"%(qfa_dir, f), "%s/%s"%(numpy_dir, f))
+        start_time = time.time()
+        log_fit.run_fitness_measurements(numpy_dir, days_experiment)
+        time_numpy += time.time() - start_time
+
+        # compare
+        dfs_differences.append(get_df_differences(pd.read_csv("%s/logRegression_fits.tbl"%qfa_dir, sep="\t"), pd.read_csv("%s/logRegression_fits.tbl"%numpy_dir, sep="\t"), fields_fits, ["Barcode", "Row", "Column"], plate_name, "fits"))
+        dfs_differences.append(get_df_differences(pd.read_csv("%s/all_images_data.tab"%qfa_dir, sep="\t"), pd.read_csv("%s/processed_all_data.tbl"%numpy_dir, sep="\t"), fields_data, ["Barcode", "Row", "Column", "Date.Time"], plate_name, "growth_data"))
+
+shutil.rmtree(tmpdir)
+if len(dfs_differences)==0: raise ValueError("There are no plates fit with qfa in %s"%growth_calculations_dir)
+
+# summarize each field across all plates
+df_differences = pd.concat(dfs_differences)
+df_report = df_differences.groupby(["type_data", "field"]).agg(n_spots=("rel_diff", "size"), median_rel_diff=("rel_diff", "median"), p95_rel_diff=("rel_diff", lambda x: np.percentile(x, 95)), max_rel_diff=("rel_diff", "max"), max_abs_diff=("abs_diff", "max"), fraction_within_tolerance=("rel_diff", lambda x: np.mean(x<=rtol))).reset_index()
+
+report_file = "%s/fitting_engines_tolerance_report.tsv"%output_dir
+df_report.to_csv(report_file, sep="\t", index=False, header=True)
+print(df_report.to_string(index=False))
+print("The numpy engine took %.2f seconds for all plates. Fields with all spots within a relative tolerance of %s: %i/%i. The report is in %s"%(time_numpy, rtol, sum(df_report.fraction_within_tolerance==1), len(df_report), report_file))
@@ -1,6 +1,6 @@
 # This is a python script to test that all the subsets testing work
 
-# for testing run python testing_script.py out_in_desktop  keep_tmp # auto, skip_enhance_image_contrast
+# for testing run python testing_script.py out_in_desktop  keep_tmp # auto, skip_enhance_image_contrast, compare_image_engines, compare_parallel_colonyzer, compare_quantification_engines, compare_grid_detection
 
 # imports
 import os, sys, platform
@@ -23,7 +23,7 @@ import main_functions as fun
 # get args
 if len(sys.argv)>1: all_args = set(sys.argv[1:])
 else: all_args = set()
-strange_args = all_args.difference({"out_in_desktop", "auto", "keep_tmp", "sudo", "skip_enhance_image_contrast"})
+strange_args = all_args.difference({"out_in_desktop", "auto", "keep_tmp", "sudo", "skip_enhance_image_contrast", "compare_image_engines", "compare_parallel_colonyzer", "compare_quantification_engines", "compare_grid_detection"})
 if len(strange_args): raise ValueError("invalid args: %s"%strange_args)
 
 # define the python executable
@@ -34,9 +34,177 @@ print("Running python with '%s ...'"%python_exec)
 # define the OS
 running_os = {"Darwin":"mac", "Linux":"linux", "Windows":"windows"}[platform.system()]
 
+# define the subsets
+test_subsets = ["AST_48h_subset", "Classic_spottest_subset", "Fitness_only_subset", "Stress_plates_subset"]
+
+def run_subset_once(test_dir, output_name, extra_args):
+
+    """Runs main.py on the input of test_dir with extra_args, writing into <test_dir>/<output_name>, unless it already finished. Returns the output dir"""
+
+    output_dir = "%s%s%s"%(test_dir, os_sep, output_name)
+    finish_file = "%s%sfinished.txt"%(output_dir, os_sep)
+
+    if fun.file_is_empty(finish_file):
+        cmd = "%s %s --os %s --input %s%sinput --docker_image mikischikora/q-phast:v1 --output %s %s"%(python_exec, main_script, running_os, test_dir, os_sep, output_dir, extra_args)
+        fun.run_cmd(cmd)     
+        open(finish_file, "w").write("finished")
+
+    return output_dir
+
+# test that the 'numpy' image engine generates the same processed images as 'imagej' (step 1 only)
+if "compare_image_engines" in all_args:
+
+    import numpy as np
+    from PIL import Image as PIL_Image
+
+    print("Comparing the processed images of the 'numpy' and 'imagej' image engines...")
+    for d in test_subsets:
+
+        print("testing %s..."%d)
+        test_dir = "%s%s%s"%(CurDir, os_sep, d)
+
+        # define enhance_image_contrast
+        if "skip_enhance_image_contrast" in all_args: enhance_image_contrast = "False"
+        else: enhance_image_contrast = "True"
+
+        # run step 1 with each engine
+        engine_to_processed_images_dir = {}
+        for image_engine in ["imagej", "numpy"]:
+
+            output_dir = run_subset_once(test_dir, "output_image_engine_%s"%image_engine, "--enhance_image_contrast %s --image_engine %s --break_after step1"%(enhance_image_contrast, image_engine))
+            engine_to_processed_images_dir[image_engine] = "%s%stmp%sprocessed_images"%(output_dir, os_sep, os_sep)
+
+        # compare the pixels of each processed image
+        for plate_batch in sorted(os.listdir(engine_to_processed_images_dir["imagej"])):
+            for img in sorted(os.listdir("%s%s%s"%(engine_to_processed_images_dir["imagej"], os_sep, plate_batch))):
+
+                imagej_array, numpy_array = [np.asarray(PIL_Image.open("%s%s%s%s%s"%(engine_to_processed_images_dir[e], os_sep, plate_batch, os_sep, img)).convert("RGB"), dtype=int) for e in ["imagej", "numpy"]]
+                if imagej_array.shape!=numpy_array.shape: raise ValueError("For %s/%s the imagej image has shape %s and the numpy one %s"%(plate_batch, img, imagej_array.shape, numpy_array.shape))
+
+                max_diff = np.max(np.abs(imagej_array - numpy_array))
+                if max_diff>0: raise ValueError("For %s/%s the numpy image is different from the imagej one (max pixel difference %i, %.4f%s of different pixels)"%(plate_batch, img, max_diff, 100*np.mean(imagej_array!=numpy_array), "%"))
+
+    print("\n\nSUCCESS!! The 'numpy' image engine generates the same images as 'imagej'.")
+    sys.exit(0)
+
+# test that --parallel_colonyzer_timepoints generates the same colonyzer data (all_images_data.dat of each plate)
+if "compare_parallel_colonyzer" in all_args:
+
+    print("Comparing the colonyzer outputs with and without --parallel_colonyzer_timepoints...")
+    for d in test_subsets:
+
+        print("testing %s..."%d)
+        test_dir = "%s%s%s"%(CurDir, os_sep, d)
+
+        # run with each mode, keeping the tmp files
+        mode_to_growth_calculations_dir = {}
+        for mode, extra_args in [("sequential", ""), ("parallel", " --parallel_colonyzer_timepoints")]:
+
+            output_dir = run_subset_once(test_dir, "output_colonyzer_%s"%mode, "--min_nAUC_to_beConsideredGrowing 0.02 --hours_experiment 24.0 --auto_accept --coords_1st_plate --keep_tmp_files%s"%extra_args)
+            mode_to_growth_calculations_dir[mode] = "%s%stmp%sgrowth_calculations"%(output_dir, os_sep, os_sep)
+
+        # compare the data of each plate
+        for plate_dir in sorted(os.listdir(mode_to_growth_calculations_dir["sequential"])):
+            for outdir_parms in sorted([x for x in os.listdir("%s%s%s"%(mode_to_growth_calculations_dir["sequential"], os_sep, plate_dir)) if x.startswith("output_") and not x.endswith("_streaming")]):
+
+                sequential_lines, parallel_lines = [open("%s%s%s%s%s%sall_images_data.dat"%(mode_to_growth_calculations_dir[m], os_sep, plate_dir, os_sep, outdir_parms, os_sep), "r").readlines() for m in ["sequential", "parallel"]]
+                if sequential_lines!=parallel_lines: raise ValueError("For %s/%s the all_images_data.dat is different with --parallel_colonyzer_timepoints"%(plate_dir, outdir_parms))
+
+    print("\n\nSUCCESS!! --parallel_colonyzer_timepoints generates the same colonyzer data.")
+    sys.exit(0)
+
+# report the agreement of the 'native' quantification engine with colonyzer (the .dat file of each image)
+if "compare_quantification_engines" in all_args:
+
+    import numpy as np
+    import pandas as pd
+
+    print("Comparing the data of the 'native' and 'colonyzer' quantification engines...")
+    dat_fields = ["FILENAME", "ROW", "COLUMN", "TOPLEFTX", "TOPLEFTY", "WHITEAREA", "TRIMMED", "THRESHOLD", "INTENSITY", "EDGEPIXELS", "COLR", "COLG", "COLB", "BKR", "BKG", "BKB", "EDGELEN", "XDIM", "YDIM"]
+    report_rows = []
+    for d in test_subsets:
+
+        print("testing %s..."%d)
+        test_dir = "%s%s%s"%(CurDir, os_sep, d)
+
+        # run with each engine, keeping the tmp files
+        engine_to_growth_calculations_dir = {}
+        for engine in ["colonyzer", "native"]:
+
+            output_dir = run_subset_once(test_dir, "output_quantification_engine_%s"%engine, "--min_nAUC_to_beConsideredGrowing 0.02 --hours_experiment 24.0 --parms_colonyzer lc,diffims --auto_accept --coords_1st_plate --keep_tmp_files --quantification_engine %s"%engine)
+            engine_to_growth_calculations_dir[engine] = "%s%stmp%sgrowth_calculations"%(output_dir, os_sep, os_sep)
+
+        # compare each field of the .dat files of each plate
+        for plate_dir in sorted(os.listdir(engine_to_growth_calculations_dir["colonyzer"])):
+
+            engine_to_df = {}
+            for engine in ["colonyzer", "native"]:
+                data_dir = "%s%s%s%soutput_diffims_lc%sOutput_Data"%(engine_to_growth_calculations_dir[engine], os_sep, plate_dir, os_sep, os_sep)
+                engine_to_df[engine] = pd.concat([pd.read_csv("%s%s%s"%(data_dir, os_sep, f), sep="\t", header=None, names=dat_fields) for f in os.listdir(data_dir) if f.endswith(".dat")]).sort_values(by=["FILENAME", "ROW", "COLUMN"]).reset_index(drop=True)
+
+            if len(engine_to_df["colonyzer"])!=len(engine_to_df["native"]) or (engine_to_df["colonyzer"][["FILENAME", "ROW", "COLUMN"]]!=engine_to_df["native"][["FILENAME", "ROW", "COLUMN"]]).any().any(): raise ValueError("The native engine analyzes different spots than colonyzer in %s/%s"%(d, plate_dir))
+
+            for field in dat_fields[3:]:
+                colonyzer_values, native_values = engine_to_df["colonyzer"][field].values.astype(float), engine_to_df["native"][field].values.astype(float)
+                equal_values = np.isclose(colonyzer_values, native_values, rtol=1e-6, atol=1e-9, equal_nan=True)
+                report_rows.append({"subset":d, "plate":plate_dir, "field":field, "n_values":len(colonyzer_values), "fraction_equal":np.mean(equal_values), "max_abs_difference":np.nanmax(np.abs(colonyzer_values-native_values)) if not all(np.isnan(colonyzer_values-native_values)) else 0.0})
+
+    # write the report
+    report_file = "%s%squantification_engines_agreement.tsv"%(CurDir, os_sep)
+    df_report = pd.DataFrame(report_rows)[["subset", "plate", "field", "n_values", "fraction_equal", "max_abs_difference"]]
+    df_report.to_csv(report_file, sep="\t", index=False, header=True)
+    print("The agreement report is in %s"%report_file)
+
+    # the 'native' engine can only be used if all values are equal
+    df_different = df_report[df_report.fraction_equal<1]
+    if len(df_different)>0: raise ValueError("The native engine differs from colonyzer in %i plate-field combinations. These are the fields with differences:\n%s"%(len(df_different), df_different.groupby("field").fraction_equal.min()))
+
+    print("\n\nSUCCESS!! The 'native' quantification engine generates the same data as colonyzer.")
+    sys.exit(0)
+
+# report the grid detected in each plate (--automatic_coordinates), and the distance to the coordinates of a previous run of this script with keep_tmp (in output_Q-PHAST), if any
+if "compare_grid_detection" in all_args:
+
+    import time
+    import pandas as pd
+    import grid_detection as grid_det
+
+    print("Detecting the grid of spots in each plate...")
+    report_rows = []
+    for d in test_subsets:
+
+        print("testing %s..."%d)
+        test_dir = "%s%s%s"%(CurDir, os_sep, d)
+
+        # get the processed images of each plate (step 1)
+        output_dir = run_subset_once(test_dir, "output_grid_detection", "--min_nAUC_to_beConsideredGrowing 0.02 --hours_experiment 24.0 --keep_tmp_files --break_after step1")
+
+        # detect the grid of each plate
+        processed_images_dir_each_plate = "%s%stmp%sprocessed_images_each_plate"%(output_dir, os_sep, os_sep)
+        for plate_dir in sorted([x for x in os.listdir(processed_images_dir_each_plate) if not x.startswith(".")]):
+
+            sorted_images = sorted([f for f in os.listdir("%s%s%s"%(processed_images_dir_each_plate, os_sep, plate_dir)) if not f.startswith(".") and f not in {"Colonyzer.txt.tmp", "Colonyzer.txt"}], key=fun.get_yyyymmddhhmm_tuple_one_image_name)
+            start_time = time.time()
+            A1, H12, confidence = grid_det.get_grid_coordinates("%s%s%s%s%s"%(processed_images_dir_each_plate, os_sep, plate_dir, os_sep, sorted_images[-1]))
+            row = {"subset":d, "plate":plate_dir, "confidence":confidence, "seconds":time.time()-start_time, "A1":A1, "H12":H12, "max_distance_pixels":None}
+
+            # compare to the coordinates of the previous run
+            previous_coords_file = "%s%soutput_Q-PHAST%stmp%sprocessed_images_each_plate%s%s%sColonyzer.txt"%(test_dir, os_sep, os_sep, os_sep, os_sep, plate_dir, os_sep)
+            if not fun.file_is_empty(previous_coords_file) and A1 is not None:
+                previous_coords = [int(x) for x in open(previous_coords_file, "r").readlines()[3].strip().split(",")[2:6]]
+                row["max_distance_pixels"] = max([abs(x-y) for x, y in zip(previous_coords, list(A1)+list(H12))])
+
+            report_rows.append(row)
+
+    # write the report
+    report_file = "%s%sgrid_detection.tsv"%(CurDir, os_sep)
+    pd.DataFrame(report_rows)[["subset", "plate", "confidence", "seconds", "A1", "H12", "max_distance_pixels"]].to_csv(report_file, sep="\t", index=False, header=True)
+    print("The report of the grid detection is in %s"%report_file)
+    sys.exit(0)
+
 # test each of the samples that should work
 print("Testing four different types of data...")
-for d in ["AST_48h_subset", "Classic_spottest_subset", "Fitness_only_subset", "Stress_plates_subset"]:
+for d in test_subsets:
 #for d in ["AST_48h_subset"]:
 
     print("testing %s..."%d)